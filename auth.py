@@ -9,119 +9,190 @@ import os
 import sys
 import asyncio
 from pathlib import Path
-from telethon import TelegramClient
-from dotenv import load_dotenv
+from typing import TYPE_CHECKING, Optional
 
-# Load environment variables
-load_dotenv()
+from utils.env_file import load_env
 
-API_ID = os.getenv("API_ID")
-API_HASH = os.getenv("API_HASH")
+if TYPE_CHECKING:
+    from telethon import TelegramClient
+
+# Load environment variables with the same .env parser the bot uses
+load_env(Path(__file__).parent / ".env")
+
+_env = os.environ
+
+# Cast once at load time; a non-numeric value is reported like a missing one
+try:
+    API_ID = int(_env["API_ID"])
+except (KeyError, ValueError):
+    API_ID = None
+
+try:
+    API_HASH = _env["API_HASH"]
+except KeyError:
+    API_HASH = None
 
 # Session configuration
 SESSIONS_DIR = "sessions"
 SESSION_NAME = "system_session"
-SESSION_PATH = os.path.join(SESSIONS_DIR, SESSION_NAME)
+_SESSIONS = Path(SESSIONS_DIR)
+SESSION_PATH = _SESSIONS / SESSION_NAME
+SESSION_FILE = _SESSIONS / f"{SESSION_NAME}.session"
+
+
+class SessionManager:
+    """Async context manager that owns one reusable Telethon client"""
+
+    def __init__(self, session_path: Path = SESSION_PATH):
+        self.session_path = session_path
+        self._client: Optional["TelegramClient"] = None
+
+    async def __aenter__(self) -> "TelegramClient":
+        # Client is created once and reused on subsequent entries
+        if self._client is None:
+            # Telethon is imported only when a client is actually needed
+            from telethon import TelegramClient
+
+            self._client = TelegramClient(
+                os.fspath(self.session_path),
+                API_ID,
+                API_HASH
+            )
+        if not self._client.is_connected():
+            await self._client.connect()
+        return self._client
+
+    async def __aexit__(self, *exc_info):
+        await self._client.disconnect()
+
+
+_BAR = "=" * 60
+
+
+def _pause(message: str):
+    """Wait for Enter only in an interactive terminal (CI/systemd would block)"""
+    if sys.stdin.isatty():
+        input(message)
+
+
+def _write(*chunks: bytes):
+    """Write pre-encoded blocks straight to the binary stdout in one go"""
+    sys.stdout.flush()  # keep order with text already written via print()
+    sys.stdout.buffer.writelines(chunks)
+    sys.stdout.buffer.flush()
+
+
+# Static console blocks, pre-encoded once so no text-layer encoding per write
+_BANNER = f"""{_BAR}
+       NeuroScraper Pro - Session Authorization Tool
+{_BAR}
+
+""".encode()
+
+_MISSING_ENV_TEXT = """
+Please create .env file and add:
+API_ID=your_api_id
+API_HASH=your_api_hash
+
+Get API_ID and API_HASH here:
+https://my.telegram.org/apps
+
+""".encode()
+
+_START_TEXT = f"""{_BAR}
+STARTING AUTHORIZATION
+{_BAR}
+
+Telethon will ask you for:
+1. Phone number (format: +7XXXXXXXXXX)
+2. Confirmation code (will be sent to Telegram)
+3. 2FA password (if you have two-factor authentication enabled)
+
+Get ready to enter your data...
+
+Connecting to Telegram...
+
+""".encode()
+
+_ERROR_HINTS = """
+Possible causes:
+  - Invalid API_ID or API_HASH
+  - Invalid phone number
+  - Invalid confirmation code
+  - Internet connection problems
+
+""".encode()
 
 
 async def authorize():
     """Async authorization function"""
-    print("=" * 60)
-    print("       NeuroScraper Pro - Session Authorization Tool")
-    print("=" * 60)
-    print()
+    _write(_BANNER)
 
     # Validate environment variables
-    if not API_ID or not API_HASH:
-        print("ERROR: API_ID or API_HASH not found in .env file!")
-        print()
-        print("Please create .env file and add:")
-        print("API_ID=your_api_id")
-        print("API_HASH=your_api_hash")
-        print()
-        print("Get API_ID and API_HASH here:")
-        print("https://my.telegram.org/apps")
-        print()
-        input("Press Enter to exit...")
+    missing = [key for key, value in (("API_ID", API_ID), ("API_HASH", API_HASH)) if not value]
+    if missing:
+        sys.stdout.write(f"ERROR: {', '.join(missing)} not found in .env file!\n")
+        _write(_MISSING_ENV_TEXT)
+        _pause("Press Enter to exit...")
         sys.exit(1)
 
     # Create sessions directory if it doesn't exist
-    Path(SESSIONS_DIR).mkdir(parents=True, exist_ok=True)
-    print(f"[OK] Directory '{SESSIONS_DIR}' checked/created")
-    print()
+    _SESSIONS.mkdir(parents=True, exist_ok=True)
+    sys.stdout.write(f"[OK] Directory '{SESSIONS_DIR}' checked/created\n\n")
 
     # Check if session already exists
-    if os.path.exists(f"{SESSION_PATH}.session"):
-        print(f"WARNING: Session already exists: {SESSION_PATH}.session")
-        print()
+    if SESSION_FILE.exists():
+        sys.stdout.write(f"WARNING: Session already exists: {SESSION_FILE}\n\n")
         response = input("Do you want to create a new session? (yes/no): ").strip().lower()
         if response not in ["yes", "y", "da"]:
             print("Operation cancelled.")
-            input("Press Enter to exit...")
+            _pause("Press Enter to exit...")
             sys.exit(0)
         print()
 
-    print("=" * 60)
-    print("STARTING AUTHORIZATION")
-    print("=" * 60)
-    print()
-    print("Telethon will ask you for:")
-    print("1. Phone number (format: +7XXXXXXXXXX)")
-    print("2. Confirmation code (will be sent to Telegram)")
-    print("3. 2FA password (if you have two-factor authentication enabled)")
-    print()
-    print("Get ready to enter your data...")
-    print()
+    _write(_START_TEXT)
 
     try:
-        # Create Telethon client
-        client = TelegramClient(
-            SESSION_PATH,
-            int(API_ID),
-            API_HASH
-        )
-
-        print("Connecting to Telegram...")
-        print()
-
-        # Start client - this will prompt for phone, code, and password
-        await client.start()
-
-        print()
-        print("=" * 60)
-        print("SUCCESS! SESSION CREATED!")
-        print("=" * 60)
-        print()
-        print(f"Session file: {SESSION_PATH}.session")
-        print()
-        print("Now you can run the main bot:")
-        print("  - Double click on run_bot.bat")
-        print("  - Or command: python main.py")
-        print()
-
-        # Disconnect client
-        await client.disconnect()
+        # Client is connected on enter and disconnected on exit
+        async with SessionManager() as client:
+            # Start client - this will prompt for phone, code, and password
+            await client.start()
+
+            sys.stdout.write("\n".join([
+                "",
+                _BAR,
+                "SUCCESS! SESSION CREATED!",
+                _BAR,
+                "",
+                f"Session file: {SESSION_FILE}",
+                "",
+                "Now you can run the main bot:",
+                "  - Double click on run_bot.bat",
+                "  - Or command: python main.py",
+                "",
+                "",
+            ]))
 
     except KeyboardInterrupt:
-        print()
-        print("Authorization interrupted by user")
+        sys.stdout.write("\nAuthorization interrupted by user\n")
         sys.exit(1)
     except Exception as e:
-        print()
-        print(f"ERROR during authorization: {e}")
-        print()
-        print("Possible causes:")
-        print("  - Invalid API_ID or API_HASH")
-        print("  - Invalid phone number")
-        print("  - Invalid confirmation code")
-        print("  - Internet connection problems")
-        print()
-        input("Press Enter to exit...")
+        sys.stdout.write(f"\nERROR during authorization: {e}\n")
+        _write(_ERROR_HINTS)
+        _pause("Press Enter to exit...")
         sys.exit(1)
 
 
 def main():
     """Main entry point"""
+    # uvloop is optional and POSIX-only; Windows keeps the default Proactor loop
+    if sys.platform != "win32":
+        try:
+            import uvloop
+            uvloop.install()
+        except ImportError:
+            pass
+
     try:
         # Run async authorization
         asyncio.run(authorize())
@@ -130,7 +201,7 @@ def main():
         print("Operation cancelled")
         sys.exit(1)
     finally:
-        input("Press Enter to exit...")
+        _pause("Press Enter to exit...")
 
 
 if __name__ == "__main__":
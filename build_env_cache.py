@@ -0,0 +1,45 @@
+"""
+Env Cache Build Script for NeuroScraper Pro
+Compiles .env into a pickled snapshot (.env.cache)
+
+config.py loads the snapshot instead of re-parsing .env while the cache
+is not older than .env. Re-run this script after editing .env.
+"""
+
+import os
+import pickle
+from pathlib import Path
+
+from utils.env_file import parse_env
+
+BASE_DIR = Path(__file__).parent
+ENV_FILE = BASE_DIR / ".env"
+ENV_CACHE_FILE = BASE_DIR / ".env.cache"
+
+
+def build_env_cache() -> int:
+    """Распарсить .env и сохранить значения в .env.cache"""
+    # Тот же разбор, что у config.py: кэш и прямое чтение .env дают одинаковые значения
+    values = parse_env(ENV_FILE)
+
+    # Пишем во временный файл и атомарно подменяем, чтобы бот не прочитал половину кэша
+    tmp_path = ENV_CACHE_FILE.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(values, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, ENV_CACHE_FILE)
+
+    return len(values)
+
+
+def main():
+    """Main entry point"""
+    if not ENV_FILE.exists():
+        print(f"ERROR: {ENV_FILE} not found!")
+        raise SystemExit(1)
+
+    count = build_env_cache()
+    print(f"[OK] {count} variables cached to {ENV_CACHE_FILE}")
+
+
+if __name__ == "__main__":
+    main()
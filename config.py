@@ -4,39 +4,135 @@ Loads environment variables and provides application settings
 """
 
 import os
+import time
+import pickle
+import functools
+from datetime import datetime, timedelta, timezone
+from dataclasses import dataclass, field
 from pathlib import Path
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+from utils.env_file import load_env
 
 # Base directory
 BASE_DIR = Path(__file__).parent
 
-# Telegram Bot Configuration
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN не найден в переменных окружения")
+# Скомпилированный снимок .env (см. build_env_cache.py)
+ENV_FILE = BASE_DIR / ".env"
+ENV_CACHE_FILE = BASE_DIR / ".env.cache"
+
+
+def _load_env_cache() -> bool:
+    """Загрузить переменные из .env.cache, если кэш не старее .env"""
+    try:
+        if ENV_CACHE_FILE.stat().st_mtime < ENV_FILE.stat().st_mtime:
+            return False
+        with open(ENV_CACHE_FILE, "rb") as f:
+            data = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return False
+
+    # Как и load_env(), не перезаписываем уже заданные переменные
+    for key, value in data.items():
+        os.environ.setdefault(key, value)
+    return True
+
+
+# Load environment variables
+if not _load_env_cache():
+    load_env(ENV_FILE)
+
+# Снимок окружения: каждая переменная читается один раз при импорте
+_ENV = os.environ.copy()
+
+
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
+# Необязательный config.json; переменные окружения имеют приоритет над ним
+CONFIG_FILE = BASE_DIR / "config.json"
+
+# Значения по умолчанию (ключ = поле Settings, в окружении - то же имя в верхнем регистре)
+_SETTINGS_DEFAULTS = {
+    "bot_token": "",
+    "admin_id": 1831192124,
+    "api_id": 0,
+    "api_hash": "",
+    "support_link": "https://t.me/NeuroCash_Support_Bot",
+    "database_path": "database.db",
+    "sessions_dir": "sessions",
+    "scratch_chat_id": 0,
+}
 
-# Admin Configuration
-ADMIN_ID = int(os.getenv("ADMIN_ID", "1831192124"))
 
-# Telethon API Credentials
-API_ID = int(os.getenv("API_ID", "0"))
-API_HASH = os.getenv("API_HASH", "")
+@dataclass(slots=True, frozen=True)
+class Settings:
+    """Настройки приложения из окружения и config.json (создаются один раз при импорте)"""
+    bot_token: str = field(repr=False)  # Секреты не попадают в логи через repr()
+    admin_id: int
+    api_id: int
+    api_hash: str = field(repr=False)
+    support_link: str
+    database_path: Path
+    sessions_dir: Path
+    scratch_chat_id: int  # Чат для подготовки фото-рассылок (0 - чат админа)
 
-if not API_ID or not API_HASH:
-    raise ValueError("API_ID и API_HASH должны быть установлены в переменных окружения")
+    def __post_init__(self):
+        # Приводим типы: значения из окружения приходят строками
+        object.__setattr__(self, "admin_id", int(self.admin_id))
+        object.__setattr__(self, "api_id", int(self.api_id or 0))
+        object.__setattr__(self, "scratch_chat_id", int(self.scratch_chat_id or 0) or self.admin_id)
+        object.__setattr__(self, "database_path", BASE_DIR / self.database_path)
+        object.__setattr__(self, "sessions_dir", BASE_DIR / self.sessions_dir)
 
-# Support Link
-SUPPORT_LINK = os.getenv("SUPPORT_LINK", "https://t.me/NeuroCash_Support_Bot")
+        if not self.bot_token:
+            raise ValueError("BOT_TOKEN не найден в переменных окружения")
+        if not self.api_id or not self.api_hash:
+            raise ValueError("API_ID и API_HASH должны быть установлены в переменных окружения")
 
-# Database Configuration
-DATABASE_PATH = BASE_DIR / os.getenv("DATABASE_PATH", "database.db")
+    @classmethod
+    def load(cls, path: Path = CONFIG_FILE) -> "Settings":
+        """Собрать настройки: умолчания -> config.json -> переменные окружения"""
+        values = dict(_SETTINGS_DEFAULTS)
 
-# Session Storage
-SESSIONS_DIR = BASE_DIR / os.getenv("SESSIONS_DIR", "sessions")
-SESSIONS_DIR.mkdir(exist_ok=True)
+        try:
+            file_values = _json.loads(path.read_bytes())
+        except FileNotFoundError:
+            file_values = {}
+        values.update((key, value) for key, value in file_values.items() if key in values)
+
+        # Один lookup на ключ: отсутствие переменной - обычный KeyError
+        for key in values:
+            try:
+                values[key] = _ENV[key.upper()]
+            except KeyError:
+                pass
+
+        return cls(**values)
+
+
+CFG = Settings.load()
+
+# Module-level aliases for backward compatibility
+BOT_TOKEN = CFG.bot_token
+ADMIN_ID = CFG.admin_id
+API_ID = CFG.api_id
+API_HASH = CFG.api_hash
+SUPPORT_LINK = CFG.support_link
+DATABASE_PATH = CFG.database_path
+DATABASE_PATH_STR = os.fspath(DATABASE_PATH)  # sqlite3/aiosqlite принимают str без __fspath__
+SCRATCH_CHAT_ID = CFG.scratch_chat_id
+
+# Session Storage (директория создаётся при первом обращении через sessions_dir())
+SESSIONS_DIR = CFG.sessions_dir
+
+
+@functools.cache
+def sessions_dir() -> Path:
+    """Директория сессий; создаётся один раз при первой записи"""
+    SESSIONS_DIR.mkdir(exist_ok=True)
+    return SESSIONS_DIR
 
 # User Limits
 FREE_PARSING_LIMIT = 3  # Бесплатных парсингов для новых пользователей
@@ -54,10 +150,22 @@ TIME_FILTERS = {
     "3months": 90
 }
 
+
+@functools.lru_cache(maxsize=8)
+def _cutoff_date(days: int, minute_bucket: int) -> datetime:
+    return datetime.fromtimestamp(minute_bucket * 60, timezone.utc) - timedelta(days=days)
+
+
+def cutoff_for(days: int) -> datetime:
+    """Граница временного фильтра (UTC), пересчитывается не чаще раза в минуту"""
+    return _cutoff_date(days, int(time.time() // 60))
+
 # Telethon Client Settings
 DEVICE_MODEL = "Desktop"
 SYSTEM_VERSION = "Windows 10"
 APP_VERSION = "1.0"
+# Одновременных Telethon-операций из хэндлеров (вход, вступление в чат): каждая держит клиент
+TELETHON_CONCURRENCY = 8
 
 # System session (for admin/public parsing)
 SYSTEM_SESSION_NAME = "system_session"
@@ -3,32 +3,247 @@ Database module for NeuroScraper Pro Bot
 Manages user data, parsing limits, and session tracking
 """
 
+import os
 import aiosqlite
 import logging
 import shutil
 import asyncio
-from typing import Optional, Dict, Any
-from datetime import datetime
+import itertools
+import time
+from typing import Optional, Dict, Any, AsyncIterator, Iterable, Tuple
+from datetime import datetime, timezone
 from pathlib import Path
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
 
 import config
 
 logger = logging.getLogger(__name__)
 
+# ===== SQL горячего пути =====
+# sqlite3 кэширует скомпилированные запросы на соединение по тексту SQL.
+# Соединения теперь долгоживущие, поэтому каждый частый запрос задан ровно
+# одной строкой-константой: без f-строк и вариаций пробелов, иначе кэш промахивается.
+
+_SQL_GET_USER = "SELECT * FROM users WHERE user_id = ?"
+_SQL_CREATE_USER = (
+    "INSERT INTO users (user_id, username, first_name, last_name, referrer_id) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+_SQL_INSERT_USER_IF_NEW = (
+    "INSERT INTO users (user_id, username, first_name, last_name, referrer_id) "
+    "VALUES (?, ?, ?, ?, ?) ON CONFLICT(user_id) DO NOTHING"
+)
+_SQL_TOUCH_USER = (
+    "UPDATE users SET last_activity = CURRENT_TIMESTAMP, username = ? WHERE user_id = ?"
+)
+_SQL_GRANT_REFERRAL_BONUS = "UPDATE users SET parsing_count = MAX(0, parsing_count - ?) WHERE user_id = ?"
+_SQL_MARK_REFERRAL_BONUS = "UPDATE users SET referral_bonus_given = 1 WHERE user_id = ?"
+_SQL_UPDATE_ACTIVITY = "UPDATE users SET last_activity = ? WHERE user_id = ?"
+_SQL_TRY_CONSUME = (
+    "UPDATE users "
+    "SET parsing_count = parsing_count + (CASE WHEN is_premium = 1 THEN 0 ELSE 1 END), "
+    "last_activity = CURRENT_TIMESTAMP "
+    "WHERE user_id = ? AND (is_premium = 1 OR parsing_count < ?) "
+    "RETURNING parsing_count, is_premium"
+)
+_SQL_GET_USER_SESSIONS = "SELECT * FROM user_sessions WHERE user_id = ? AND is_active = 1"
+# session_name уникален - поиск идёт по его индексу
+_SQL_GET_SESSION_BY_NAME = (
+    "SELECT * FROM user_sessions WHERE session_name = ? AND user_id = ? AND is_active = 1"
+)
+_SQL_ADD_PARSING_HISTORY = (
+    "INSERT INTO parsing_history "
+    "(user_id, target_link, parse_type, time_filter, users_found, admins_found) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+_SQL_GET_SETTINGS = "SELECT key, value FROM bot_settings"
+_SQL_GET_SUBSCRIPTION = "SELECT subscription_verified FROM users WHERE user_id = ?"
+_SQL_SET_SUBSCRIPTION = "UPDATE users SET subscription_verified = ? WHERE user_id = ?"
+_SQL_GET_REFERRALS_COUNT = "SELECT referrals_count FROM users WHERE user_id = ?"
+_SQL_INCREMENT_REFERRALS = "UPDATE users SET referrals_count = referrals_count + 1 WHERE user_id = ?"
+# Список ID передаётся одним JSON-параметром: текст запроса не зависит от длины списка
+_SQL_GET_USERS_BULK = (
+    "SELECT user_id, username FROM users "
+    "WHERE user_id IN (SELECT value FROM json_each(?))"
+)
+_SQL_GET_STATS = "SELECT key, value FROM stats_counters"
+_SQL_BROADCAST_TARGETS_PAGE = (
+    "SELECT user_id FROM broadcast_targets "
+    "WHERE job_id = ? AND status = 'pending' AND user_id > ? ORDER BY user_id LIMIT ?"
+)
+_SQL_SET_BROADCAST_STATUS = "UPDATE broadcast_targets SET status = ? WHERE job_id = ? AND user_id = ?"
+
+# ===== Схема =====
+# Только идемпотентные CREATE ... IF NOT EXISTS и засев счётчиков: init_db выполняет
+# всё одним executescript. Условные ALTER для старых баз - в Database._migrate
+_SCHEMA_SQL = """
+BEGIN IMMEDIATE;
+
+-- Users table
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    parsing_count INTEGER DEFAULT 0,
+    is_premium BOOLEAN DEFAULT 0,
+    referrer_id INTEGER DEFAULT NULL,
+    referral_bonus_given BOOLEAN DEFAULT 0,
+    registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    subscription_verified BOOLEAN DEFAULT 0,
+    referrals_count INTEGER DEFAULT 0
+);
+
+-- User sessions table (for Telethon accounts)
+CREATE TABLE IF NOT EXISTS user_sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    phone_number TEXT NOT NULL,
+    session_name TEXT NOT NULL UNIQUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_active BOOLEAN DEFAULT 1,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
+-- Parsing history table
+CREATE TABLE IF NOT EXISTS parsing_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    target_link TEXT NOT NULL,
+    parse_type TEXT NOT NULL,
+    time_filter TEXT,
+    users_found INTEGER DEFAULT 0,
+    admins_found INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
+-- Bot admins table (для управления админами бота)
+CREATE TABLE IF NOT EXISTS bot_admins (
+    user_id INTEGER PRIMARY KEY,
+    added_by INTEGER,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Bot settings table (for global flags like access control)
+CREATE TABLE IF NOT EXISTS bot_settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Индексы для ускорения запросов
+CREATE INDEX IF NOT EXISTS idx_users_premium ON users(is_premium);
+CREATE INDEX IF NOT EXISTS idx_parsing_history_user_id ON parsing_history(user_id);
+CREATE INDEX IF NOT EXISTS idx_parsing_history_created ON parsing_history(created_at);
+CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id, is_active);
+-- Частичный индекс: большинство пользователей пришли без реферера
+CREATE INDEX IF NOT EXISTS idx_users_referrer ON users(referrer_id)
+WHERE referrer_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_users_registered ON users(registered_at DESC);
+CREATE INDEX IF NOT EXISTS idx_bot_admins_added ON bot_admins(added_at DESC);
+-- Покрывающий индекс для истории пользователя (без обращения к таблице)
+CREATE INDEX IF NOT EXISTS idx_parsing_history_user_created
+ON parsing_history(user_id, created_at DESC, users_found, admins_found);
+
+-- Рассылки: задание и статус каждого получателя переживают перезапуск бота
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    job_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS broadcast_targets (
+    job_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending / ok / blocked / error
+    PRIMARY KEY (job_id, user_id),
+    FOREIGN KEY (job_id) REFERENCES broadcast_jobs(job_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+-- Счётчики для get_stats: поддерживаются триггерами, чтение - O(1)
+CREATE TABLE IF NOT EXISTS stats_counters (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+-- Начальные значения для существующей базы (одним проходом по таблицам)
+INSERT OR IGNORE INTO stats_counters (key, value)
+SELECT 'total_users', COUNT(*) FROM users
+UNION ALL SELECT 'premium_users', COUNT(*) FROM users WHERE is_premium = 1
+UNION ALL SELECT 'total_parsings', COUNT(*) FROM parsing_history
+UNION ALL SELECT 'total_users_found', COALESCE(SUM(users_found), 0) FROM parsing_history;
+
+CREATE TRIGGER IF NOT EXISTS trg_users_insert_stats AFTER INSERT ON users
+BEGIN
+    UPDATE stats_counters SET value = value + 1 WHERE key = 'total_users';
+    UPDATE stats_counters SET value = value + (NEW.is_premium = 1) WHERE key = 'premium_users';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_users_delete_stats AFTER DELETE ON users
+BEGIN
+    UPDATE stats_counters SET value = value - 1 WHERE key = 'total_users';
+    UPDATE stats_counters SET value = value - (OLD.is_premium = 1) WHERE key = 'premium_users';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_users_premium_stats AFTER UPDATE OF is_premium ON users
+WHEN (OLD.is_premium = 1) != (NEW.is_premium = 1)
+BEGIN
+    UPDATE stats_counters SET value = value + (NEW.is_premium = 1) - (OLD.is_premium = 1)
+    WHERE key = 'premium_users';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_parsing_history_insert_stats AFTER INSERT ON parsing_history
+BEGIN
+    UPDATE stats_counters SET value = value + 1 WHERE key = 'total_parsings';
+    UPDATE stats_counters SET value = value + COALESCE(NEW.users_found, 0)
+    WHERE key = 'total_users_found';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_parsing_history_delete_stats AFTER DELETE ON parsing_history
+BEGIN
+    UPDATE stats_counters SET value = value - 1 WHERE key = 'total_parsings';
+    UPDATE stats_counters SET value = value - COALESCE(OLD.users_found, 0)
+    WHERE key = 'total_users_found';
+END;
+
+COMMIT;
+"""
+
 
 class Database:
     """Database manager for user data and limits with connection pooling"""
 
     # Timeout для SQLite соединений (секунды) - критично для многопользовательского доступа
     DB_TIMEOUT = 30.0
+    # Количество читающих соединений: в WAL читатели не блокируют писателя и друг друга
+    READER_POOL_SIZE = 4
+    # Размер кэша подготовленных запросов на соединение (по умолчанию в sqlite3 - 128)
+    STATEMENT_CACHE_SIZE = 256
+    # Группировка простых записей: до N операций за окно T секунд - один COMMIT
+    WRITE_BATCH_SIZE = 64
+    WRITE_BATCH_WINDOW = 0.005
+    # last_activity - "примерное время": копим в памяти и сбрасываем раз в N секунд
+    ACTIVITY_FLUSH_INTERVAL = 5.0
+    # Список админов бота перечитывается из базы не чаще раза в N секунд
+    # (правки через add/remove_bot_admin применяются к кэшу сразу)
+    BOT_ADMINS_TTL = 60.0
+    # Версия схемы (PRAGMA user_version); увеличивайте при добавлении миграции в _migrate()
+    SCHEMA_VERSION = 2
 
-    def __init__(self, db_path: Path = config.DATABASE_PATH):
-        self.db_path = db_path
-        self._connection: Optional[aiosqlite.Connection] = None
-        self._lock = asyncio.Lock()
+    def __init__(self, db_path: str = config.DATABASE_PATH_STR):
+        # Путь храним строкой - так его ждёт aiosqlite.connect()
+        self.db_path = os.fspath(db_path)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._open_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._write_task: Optional[asyncio.Task] = None
+        self._pending_activity: dict[int, float] = {}
+        self._activity_task: Optional[asyncio.Task] = None
+        # Кэши горячих проверок (обновляются при записи через этот же экземпляр)
+        self._settings: Optional[Dict[str, str]] = None  # Копия таблицы bot_settings
+        self._bot_admins_set: Optional[set[int]] = None
+        self._bot_admins_expires = 0.0
+        self._bot_admins_lock = asyncio.Lock()
 
-    async def _setup_connection(self, conn: aiosqlite.Connection):
+    async def _setup_connection(self, conn: aiosqlite.Connection, query_only: bool = False):
         """Настройка соединения с WAL mode и оптимизациями"""
         conn.row_factory = aiosqlite.Row
         # WAL mode - критично для concurrent access
@@ -37,138 +252,192 @@ class Database:
         # Дополнительные оптимизации для concurrent access
         await conn.execute("PRAGMA busy_timeout=30000")  # 30 секунд ожидание блокировки
         await conn.execute("PRAGMA synchronous=NORMAL")  # Баланс скорости и надёжности
+        # Кэш и временные структуры в памяти: сортировки/агрегаты не ходят на диск
+        await conn.execute("PRAGMA temp_store=MEMORY")
+        await conn.execute("PRAGMA cache_size=-65536")  # ~64 МБ кэша страниц
+        await conn.execute("PRAGMA mmap_size=268435456")  # 256 МБ memory-mapped I/O
+        await conn.execute("PRAGMA wal_autocheckpoint=1000")
+        if query_only:
+            await conn.execute("PRAGMA query_only=TRUE")  # Читатель не может случайно писать
 
-    @asynccontextmanager
-    async def get_connection(self):
-        """Получить переиспользуемое соединение с блокировкой"""
-        async with self._lock:
-            if self._connection is None:
-                self._connection = await aiosqlite.connect(
+    async def _ensure_open(self):
+        """Открыть писателя и пул читателей при первом обращении"""
+        if self._readers is not None:
+            return
+        async with self._open_lock:
+            if self._readers is not None:
+                return
+            # isolation_level=IMMEDIATE: неявная транзакция сразу берёт RESERVED-блокировку,
+            # а не пытается повысить её посреди транзакции (источник SQLITE_BUSY)
+            writer = await aiosqlite.connect(
+                self.db_path,
+                timeout=self.DB_TIMEOUT,
+                isolation_level="IMMEDIATE",
+                cached_statements=self.STATEMENT_CACHE_SIZE
+            )
+            await self._setup_connection(writer)
+
+            readers = asyncio.Queue()
+            for _ in range(self.READER_POOL_SIZE):
+                reader = await aiosqlite.connect(
                     self.db_path,
-                    timeout=self.DB_TIMEOUT
+                    timeout=self.DB_TIMEOUT,
+                    cached_statements=self.STATEMENT_CACHE_SIZE
                 )
-                await self._setup_connection(self._connection)
-            yield self._connection
-    
+                await self._setup_connection(reader, query_only=True)
+                readers.put_nowait(reader)
+
+            self._writer = writer
+            self._write_queue = asyncio.Queue()
+            self._write_task = asyncio.create_task(self._write_worker())
+            self._activity_task = asyncio.create_task(self._activity_flusher())
+            self._readers = readers
+
+    @asynccontextmanager
+    async def get_writer(self):
+        """Единственное пишущее соединение; записи выполняются по очереди"""
+        await self._ensure_open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                # Не оставляем незавершённую транзакцию следующему писателю
+                await self._writer.rollback()
+                raise
+
+    async def _enqueue_write(self, sql: str, params: tuple = ()):
+        """Поставить запись без результата в очередь и дождаться её COMMIT"""
+        await self._ensure_open()
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((sql, params, future))
+        await future
+
+    async def _write_worker(self):
+        """Фоновая задача: применяет накопленные записи одной транзакцией"""
+        queue = self._write_queue
+        while True:
+            batch = [await queue.get()]
+            # Даём параллельным запросам попасть в ту же транзакцию
+            await asyncio.sleep(self.WRITE_BATCH_WINDOW)
+            while len(batch) < self.WRITE_BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            try:
+                async with self.get_writer() as db:
+                    # Подряд идущие одинаковые запросы - одним executemany (порядок сохраняется)
+                    for sql, ops in itertools.groupby(batch, key=lambda op: op[0]):
+                        await db.executemany(sql, [params for _, params, _ in ops])
+                    await db.commit()
+                results = [None] * len(batch)
+            except Exception:
+                # Одна ошибочная операция не должна ронять всю пачку - повторяем поштучно
+                results = []
+                for sql, params, _ in batch:
+                    try:
+                        async with self.get_writer() as db:
+                            await db.execute(sql, params)
+                            await db.commit()
+                        results.append(None)
+                    except Exception as e:
+                        results.append(e)
+
+            for (_, _, future), error in zip(batch, results):
+                if not future.done():
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+                queue.task_done()
+
+    @asynccontextmanager
+    async def get_reader(self):
+        """Свободное читающее соединение из пула (только SELECT)"""
+        await self._ensure_open()
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
     async def close(self):
-        """Закрыть соединение при завершении работы"""
-        if self._connection:
-            await self._connection.close()
-            self._connection = None
+        """Закрыть соединения при завершении работы"""
+        if self._readers is None:
+            return
+        # Останавливаем фоновые задачи, не теряя накопленных записей: дожидаемся
+        # остановки флашера (прерванная пачка вернётся в _pending_activity),
+        # затем сбрасываем всё накопленное
+        self._activity_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._activity_task
+        await self._flush_activity()
+        await self._write_queue.join()
+        self._write_task.cancel()
+        async with self._write_lock:
+            # Обновляем статистику планировщика перед выходом (дёшево, если нечего делать)
+            await self._writer.execute("PRAGMA optimize")
+            await self._writer.close()
+            while not self._readers.empty():
+                await self._readers.get_nowait().close()
+            self._writer = None
+            self._write_queue = None
+            self._write_task = None
+            self._activity_task = None
+            self._readers = None
             logger.info("Database connection closed")
 
     async def init_db(self):
-        """Initialize database tables"""
-        async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-            # Инициализируем WAL mode сразу при создании БД
-            await self._setup_connection(db)
-            # Users table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    parsing_count INTEGER DEFAULT 0,
-                    is_premium BOOLEAN DEFAULT 0,
-                    referrer_id INTEGER DEFAULT NULL,
-                    referral_bonus_given BOOLEAN DEFAULT 0,
-                    registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Миграция: добавляем поля referrer_id и referral_bonus_given если их нет
-            try:
+        """Initialize database tables (migrations run only if schema version is behind)"""
+        async with self.get_writer() as db:
+            async with db.execute("PRAGMA user_version") as cursor:
+                version = (await cursor.fetchone())[0]
+
+            if version < self.SCHEMA_VERSION:
+                # Условные ALTER - одной транзакцией: либо применились целиком, либо откатились
+                await db.execute("BEGIN IMMEDIATE")
+                await self._migrate(db, version)
+                await db.commit()
+                # Идемпотентная часть схемы - одним пакетом без round-trip на каждый CREATE.
+                # executescript сам коммитит открытую транзакцию, поэтому идёт отдельно
+                await db.executescript(_SCHEMA_SQL)
+                await db.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+                await db.commit()
+                logger.info(f"Database schema migrated: v{version} -> v{self.SCHEMA_VERSION}")
+
+        logger.info("Database initialized")
+        await self._load_settings()
+        await self._load_bot_admins()
+
+    async def _migrate(self, db: aiosqlite.Connection, version: int):
+        """Условные миграции с версии version до SCHEMA_VERSION (до _SCHEMA_SQL)"""
+        if version < 1:
+            # v1: базы, созданные до появления user_version (версия 0), могут не иметь
+            # части колонок users - добавляем недостающие по списку из PRAGMA table_info.
+            # На свежей базе таблицы ещё нет, колонки придут из CREATE TABLE в _SCHEMA_SQL
+            async with db.execute("PRAGMA table_info(users)") as cursor:
+                columns = {row[1] for row in await cursor.fetchall()}
+            if not columns:
+                return
+            if "referrer_id" not in columns:
                 await db.execute("ALTER TABLE users ADD COLUMN referrer_id INTEGER DEFAULT NULL")
-            except:
-                pass  # Колонка уже существует
-            try:
+            if "referral_bonus_given" not in columns:
                 await db.execute("ALTER TABLE users ADD COLUMN referral_bonus_given BOOLEAN DEFAULT 0")
-            except:
-                pass  # Колонка уже существует
-            
-            # Миграция: добавляем поле subscription_verified для кэширования проверки подписки
-            try:
+            if "subscription_verified" not in columns:
                 await db.execute("ALTER TABLE users ADD COLUMN subscription_verified BOOLEAN DEFAULT 0")
-            except:
-                pass  # Колонка уже существует
-
-            # User sessions table (for Telethon accounts)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS user_sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    phone_number TEXT NOT NULL,
-                    session_name TEXT NOT NULL UNIQUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT 1,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-
-            # Parsing history table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS parsing_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    target_link TEXT NOT NULL,
-                    parse_type TEXT NOT NULL,
-                    time_filter TEXT,
-                    users_found INTEGER DEFAULT 0,
-                    admins_found INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-            
-            # Bot admins table (для управления админами бота)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS bot_admins (
-                    user_id INTEGER PRIMARY KEY,
-                    added_by INTEGER,
-                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Bot settings table (for global flags like access control)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS bot_settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT NOT NULL,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Индексы для ускорения запросов
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_users_premium ON users(is_premium)
-            """)
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_parsing_history_user_id ON parsing_history(user_id)
-            """)
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_parsing_history_created ON parsing_history(created_at)
-            """)
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id, is_active)
-            """)
-
-            await db.commit()
-            logger.info("Database initialized with indexes")
+            # Денормализованный счётчик приглашённых: get_referral_stats читает одну строку
+            if "referrals_count" not in columns:
+                await db.execute("ALTER TABLE users ADD COLUMN referrals_count INTEGER DEFAULT 0")
+                await db.execute("""
+                    UPDATE users SET referrals_count = (
+                        SELECT COUNT(*) FROM users AS invited WHERE invited.referrer_id = users.user_id
+                    )
+                """)
+        # v2: таблицы broadcast_jobs/broadcast_targets - только CREATE, они в _SCHEMA_SQL
 
-    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Get user data by ID"""
-        async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM users WHERE user_id = ?",
-                (user_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return dict(row)
-                return None
+    async def get_user(self, user_id: int) -> Optional[aiosqlite.Row]:
+        """Get user data by ID (row supports access by column name)"""
+        async with self.get_reader() as db:
+            async with db.execute(_SQL_GET_USER, (user_id,)) as cursor:
+                return await cursor.fetchone()
 
     async def create_user(
         self,
@@ -180,11 +449,14 @@ class Database:
     ) -> bool:
         """Create new user in database"""
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-                await db.execute("""
-                    INSERT INTO users (user_id, username, first_name, last_name, referrer_id)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (user_id, username, first_name, last_name, referrer_id))
+            async with self.get_writer() as db:
+                await db.execute(
+                    _SQL_CREATE_USER,
+                    (user_id, username, first_name, last_name, referrer_id)
+                )
+                # Счётчик реферера обновляется в той же транзакции
+                if referrer_id is not None:
+                    await db.execute(_SQL_INCREMENT_REFERRALS, (referrer_id,))
                 await db.commit()
                 logger.info(f"New user created: {user_id}, referrer: {referrer_id}")
                 return True
@@ -192,16 +464,80 @@ class Database:
             logger.warning(f"User {user_id} already exists")
             return False
 
+    async def upsert_user(
+        self,
+        user_id: int,
+        username: Optional[str] = None,
+        first_name: Optional[str] = None,
+        last_name: Optional[str] = None,
+        referrer_id: Optional[int] = None
+    ) -> bool:
+        """
+        Создать пользователя или обновить активность существующего - одной транзакцией.
+        Новому пользователю с реферером сразу начисляется реферальный бонус.
+        Returns: True если пользователь новый
+        """
+        async with self.get_writer() as db:
+            cursor = await db.execute(
+                _SQL_INSERT_USER_IF_NEW,
+                (user_id, username, first_name, last_name, referrer_id)
+            )
+            is_new = cursor.rowcount == 1
+            await cursor.close()
+
+            if not is_new:
+                await db.execute(_SQL_TOUCH_USER, (username, user_id))
+            elif referrer_id is not None:
+                # Бонус рефереру и отметка о выдаче - в той же транзакции, что и INSERT
+                await db.execute(_SQL_INCREMENT_REFERRALS, (referrer_id,))
+                await db.execute(_SQL_GRANT_REFERRAL_BONUS, (config.REFERRAL_BONUS, referrer_id))
+                await db.execute(_SQL_MARK_REFERRAL_BONUS, (user_id,))
+            await db.commit()
+
+        if is_new:
+            logger.info(f"New user created: {user_id}, referrer: {referrer_id}")
+            if referrer_id is not None:
+                logger.info(f"Referral bonus +{config.REFERRAL_BONUS} given to user {referrer_id} for inviting {user_id}")
+        return is_new
+
     async def update_user_activity(self, user_id: int):
-        """Update user's last activity timestamp"""
-        async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-            await db.execute("""
-                UPDATE users
-                SET last_activity = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            """, (user_id,))
+        """Update user's last activity timestamp (written to DB in periodic batches)"""
+        await self._ensure_open()
+        self._pending_activity[user_id] = time.time()
+
+    async def _flush_activity(self):
+        """Записать накопленные last_activity одной транзакцией"""
+        if not self._pending_activity:
+            return
+        pending, self._pending_activity = self._pending_activity, {}
+        try:
+            await self.bulk_update_activity(pending.items())
+        except BaseException as e:
+            # Транзакция откатана (get_writer): возвращаем несохранённое, не затирая
+            # более свежие отметки. Отмена задачи пробрасывается дальше
+            for user_id, ts in pending.items():
+                self._pending_activity.setdefault(user_id, ts)
+            if not isinstance(e, Exception):
+                raise
+            logger.error(f"Error flushing user activity: {e}")
+
+    async def bulk_update_activity(self, activity: Iterable[Tuple[int, float]]):
+        """Обновить last_activity для множества пользователей: (user_id, unix time)"""
+        # Формат как у CURRENT_TIMESTAMP (UTC), чтобы значения в колонке были однородны
+        rows = (
+            (datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S"), user_id)
+            for user_id, ts in activity
+        )
+        async with self.get_writer() as db:
+            await db.executemany(_SQL_UPDATE_ACTIVITY, rows)
             await db.commit()
 
+    async def _activity_flusher(self):
+        """Фоновая задача: периодический сброс last_activity"""
+        while True:
+            await asyncio.sleep(self.ACTIVITY_FLUSH_INTERVAL)
+            await self._flush_activity()
+
     async def check_limit(self, user_id: int) -> Dict[str, Any]:
         """
         Check if user has available parsing attempts
@@ -246,36 +582,36 @@ class Database:
             "is_premium": is_premium
         }
 
-    async def decrease_limit(self, user_id: int) -> bool:
+    async def try_consume(self, user_id: int) -> Optional[Dict[str, Any]]:
         """
-        Decrease user's parsing limit by 1
-        Returns: True if limit was decreased, False if no limit available
+        Atomically spend one parsing attempt (single UPDATE ... RETURNING)
+        Returns: {"remaining": int, "is_premium": bool} or None if no limit available
         """
-        limit_info = await self.check_limit(user_id)
-
-        if not limit_info["has_limit"]:
-            return False
-
-        # Don't decrease for premium users
-        if limit_info["is_premium"]:
-            return True
+        # Admin and open access are unlimited - no write needed
+        if user_id == config.ADMIN_ID or await self.is_access_open():
+            return {"remaining": -1, "is_premium": True}
 
-        async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-            await db.execute("""
-                UPDATE users
-                SET parsing_count = parsing_count + 1,
-                    last_activity = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            """, (user_id,))
+        # Premium users pass the check but their counter is not increased
+        async with self.get_writer() as db:
+            async with db.execute(_SQL_TRY_CONSUME, (user_id, config.FREE_PARSING_LIMIT)) as cursor:
+                row = await cursor.fetchone()
             await db.commit()
 
-        logger.info(f"Parsing count increased for user {user_id}")
-        return True
+        if row is None:
+            return None
+
+        is_premium = bool(row["is_premium"])
+        if not is_premium:
+            logger.info(f"Parsing count increased for user {user_id}")
+        return {
+            "remaining": -1 if is_premium else max(0, config.FREE_PARSING_LIMIT - row["parsing_count"]),
+            "is_premium": is_premium
+        }
 
     async def set_premium(self, user_id: int, is_premium: bool = True) -> bool:
         """Set user premium status"""
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
+            async with self.get_writer() as db:
                 await db.execute("""
                     UPDATE users
                     SET is_premium = ?
@@ -291,7 +627,7 @@ class Database:
     async def reset_limit(self, user_id: int) -> bool:
         """Reset user's parsing count to 0"""
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
+            async with self.get_writer() as db:
                 await db.execute("""
                     UPDATE users
                     SET parsing_count = 0
@@ -315,9 +651,7 @@ class Database:
         
         for attempt in range(max_retries):
             try:
-                async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-                    await self._setup_connection(db)
-                    
+                async with self.get_writer() as db:
                     # Сначала проверяем, есть ли деактивированная сессия
                     async with db.execute(
                         "SELECT is_active FROM user_sessions WHERE session_name = ?",
@@ -359,21 +693,22 @@ class Database:
         
         return False
 
-    async def get_user_sessions(self, user_id: int) -> list:
+    async def get_user_sessions(self, user_id: int) -> list[aiosqlite.Row]:
         """Get all active sessions for user"""
-        async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM user_sessions
-                WHERE user_id = ? AND is_active = 1
-            """, (user_id,)) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        async with self.get_reader() as db:
+            async with db.execute(_SQL_GET_USER_SESSIONS, (user_id,)) as cursor:
+                return await cursor.fetchall()
+
+    async def get_session_by_name(self, user_id: int, session_name: str) -> Optional[aiosqlite.Row]:
+        """Get user's active session by name"""
+        async with self.get_reader() as db:
+            async with db.execute(_SQL_GET_SESSION_BY_NAME, (session_name, user_id)) as cursor:
+                return await cursor.fetchone()
 
     async def deactivate_session(self, session_name: str) -> bool:
         """Deactivate a session"""
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
+            async with self.get_writer() as db:
                 await db.execute("""
                     UPDATE user_sessions
                     SET is_active = 0
@@ -396,47 +731,35 @@ class Database:
         admins_found: int = 0
     ):
         """Add parsing record to history"""
-        async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-            await db.execute("""
-                INSERT INTO parsing_history
-                (user_id, target_link, parse_type, time_filter, users_found, admins_found)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (user_id, target_link, parse_type, time_filter, users_found, admins_found))
-            await db.commit()
+        await self._enqueue_write(
+            _SQL_ADD_PARSING_HISTORY,
+            (user_id, target_link, parse_type, time_filter, users_found, admins_found)
+        )
 
     async def get_stats(self) -> Dict[str, int]:
         """Get overall bot statistics"""
-        async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-            # Total users
-            async with db.execute("SELECT COUNT(*) FROM users") as cursor:
-                total_users = (await cursor.fetchone())[0]
-
-            # Premium users
-            async with db.execute("SELECT COUNT(*) FROM users WHERE is_premium = 1") as cursor:
-                premium_users = (await cursor.fetchone())[0]
-
-            # Total parsings
-            async with db.execute("SELECT COUNT(*) FROM parsing_history") as cursor:
-                total_parsings = (await cursor.fetchone())[0]
-
-            # Total users found
-            async with db.execute("SELECT SUM(users_found) FROM parsing_history") as cursor:
-                total_users_found = (await cursor.fetchone())[0] or 0
-
-            return {
-                "total_users": total_users,
-                "premium_users": premium_users,
-                "total_parsings": total_parsings,
-                "total_users_found": total_users_found
-            }
+        stats = {
+            "total_users": 0,
+            "premium_users": 0,
+            "total_parsings": 0,
+            "total_users_found": 0
+        }
+        # Один запрос к таблице счётчиков вместо четырёх агрегатов
+        async with self.get_reader() as db:
+            async with db.execute(_SQL_GET_STATS) as cursor:
+                for key, value in await cursor.fetchall():
+                    stats[key] = value
+        return stats
 
-    async def get_user_statistics(self) -> list[Dict[str, Any]]:
+    async def get_user_statistics(self, limit: int = -1) -> Tuple[int, list[aiosqlite.Row]]:
         """
-        Get detailed statistics for all users
-        Returns list with: user_id, username, joined_date, days_in_bot, total_parses, is_premium
+        Get detailed statistics for the most recently registered users
+        Returns (total users count, rows with: user_id, username, joined_date, days_in_bot,
+        total_parses, is_premium); limit=-1 returns all rows
         """
-        async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.get_reader() as db:
+            async with db.execute("SELECT COUNT(*) FROM users") as cursor:
+                total = (await cursor.fetchone())[0]
             async with db.execute("""
                 SELECT
                     user_id,
@@ -450,24 +773,34 @@ class Database:
                     CAST((julianday('now') - julianday(registered_at)) AS INTEGER) as days_in_bot
                 FROM users
                 ORDER BY registered_at DESC
-            """) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                LIMIT ?
+            """, (limit,)) as cursor:
+                return total, await cursor.fetchall()
 
+    async def get_users_bulk(self, user_ids: Iterable[int]) -> list[aiosqlite.Row]:
+        """Получить user_id и username для списка пользователей одним запросом"""
+        ids = ",".join(str(int(user_id)) for user_id in user_ids)
+        if not ids:
+            return []
+        async with self.get_reader() as db:
+            async with db.execute(_SQL_GET_USERS_BULK, (f"[{ids}]",)) as cursor:
+                return await cursor.fetchall()
 
     # ===== УПРАВЛЕНИЕ АДМИНАМИ БОТА =====
     
     async def add_bot_admin(self, user_id: int, added_by: int) -> bool:
         """Добавить админа бота"""
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
+            async with self.get_writer() as db:
                 await db.execute("""
                     INSERT OR REPLACE INTO bot_admins (user_id, added_by)
                     VALUES (?, ?)
                 """, (user_id, added_by))
                 await db.commit()
-                logger.info(f"Bot admin added: {user_id} by {added_by}")
-                return True
+            if self._bot_admins_set is not None:
+                self._bot_admins_set.add(user_id)
+            logger.info(f"Bot admin added: {user_id} by {added_by}")
+            return True
         except Exception as e:
             logger.error(f"Error adding bot admin: {e}")
             return False
@@ -475,29 +808,41 @@ class Database:
     async def remove_bot_admin(self, user_id: int) -> bool:
         """Удалить админа бота"""
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
+            async with self.get_writer() as db:
                 await db.execute("""
                     DELETE FROM bot_admins WHERE user_id = ?
                 """, (user_id,))
                 await db.commit()
-                logger.info(f"Bot admin removed: {user_id}")
-                return True
+            if self._bot_admins_set is not None:
+                self._bot_admins_set.discard(user_id)
+            logger.info(f"Bot admin removed: {user_id}")
+            return True
         except Exception as e:
             logger.error(f"Error removing bot admin: {e}")
             return False
     
+    async def _load_bot_admins(self) -> set[int]:
+        """Загрузить ID админов бота в память"""
+        async with self.get_reader() as db:
+            async with db.execute("SELECT user_id FROM bot_admins") as cursor:
+                self._bot_admins_set = {row[0] for row in await cursor.fetchall()}
+        self._bot_admins_expires = time.monotonic() + self.BOT_ADMINS_TTL
+        return self._bot_admins_set
+
     async def is_bot_admin(self, user_id: int) -> bool:
         """Проверить, является ли пользователь админом бота"""
         # Главный админ из конфига всегда админ
         if user_id == config.ADMIN_ID:
             return True
-        
-        async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-            async with db.execute(
-                "SELECT 1 FROM bot_admins WHERE user_id = ?",
-                (user_id,)
-            ) as cursor:
-                return await cursor.fetchone() is not None
+
+        admins = self._bot_admins_set
+        if admins is None or time.monotonic() >= self._bot_admins_expires:
+            # Одна перезагрузка на всех: остальные ждут и берут готовый набор
+            async with self._bot_admins_lock:
+                admins = self._bot_admins_set
+                if admins is None or time.monotonic() >= self._bot_admins_expires:
+                    admins = await self._load_bot_admins()
+        return user_id in admins
     
     async def get_bot_admins(self) -> list[Dict[str, Any]]:
         """Получить список всех админов бота"""
@@ -511,8 +856,7 @@ class Database:
             "is_main": True
         })
         
-        async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.get_reader() as db:
             async with db.execute("""
                 SELECT user_id, added_by, added_at FROM bot_admins
                 ORDER BY added_at DESC
@@ -534,43 +878,46 @@ class Database:
     async def set_access_open(self, status: bool) -> bool:
         """Set global access open/closed flag"""
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
+            async with self.get_writer() as db:
                 await db.execute("""
                     INSERT OR REPLACE INTO bot_settings (key, value, updated_at)
                     VALUES ('is_access_open', ?, CURRENT_TIMESTAMP)
                 """, ('1' if status else '0',))
                 await db.commit()
-                logger.info(f"Global access set to: {'OPEN' if status else 'CLOSED'}")
-                return True
+            if self._settings is not None:
+                self._settings["is_access_open"] = '1' if status else '0'
+            logger.info(f"Global access set to: {'OPEN' if status else 'CLOSED'}")
+            return True
         except Exception as e:
             logger.error(f"Error setting access status: {e}")
             return False
 
+    async def _load_settings(self) -> Dict[str, str]:
+        """Загрузить таблицу bot_settings (несколько строк) в память"""
+        async with self.get_reader() as db:
+            async with db.execute(_SQL_GET_SETTINGS) as cursor:
+                self._settings = {key: value for key, value in await cursor.fetchall()}
+        return self._settings
+
     async def is_access_open(self) -> bool:
         """Check if global access is open for all users"""
-        try:
-            async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-                async with db.execute(
-                    "SELECT value FROM bot_settings WHERE key = 'is_access_open'"
-                ) as cursor:
-                    row = await cursor.fetchone()
-                    if row:
-                        return row[0] == '1'
-                    return False  # Default: access is closed (3 trial parsings)
-        except Exception as e:
-            logger.error(f"Error checking access status: {e}")
-            return False  # Default to closed on error
+        settings = self._settings
+        if settings is None:
+            try:
+                settings = await self._load_settings()
+            except Exception as e:
+                logger.error(f"Error checking access status: {e}")
+                return False  # Default to closed on error
+        # Default: access is closed (3 trial parsings)
+        return settings.get("is_access_open", '0') == '1'
 
     # ===== КЭШИРОВАНИЕ ПРОВЕРКИ ПОДПИСКИ =====
     
     async def is_subscription_verified(self, user_id: int) -> bool:
         """Проверить, подтверждена ли подписка пользователя (кэш)"""
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-                async with db.execute(
-                    "SELECT subscription_verified FROM users WHERE user_id = ?",
-                    (user_id,)
-                ) as cursor:
+            async with self.get_reader() as db:
+                async with db.execute(_SQL_GET_SUBSCRIPTION, (user_id,)) as cursor:
                     row = await cursor.fetchone()
                     if row:
                         return bool(row[0])
@@ -582,15 +929,9 @@ class Database:
     async def set_subscription_verified(self, user_id: int, verified: bool = True) -> bool:
         """Сохранить статус подтверждения подписки в БД"""
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-                await db.execute("""
-                    UPDATE users
-                    SET subscription_verified = ?
-                    WHERE user_id = ?
-                """, (1 if verified else 0, user_id))
-                await db.commit()
-                logger.info(f"Subscription verified status set to {verified} for user {user_id}")
-                return True
+            await self._enqueue_write(_SQL_SET_SUBSCRIPTION, (1 if verified else 0, user_id))
+            logger.info(f"Subscription verified status set to {verified} for user {user_id}")
+            return True
         except Exception as e:
             logger.error(f"Error setting subscription status: {e}")
             return False
@@ -604,7 +945,7 @@ class Database:
         Returns: True если бонус начислен
         """
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
+            async with self.get_writer() as db:
                 # Проверяем что бонус ещё не был начислен за этого юзера
                 async with db.execute(
                     "SELECT referral_bonus_given FROM users WHERE user_id = ?",
@@ -617,18 +958,10 @@ class Database:
                 
                 # Начисляем бонус рефереру (уменьшаем parsing_count, что увеличивает remaining)
                 # parsing_count - это использованные парсинги, уменьшаем чтобы увеличить остаток
-                await db.execute("""
-                    UPDATE users
-                    SET parsing_count = MAX(0, parsing_count - ?)
-                    WHERE user_id = ?
-                """, (config.REFERRAL_BONUS, referrer_id))
+                await db.execute(_SQL_GRANT_REFERRAL_BONUS, (config.REFERRAL_BONUS, referrer_id))
                 
                 # Отмечаем что бонус за этого юзера уже выдан
-                await db.execute("""
-                    UPDATE users
-                    SET referral_bonus_given = 1
-                    WHERE user_id = ?
-                """, (new_user_id,))
+                await db.execute(_SQL_MARK_REFERRAL_BONUS, (new_user_id,))
                 
                 await db.commit()
                 logger.info(f"Referral bonus +{config.REFERRAL_BONUS} given to user {referrer_id} for inviting {new_user_id}")
@@ -640,13 +973,11 @@ class Database:
     
     async def get_referral_stats(self, user_id: int) -> Dict[str, Any]:
         """Получить статистику рефералов пользователя"""
-        async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
+        async with self.get_reader() as db:
             # Количество приглашённых
-            async with db.execute(
-                "SELECT COUNT(*) FROM users WHERE referrer_id = ?",
-                (user_id,)
-            ) as cursor:
-                invited_count = (await cursor.fetchone())[0]
+            async with db.execute(_SQL_GET_REFERRALS_COUNT, (user_id,)) as cursor:
+                row = await cursor.fetchone()
+            invited_count = row[0] if row else 0
             
             # Общий заработанный бонус
             total_bonus = invited_count * config.REFERRAL_BONUS
@@ -659,7 +990,7 @@ class Database:
     async def add_parsing_attempts(self, user_id: int, amount: int) -> bool:
         """Добавить попытки парсинга пользователю (уменьшить parsing_count)"""
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
+            async with self.get_writer() as db:
                 await db.execute("""
                     UPDATE users
                     SET parsing_count = MAX(0, parsing_count - ?)
@@ -680,15 +1011,19 @@ class Database:
         try:
             if backup_dir is None:
                 backup_dir = config.BASE_DIR / "backups"
-            backup_dir.mkdir(exist_ok=True)
+            await asyncio.to_thread(backup_dir.mkdir, exist_ok=True)
             
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_path = backup_dir / f"database_backup_{timestamp}.db"
             
-            # Используем SQLite backup API для консистентного бэкапа
-            async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as source:
-                async with aiosqlite.connect(backup_path) as dest:
-                    await source.backup(dest)
+            # VACUUM INTO на читающем соединении: консистентный сжатый снимок,
+            # в WAL не блокирует писателя. query_only снимаем только на время команды
+            async with self.get_reader() as db:
+                await db.execute("PRAGMA query_only=FALSE")
+                try:
+                    await db.execute("VACUUM INTO ?", (os.fspath(backup_path),))
+                finally:
+                    await db.execute("PRAGMA query_only=TRUE")
             
             logger.info(f"Database backup created: {backup_path}")
             
@@ -702,6 +1037,12 @@ class Database:
     
     async def _cleanup_old_backups(self, backup_dir: Path, days: int = 7):
         """Удалить бэкапы старше N дней"""
+        # Обход директории, stat и unlink - блокирующие вызовы: целиком в пул потоков
+        await asyncio.to_thread(self._cleanup_old_backups_sync, backup_dir, days)
+
+    @staticmethod
+    def _cleanup_old_backups_sync(backup_dir: Path, days: int):
+        """Синхронная часть очистки бэкапов (выполняется вне event loop)"""
         cutoff = datetime.now().timestamp() - (days * 86400)
         for backup_file in backup_dir.glob("database_backup_*.db"):
             if backup_file.stat().st_mtime < cutoff:
@@ -710,12 +1051,95 @@ class Database:
 
     # ===== РАССЫЛКИ =====
 
-    async def get_all_user_ids(self) -> list[int]:
-        """Получить список всех user_id из базы данных"""
-        async with aiosqlite.connect(self.db_path, timeout=self.DB_TIMEOUT) as db:
-            async with db.execute("SELECT user_id FROM users") as cursor:
-                rows = await cursor.fetchall()
-                return [row[0] for row in rows]
+    async def count_users(self) -> int:
+        """Количество пользователей в базе"""
+        async with self.get_reader() as db:
+            async with db.execute("SELECT COUNT(*) FROM users") as cursor:
+                return (await cursor.fetchone())[0]
+
+    async def create_broadcast_job(
+        self,
+        job_id: str,
+        payload: str,
+        user_ids: Optional[Iterable[int]] = None
+    ) -> int:
+        """
+        Сохранить задание рассылки и его получателей (user_ids=None - все пользователи
+        на момент постановки). Возвращает число получателей
+        """
+        async with self.get_writer() as db:
+            await db.execute(
+                "INSERT INTO broadcast_jobs (job_id, payload) VALUES (?, ?)",
+                (job_id, payload)
+            )
+            if user_ids is None:
+                cursor = await db.execute(
+                    "INSERT INTO broadcast_targets (job_id, user_id) SELECT ?, user_id FROM users",
+                    (job_id,)
+                )
+            else:
+                # Как и в get_users_bulk: список - одним JSON-параметром
+                ids = ",".join(str(int(user_id)) for user_id in user_ids)
+                cursor = await db.execute(
+                    "INSERT OR IGNORE INTO broadcast_targets (job_id, user_id) "
+                    "SELECT ?, value FROM json_each(?)",
+                    (job_id, f"[{ids}]")
+                )
+            count = cursor.rowcount
+            await cursor.close()
+            await db.commit()
+        return count
+
+    async def iter_broadcast_targets(self, job_id: str, page_size: int = 500) -> AsyncIterator[int]:
+        """
+        Перебрать получателей рассылки, которым ещё не отправляли (status = 'pending').
+        Страницы - по user_id, а не по статусу: отправки из прошлой страницы могут
+        быть ещё не отмечены, и повторно выбирать их нельзя
+        """
+        last_id = -1
+        while True:
+            async with self.get_reader() as db:
+                cursor = await db.execute(_SQL_BROADCAST_TARGETS_PAGE, (job_id, last_id, page_size))
+                rows = await cursor.fetchmany(page_size)
+                await cursor.close()
+
+            for row in rows:
+                yield row[0]
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1][0]
+
+    async def set_broadcast_statuses(self, job_id: str, results: Iterable[Tuple[str, int]]):
+        """Отметить результаты отправки пачкой: results - пары (status, user_id)"""
+        async with self.get_writer() as db:
+            await db.executemany(
+                _SQL_SET_BROADCAST_STATUS,
+                [(status, job_id, user_id) for status, user_id in results]
+            )
+            await db.commit()
+
+    async def get_broadcast_progress(self, job_id: str) -> Dict[str, int]:
+        """Число получателей рассылки по статусам"""
+        async with self.get_reader() as db:
+            async with db.execute(
+                "SELECT status, COUNT(*) FROM broadcast_targets WHERE job_id = ? GROUP BY status",
+                (job_id,)
+            ) as cursor:
+                return {status: count for status, count in await cursor.fetchall()}
+
+    async def get_broadcast_jobs(self) -> list[aiosqlite.Row]:
+        """Незавершённые рассылки (завершённые удаляются) в порядке постановки"""
+        async with self.get_reader() as db:
+            async with db.execute(
+                "SELECT job_id, payload FROM broadcast_jobs ORDER BY created_at, rowid"
+            ) as cursor:
+                return await cursor.fetchall()
+
+    async def delete_broadcast_job(self, job_id: str):
+        """Удалить рассылку вместе с получателями (ON DELETE CASCADE)"""
+        async with self.get_writer() as db:
+            await db.execute("DELETE FROM broadcast_jobs WHERE job_id = ?", (job_id,))
+            await db.commit()
 
 
 # Global database instance
@@ -4,24 +4,68 @@ Handles admin commands and management functions
 """
 
 import logging
-import asyncio
 import time
-import re
-from aiogram import Router, F, Bot
+import uuid
+from array import array
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Final, Optional
+from urllib.parse import urlsplit
+from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.exceptions import TelegramForbiddenError, TelegramNotFound, TelegramBadRequest
 
 import keyboards
 import config
 from database import db
+from services.broadcast_worker import broadcast_worker, BroadcastJob
+from handlers.common import safe_edit
 
 logger = logging.getLogger(__name__)
 
 router = Router()
 
+# Значения конфигурации не меняются во время работы - привязываем их один раз
+_ADMIN_ID: Final[int] = config.ADMIN_ID
+_FREE_PARSING_LIMIT: Final[int] = config.FREE_PARSING_LIMIT
+
+# Разделители в списке ID для рассылки: запятые превращаем в пробелы,
+# дальше str.split() режет по любым пробельным символам (включая переносы строк)
+_ID_SEPARATORS = str.maketrans(",", " ")
+
+# Допустимые схемы ссылок для URL-кнопки рассылки
+_BUTTON_URL_SCHEMES = frozenset(("http", "https", "tg"))
+
+# Неизменяемые тексты ответов
+_ADMIN_PANEL_TEXT = """
+👑 <b>Админ-панель</b>
+
+Добро пожаловать в панель управления!
+
+Выберите действие:
+"""
+
+_HELP_TEXT = """
+❓ <b>Справка по командам</b>
+
+/start - Главное меню
+/id - Получить свой ID
+/help - Эта справка
+
+<b>Основные функции:</b>
+
+📊 Парсинг каналов - сбор активных пользователей из комментариев
+👥 Парсинг чатов - сбор участников из групповых чатов
+➕ Добавить аккаунт - для парсинга закрытых чатов
+💎 Мой лимит - проверить доступные парсинги
+
+<b>Поддержка:</b>
+Если у вас возникли вопросы, обратитесь в поддержку через главное меню.
+"""
+
+_BAD_ID_TEXT = "❌ Неверный формат ID. Введите числовой ID пользователя:"
+
 
 class AdminStates(StatesGroup):
     """Состояния для админских действий"""
@@ -47,7 +91,33 @@ class BroadcastStates(StatesGroup):
 
 async def is_admin(user_id: int) -> bool:
     """Проверка прав администратора (включая добавленных)"""
-    return await db.is_bot_admin(user_id)
+    # Главный админ проверяется без обращения к БД
+    return user_id == _ADMIN_ID or await db.is_bot_admin(user_id)
+
+
+async def _parse_target_user_id(message: Message) -> Optional[int]:
+    """
+    Прочитать ID пользователя из сообщения админа.
+    При неверном формате просит ввести ID ещё раз и возвращает None (состояние сохраняется).
+    """
+    try:
+        return int((message.text or "").strip())
+    except ValueError:
+        await message.answer(_BAD_ID_TEXT, reply_markup=keyboards.get_cancel_button())
+        return None
+
+
+async def _get_existing_user(message: Message, state: FSMContext, user_id: int):
+    """Получить пользователя из БД; если его нет - сообщить админу и сбросить состояние"""
+    user = await db.get_user(user_id)
+    if not user:
+        await message.answer(
+            "❌ Пользователь не найден в базе данных",
+            reply_markup=keyboards.get_admin_menu()
+        )
+        await state.clear()
+        return None
+    return user
 
 
 # Команда /admin
@@ -58,18 +128,9 @@ async def cmd_admin(message: Message):
         await message.answer("❌ У вас нет прав администратора")
         return
 
-    text = """
-👑 <b>Админ-панель</b>
-
-Добро пожаловать в панель управления!
-
-Выберите действие:
-"""
-
     await message.answer(
-        text,
-        reply_markup=keyboards.get_admin_menu(),
-        parse_mode="HTML"
+        _ADMIN_PANEL_TEXT,
+        reply_markup=keyboards.get_admin_menu()
     )
 
 
@@ -84,8 +145,7 @@ async def admin_give_premium_start(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text(
         "👤 <b>Выдача премиума</b>\n\n"
         "Отправьте ID пользователя:",
-        reply_markup=keyboards.get_cancel_button(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_cancel_button()
     )
     await state.set_state(AdminStates.waiting_for_user_id_premium)
     await callback.answer()
@@ -94,13 +154,8 @@ async def admin_give_premium_start(callback: CallbackQuery, state: FSMContext):
 @router.message(AdminStates.waiting_for_user_id_premium)
 async def admin_give_premium_process(message: Message, state: FSMContext):
     """Обработка выдачи премиума"""
-    try:
-        target_user_id = int(message.text.strip())
-    except ValueError:
-        await message.answer(
-            "❌ Неверный формат ID. Введите числовой ID пользователя:",
-            reply_markup=keyboards.get_cancel_button()
-        )
+    target_user_id = await _parse_target_user_id(message)
+    if target_user_id is None:
         return
 
     # Проверяем существование пользователя
@@ -117,8 +172,7 @@ async def admin_give_premium_process(message: Message, state: FSMContext):
             f"✅ <b>Премиум выдан!</b>\n\n"
             f"User ID: <code>{target_user_id}</code>\n"
             f"Статус: Премиум активен",
-            reply_markup=keyboards.get_admin_menu(),
-            parse_mode="HTML"
+            reply_markup=keyboards.get_admin_menu()
         )
     else:
         await message.answer(
@@ -140,8 +194,7 @@ async def admin_reset_limit_start(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text(
         "🔄 <b>Сброс лимита</b>\n\n"
         "Отправьте ID пользователя:",
-        reply_markup=keyboards.get_cancel_button(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_cancel_button()
     )
     await state.set_state(AdminStates.waiting_for_user_id_reset)
     await callback.answer()
@@ -150,23 +203,13 @@ async def admin_reset_limit_start(callback: CallbackQuery, state: FSMContext):
 @router.message(AdminStates.waiting_for_user_id_reset)
 async def admin_reset_limit_process(message: Message, state: FSMContext):
     """Обработка сброса лимита"""
-    try:
-        target_user_id = int(message.text.strip())
-    except ValueError:
-        await message.answer(
-            "❌ Неверный формат ID. Введите числовой ID пользователя:",
-            reply_markup=keyboards.get_cancel_button()
-        )
+    target_user_id = await _parse_target_user_id(message)
+    if target_user_id is None:
         return
 
     # Проверяем существование пользователя
-    user = await db.get_user(target_user_id)
-    if not user:
-        await message.answer(
-            "❌ Пользователь не найден в базе данных",
-            reply_markup=keyboards.get_admin_menu()
-        )
-        await state.clear()
+    user = await _get_existing_user(message, state, target_user_id)
+    if user is None:
         return
 
     # Сбрасываем лимит
@@ -176,9 +219,8 @@ async def admin_reset_limit_process(message: Message, state: FSMContext):
         await message.answer(
             f"✅ <b>Лимит сброшен!</b>\n\n"
             f"User ID: <code>{target_user_id}</code>\n"
-            f"Парсингов доступно: {config.FREE_PARSING_LIMIT}",
-            reply_markup=keyboards.get_admin_menu(),
-            parse_mode="HTML"
+            f"Парсингов доступно: {_FREE_PARSING_LIMIT}",
+            reply_markup=keyboards.get_admin_menu()
         )
     else:
         await message.answer(
@@ -200,8 +242,7 @@ async def admin_revoke_premium_start(callback: CallbackQuery, state: FSMContext)
     await callback.message.edit_text(
         "📉 <b>Отзыв премиума</b>\n\n"
         "Отправьте ID пользователя, у которого нужно забрать премиум:",
-        reply_markup=keyboards.get_cancel_button(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_cancel_button()
     )
     await state.set_state(AdminStates.waiting_for_user_id_revoke)
     await callback.answer()
@@ -210,23 +251,13 @@ async def admin_revoke_premium_start(callback: CallbackQuery, state: FSMContext)
 @router.message(AdminStates.waiting_for_user_id_revoke)
 async def admin_revoke_premium_process(message: Message, state: FSMContext):
     """Обработка отзыва премиума"""
-    try:
-        target_user_id = int(message.text.strip())
-    except ValueError:
-        await message.answer(
-            "❌ Неверный формат ID. Введите числовой ID пользователя:",
-            reply_markup=keyboards.get_cancel_button()
-        )
+    target_user_id = await _parse_target_user_id(message)
+    if target_user_id is None:
         return
 
     # Проверяем существование пользователя
-    user = await db.get_user(target_user_id)
-    if not user:
-        await message.answer(
-            "❌ Пользователь не найден в базе данных",
-            reply_markup=keyboards.get_admin_menu()
-        )
-        await state.clear()
+    user = await _get_existing_user(message, state, target_user_id)
+    if user is None:
         return
 
     # Забираем премиум
@@ -237,9 +268,8 @@ async def admin_revoke_premium_process(message: Message, state: FSMContext):
             f"✅ <b>Премиум отозван!</b>\n\n"
             f"User ID: <code>{target_user_id}</code>\n"
             f"Статус: Обычный пользователь\n"
-            f"Доступно парсингов: {max(0, config.FREE_PARSING_LIMIT - user['parsing_count'])}",
-            reply_markup=keyboards.get_admin_menu(),
-            parse_mode="HTML"
+            f"Доступно парсингов: {max(0, _FREE_PARSING_LIMIT - user['parsing_count'])}",
+            reply_markup=keyboards.get_admin_menu()
         )
     else:
         await message.answer(
@@ -273,18 +303,63 @@ async def admin_stats(callback: CallbackQuery):
 • Пользователей найдено: {stats['total_users_found']}
 
 💎 <b>Лимиты:</b>
-• Бесплатных парсингов: {config.FREE_PARSING_LIMIT}
+• Бесплатных парсингов: {_FREE_PARSING_LIMIT}
 """
 
     await callback.message.edit_text(
         text,
-        reply_markup=keyboards.get_admin_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_admin_menu()
     )
     await callback.answer()
 
 
 # Статистика пользователей
+# Готовый текст кэшируется ненадолго: повторные клики (в т.ч. разных админов) не ходят в БД
+_USER_STATS_TTL = 30.0
+_user_stats_cache: Optional[tuple[float, str]] = None  # (момент истечения, текст)
+
+
+async def _get_user_stats_text() -> Optional[str]:
+    """Текст статистики по последним 20 пользователям (None, если пользователей нет)"""
+    global _user_stats_cache
+    now = time.monotonic()
+    if _user_stats_cache is not None and now < _user_stats_cache[0]:
+        return _user_stats_cache[1]
+
+    # В сообщение помещаются первые 20 пользователей - больше из БД и не читаем
+    total_users, display_users = await db.get_user_statistics(limit=20)
+    if not total_users:
+        return None
+
+    # Формируем текстовое сообщение (части собираем в список и склеиваем один раз)
+    parts = [
+        "📈 <b>Статистика пользователей</b>\n\n",
+        f"<b>Всего пользователей:</b> {total_users}\n\n",
+    ]
+
+    for idx, user in enumerate(display_users, 1):
+        username = f"@{user['username']}" if user['username'] else "Нет username"
+        first_name = user['first_name'] or "Нет имени"
+        premium_badge = " 💎" if user['is_premium'] else ""
+
+        parts.append(
+            f"{idx}. <b>{first_name}</b> {premium_badge}\n"
+            f"   ID: <code>{user['user_id']}</code>\n"
+            f"   Username: {username}\n"
+            f"   Регистрация: {user['registered_at'][:10]}\n"
+            f"   Дней в боте: {user['days_in_bot']}\n"
+            f"   Парсингов: {user['parsing_count']}\n"
+            f"   Последняя активность: {user['last_activity'][:10]}\n\n"
+        )
+
+    if total_users > len(display_users):
+        parts.append(f"<i>Показаны первые {len(display_users)} из {total_users} пользователей</i>\n")
+
+    text = "".join(parts)
+    _user_stats_cache = (now + _USER_STATS_TTL, text)
+    return text
+
+
 @router.callback_query(F.data == "admin_user_stats")
 async def admin_user_stats(callback: CallbackQuery):
     """Показать детальную статистику по пользователям"""
@@ -294,46 +369,39 @@ async def admin_user_stats(callback: CallbackQuery):
 
     await callback.answer("⏳ Формирую статистику...")
 
-    user_stats = await db.get_user_statistics()
+    text = await _get_user_stats_text()
 
-    if not user_stats:
+    if text is None:
         await callback.message.answer(
             "ℹ️ Пользователей пока нет",
             reply_markup=keyboards.get_admin_menu()
         )
         return
 
-    # Формируем текстовое сообщение
-    text = "📈 <b>Статистика пользователей</b>\n\n"
-    text += f"<b>Всего пользователей:</b> {len(user_stats)}\n\n"
-
-    # Ограничиваем до 20 пользователей в сообщении
-    display_users = user_stats[:20]
-
-    for idx, user in enumerate(display_users, 1):
-        username = f"@{user['username']}" if user['username'] else "Нет username"
-        first_name = user['first_name'] or "Нет имени"
-        premium_badge = " 💎" if user['is_premium'] else ""
-
-        text += f"{idx}. <b>{first_name}</b> {premium_badge}\n"
-        text += f"   ID: <code>{user['user_id']}</code>\n"
-        text += f"   Username: {username}\n"
-        text += f"   Регистрация: {user['registered_at'][:10]}\n"
-        text += f"   Дней в боте: {user['days_in_bot']}\n"
-        text += f"   Парсингов: {user['parsing_count']}\n"
-        text += f"   Последняя активность: {user['last_activity'][:10]}\n\n"
-
-    if len(user_stats) > 20:
-        text += f"<i>Показаны первые 20 из {len(user_stats)} пользователей</i>\n"
-
     # Отправляем как новое сообщение (если текст слишком длинный для edit)
     await callback.message.answer(
         text,
-        parse_mode="HTML",
         reply_markup=keyboards.get_admin_menu()
     )
 
 
+# Остановка текущей рассылки
+@router.message(Command("cancel_broadcast"))
+async def cmd_cancel_broadcast(message: Message):
+    """Остановить текущую рассылку"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+
+    job_id = broadcast_worker.cancel_current()
+    if job_id is None:
+        await message.answer("ℹ️ Сейчас рассылок нет")
+        return
+
+    logger.info(f"Broadcast {job_id} cancelled by {message.from_user.id}")
+    await message.answer("⛔ Рассылка останавливается, итог будет в её статусном сообщении")
+
+
 # Команда для получения своего ID (полезно для пользователей)
 @router.message(Command("id"))
 async def cmd_get_id(message: Message):
@@ -349,35 +417,16 @@ Username: @{username}
 Имя: {message.from_user.first_name or ""}
 """
 
-    await message.answer(text, parse_mode="HTML")
+    await message.answer(text)
 
 
 # Команда для помощи (доступна всем)
 @router.message(Command("help"))
 async def cmd_help(message: Message):
     """Показать помощь"""
-    text = """
-❓ <b>Справка по командам</b>
-
-/start - Главное меню
-/id - Получить свой ID
-/help - Эта справка
-
-<b>Основные функции:</b>
-
-📊 Парсинг каналов - сбор активных пользователей из комментариев
-👥 Парсинг чатов - сбор участников из групповых чатов
-➕ Добавить аккаунт - для парсинга закрытых чатов
-💎 Мой лимит - проверить доступные парсинги
-
-<b>Поддержка:</b>
-Если у вас возникли вопросы, обратитесь в поддержку через главное меню.
-"""
-
     await message.answer(
-        text,
-        reply_markup=keyboards.get_main_menu(),
-        parse_mode="HTML"
+        _HELP_TEXT,
+        reply_markup=keyboards.get_main_menu()
     )
 
 
@@ -387,7 +436,7 @@ async def cmd_help(message: Message):
 async def admin_add_admin_start(callback: CallbackQuery, state: FSMContext):
     """Начало процесса добавления админа"""
     # Только главный админ может добавлять других админов
-    if callback.from_user.id != config.ADMIN_ID:
+    if callback.from_user.id != _ADMIN_ID:
         await callback.answer("❌ Только главный админ может добавлять админов", show_alert=True)
         return
 
@@ -395,8 +444,7 @@ async def admin_add_admin_start(callback: CallbackQuery, state: FSMContext):
         "👑 <b>Добавление админа бота</b>\n\n"
         "Отправьте Telegram ID пользователя, которого хотите сделать админом:\n\n"
         "<i>Пользователь сможет управлять премиумом, сбрасывать лимиты и просматривать статистику.</i>",
-        reply_markup=keyboards.get_cancel_button(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_cancel_button()
     )
     await state.set_state(AdminStates.waiting_for_user_id_add_admin)
     await callback.answer()
@@ -405,16 +453,11 @@ async def admin_add_admin_start(callback: CallbackQuery, state: FSMContext):
 @router.message(AdminStates.waiting_for_user_id_add_admin)
 async def admin_add_admin_process(message: Message, state: FSMContext):
     """Обработка добавления админа"""
-    try:
-        target_user_id = int(message.text.strip())
-    except ValueError:
-        await message.answer(
-            "❌ Неверный формат ID. Введите числовой ID пользователя:",
-            reply_markup=keyboards.get_cancel_button()
-        )
+    target_user_id = await _parse_target_user_id(message)
+    if target_user_id is None:
         return
 
-    if target_user_id == config.ADMIN_ID:
+    if target_user_id == _ADMIN_ID:
         await message.answer(
             "ℹ️ Этот пользователь уже является главным админом",
             reply_markup=keyboards.get_admin_menu()
@@ -439,8 +482,7 @@ async def admin_add_admin_process(message: Message, state: FSMContext):
             f"✅ <b>Админ добавлен!</b>\n\n"
             f"User ID: <code>{target_user_id}</code>\n\n"
             f"Теперь этот пользователь может использовать /admin",
-            reply_markup=keyboards.get_admin_menu(),
-            parse_mode="HTML"
+            reply_markup=keyboards.get_admin_menu()
         )
     else:
         await message.answer(
@@ -455,7 +497,7 @@ async def admin_add_admin_process(message: Message, state: FSMContext):
 async def admin_remove_admin_start(callback: CallbackQuery, state: FSMContext):
     """Начало процесса удаления админа"""
     # Только главный админ может удалять админов
-    if callback.from_user.id != config.ADMIN_ID:
+    if callback.from_user.id != _ADMIN_ID:
         await callback.answer("❌ Только главный админ может удалять админов", show_alert=True)
         return
 
@@ -463,8 +505,7 @@ async def admin_remove_admin_start(callback: CallbackQuery, state: FSMContext):
         "🚫 <b>Удаление админа бота</b>\n\n"
         "Отправьте Telegram ID админа, которого хотите удалить:\n\n"
         "<i>Главного админа удалить нельзя.</i>",
-        reply_markup=keyboards.get_cancel_button(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_cancel_button()
     )
     await state.set_state(AdminStates.waiting_for_user_id_remove_admin)
     await callback.answer()
@@ -473,16 +514,11 @@ async def admin_remove_admin_start(callback: CallbackQuery, state: FSMContext):
 @router.message(AdminStates.waiting_for_user_id_remove_admin)
 async def admin_remove_admin_process(message: Message, state: FSMContext):
     """Обработка удаления админа"""
-    try:
-        target_user_id = int(message.text.strip())
-    except ValueError:
-        await message.answer(
-            "❌ Неверный формат ID. Введите числовой ID пользователя:",
-            reply_markup=keyboards.get_cancel_button()
-        )
+    target_user_id = await _parse_target_user_id(message)
+    if target_user_id is None:
         return
 
-    if target_user_id == config.ADMIN_ID:
+    if target_user_id == _ADMIN_ID:
         await message.answer(
             "❌ Нельзя удалить главного админа!",
             reply_markup=keyboards.get_admin_menu()
@@ -498,8 +534,7 @@ async def admin_remove_admin_process(message: Message, state: FSMContext):
             f"✅ <b>Админ удалён!</b>\n\n"
             f"User ID: <code>{target_user_id}</code>\n\n"
             f"Пользователь больше не имеет доступа к админ-панели.",
-            reply_markup=keyboards.get_admin_menu(),
-            parse_mode="HTML"
+            reply_markup=keyboards.get_admin_menu()
         )
     else:
         await message.answer(
@@ -518,8 +553,13 @@ async def admin_list_admins(callback: CallbackQuery):
         return
 
     admins = await db.get_bot_admins()
+    # Username всех админов - одним запросом вместо get_user на каждого
+    users_by_id = {
+        row["user_id"]: row
+        for row in await db.get_users_bulk(admin["user_id"] for admin in admins)
+    }
 
-    text = "📋 <b>Список админов бота:</b>\n\n"
+    parts = ["📋 <b>Список админов бота:</b>\n\n"]
 
     for idx, admin in enumerate(admins, 1):
         user_id = admin["user_id"]
@@ -529,21 +569,23 @@ async def admin_list_admins(callback: CallbackQuery):
         else:
             badge = "⭐️ Админ"
 
-        # Пробуем получить username из БД пользователей
-        user_info = await db.get_user(user_id)
-        if user_info and user_info.get("username"):
+        user_info = users_by_id.get(user_id)
+        if user_info and user_info["username"]:
             username = f"@{user_info['username']}"
         else:
             username = "username не известен"
 
-        text += f"{idx}. {badge}\n"
-        text += f"   ID: <code>{user_id}</code>\n"
-        text += f"   {username}\n\n"
+        parts.append(
+            f"{idx}. {badge}\n"
+            f"   ID: <code>{user_id}</code>\n"
+            f"   {username}\n\n"
+        )
+
+    text = "".join(parts)
 
     await callback.message.edit_text(
         text,
-        reply_markup=keyboards.get_admin_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_admin_menu()
     )
     await callback.answer()
 
@@ -567,8 +609,7 @@ async def admin_open_access(callback: CallbackQuery):
             "🔓 <b>Доступ ОТКРЫТ</b>\n\n"
             "Теперь все пользователи имеют неограниченный доступ к парсингу.\n\n"
             "Чтобы вернуть ограничения (3 пробных парсинга), нажмите «Закрыть доступ».",
-            reply_markup=keyboards.get_admin_menu(),
-            parse_mode="HTML"
+            reply_markup=keyboards.get_admin_menu()
         )
     else:
         await callback.answer("❌ Ошибка при изменении настроек", show_alert=True)
@@ -589,11 +630,10 @@ async def admin_close_access(callback: CallbackQuery):
         await callback.answer("🔒 Доступ закрыт!", show_alert=True)
         await callback.message.edit_text(
             "🔒 <b>Доступ ЗАКРЫТ</b>\n\n"
-            f"Новые пользователи получают только {config.FREE_PARSING_LIMIT} пробных парсингов.\n"
+            f"Новые пользователи получают только {_FREE_PARSING_LIMIT} пробных парсингов.\n"
             "Премиум-пользователи сохраняют неограниченный доступ.\n\n"
             "Чтобы открыть доступ для всех, нажмите «Открыть доступ всем».",
-            reply_markup=keyboards.get_admin_menu(),
-            parse_mode="HTML"
+            reply_markup=keyboards.get_admin_menu()
         )
     else:
         await callback.answer("❌ Ошибка при изменении настроек", show_alert=True)
@@ -601,22 +641,53 @@ async def admin_close_access(callback: CallbackQuery):
 
 # ===== МОДУЛЬ РАССЫЛОК (Broadcast Module) =====
 
-def get_default_broadcast_data() -> dict:
-    """Получить данные рассылки по умолчанию"""
-    return {
-        "mode": None,           # "all" или "ids"
-        "target_ids": [],       # Список ID для рассылки
-        "photo_id": None,       # file_id фото
-        "text": None,           # Текст сообщения
-        "button_text": None,    # Текст кнопки
-        "button_url": None,     # URL кнопки
-        "pin_enabled": False,   # Закреплять сообщение
-    }
+# Списки ID для рассылки (режим "ids") по job_id: в FSM лежит только ключ,
+# чтобы каждый update_data не таскал за собой весь список. Список хранится
+# плотным массивом int64 (8 байт на ID вместо ~36 у list[int]) до постановки
+# рассылки - дальше получатели живут в БД (broadcast_targets)
+_broadcast_targets: dict[str, array] = {}
+
+
+@dataclass(slots=True)
+class BroadcastData:
+    """Черновик рассылки (в FSM лежит как dict: см. _load_bcast/_save_bcast)"""
+    mode: Optional[str] = None          # "all" или "ids"
+    job_id: Optional[str] = None        # Ключ списка ID в _broadcast_targets (режим "ids")
+    target_count: int = 0               # Количество получателей
+    photo_id: Optional[str] = None      # file_id фото
+    text: Optional[str] = None          # Текст сообщения
+    button_text: Optional[str] = None   # Текст кнопки
+    button_url: Optional[str] = None    # URL кнопки
+    pin_enabled: bool = False           # Закреплять сообщение
+
+
+_BCAST_FIELDS = BroadcastData.__slots__
+
+
+async def _load_bcast(state: FSMContext) -> BroadcastData:
+    """Прочитать черновик рассылки из FSM (пустой, если рассылка ещё не начата)"""
+    stored = (await state.get_data()).get("broadcast")
+    return BroadcastData(**stored) if stored else BroadcastData()
+
+
+async def _save_bcast(state: FSMContext, broadcast_data: BroadcastData):
+    """Записать черновик рассылки в FSM (только в обработчиках, которые его меняют)"""
+    # Все поля - скаляры, поэтому хватает плоского словаря по __slots__:
+    # asdict() рекурсивно копирует каждое значение и заметно медленнее
+    await state.update_data(broadcast={
+        name: getattr(broadcast_data, name) for name in _BCAST_FIELDS
+    })
+
+
+async def release_broadcast_targets(state: FSMContext):
+    """Освободить список получателей предыдущей рассылки (если он был)"""
+    job_id = (await _load_bcast(state)).job_id
+    if job_id:
+        _broadcast_targets.pop(job_id, None)
 
 
 # --- Начало рассылки ---
 
-@router.callback_query(F.data == "admin_broadcast_all")
 async def admin_broadcast_all_start(callback: CallbackQuery, state: FSMContext):
     """Начало массовой рассылки по всем пользователям"""
     if not await is_admin(callback.from_user.id):
@@ -624,28 +695,26 @@ async def admin_broadcast_all_start(callback: CallbackQuery, state: FSMContext):
         return
 
     # Получаем количество пользователей
-    all_users = await db.get_all_user_ids()
-    user_count = len(all_users)
+    # ID не храним в FSM - при отправке они читаются из БД постранично
+    user_count = await db.count_users()
 
     # Инициализируем данные рассылки
-    broadcast_data = get_default_broadcast_data()
-    broadcast_data["mode"] = "all"
-    broadcast_data["target_ids"] = all_users
-    await state.update_data(broadcast=broadcast_data)
+    await release_broadcast_targets(state)
+    broadcast_data = BroadcastData(mode="all", target_count=user_count)
+    await _save_bcast(state, broadcast_data)
 
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         f"📢 <b>Массовая рассылка</b>\n\n"
         f"Получателей: <b>{user_count}</b> пользователей\n\n"
         f"<b>Шаг 1/4: Картинка</b>\n"
         f"Отправьте фото или нажмите «Пропустить»:",
-        reply_markup=keyboards.get_broadcast_photo_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_photo_menu()
     )
     await state.set_state(BroadcastStates.waiting_for_photo)
     await callback.answer()
 
 
-@router.callback_query(F.data == "admin_broadcast_ids")
 async def admin_broadcast_ids_start(callback: CallbackQuery, state: FSMContext):
     """Начало рассылки по конкретным ID"""
     if not await is_admin(callback.from_user.id):
@@ -653,19 +722,19 @@ async def admin_broadcast_ids_start(callback: CallbackQuery, state: FSMContext):
         return
 
     # Инициализируем данные рассылки
-    broadcast_data = get_default_broadcast_data()
-    broadcast_data["mode"] = "ids"
-    await state.update_data(broadcast=broadcast_data)
+    await release_broadcast_targets(state)
+    broadcast_data = BroadcastData(mode="ids")
+    await _save_bcast(state, broadcast_data)
 
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "🎯 <b>Рассылка по ID</b>\n\n"
         "Отправьте список Telegram ID пользователей.\n\n"
         "<i>Можно через пробел, запятую или с новой строки:</i>\n"
         "<code>123456789 987654321</code>\n"
         "<code>123456789, 987654321</code>\n"
         "<code>123456789\n987654321</code>",
-        reply_markup=keyboards.get_broadcast_text_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_text_menu()
     )
     await state.set_state(BroadcastStates.waiting_for_ids)
     await callback.answer()
@@ -675,25 +744,25 @@ async def admin_broadcast_ids_start(callback: CallbackQuery, state: FSMContext):
 async def process_broadcast_ids(message: Message, state: FSMContext):
     """Обработка списка ID для рассылки"""
     # Парсим ID из текста (через пробел, запятую или новую строку)
-    text = message.text.strip()
-    # Разделяем по пробелам, запятым и переносам строки
-    raw_ids = re.split(r'[\s,\n]+', text)
+    raw_ids = message.text.translate(_ID_SEPARATORS).split()
 
     valid_ids = []
-    invalid_entries = []
+    invalid_count = 0
 
     for raw_id in raw_ids:
-        raw_id = raw_id.strip()
-        if not raw_id:
-            continue
         try:
             user_id = int(raw_id)
-            if user_id > 0:
-                valid_ids.append(user_id)
-            else:
-                invalid_entries.append(raw_id)
         except ValueError:
-            invalid_entries.append(raw_id)
+            invalid_count += 1
+            continue
+        if user_id > 0:
+            valid_ids.append(user_id)
+        else:
+            invalid_count += 1
+
+    # Повторы в списке - лишние сообщения в лимите Telegram; порядок сохраняем
+    parsed_count = len(valid_ids)
+    valid_ids = list(dict.fromkeys(valid_ids))
 
     if not valid_ids:
         await message.answer(
@@ -704,22 +773,30 @@ async def process_broadcast_ids(message: Message, state: FSMContext):
         return
 
     # Обновляем данные
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
-    broadcast_data["target_ids"] = valid_ids
-    await state.update_data(broadcast=broadcast_data)
+    broadcast_data = await _load_bcast(state)
+    # job_id с префиксом админа: брошенный список (например, после /start) того же
+    # админа заменяется новым, а не копится в памяти
+    owner_prefix = f"{message.from_user.id}:"
+    for stale_job_id in [key for key in _broadcast_targets if key.startswith(owner_prefix)]:
+        del _broadcast_targets[stale_job_id]
+    job_id = owner_prefix + uuid.uuid4().hex
+    _broadcast_targets[job_id] = array("q", valid_ids)
+    broadcast_data.job_id = job_id
+    broadcast_data.target_count = len(valid_ids)
+    await _save_bcast(state, broadcast_data)
 
     warning_text = ""
-    if invalid_entries:
-        warning_text = f"\n⚠️ Пропущено некорректных значений: {len(invalid_entries)}"
+    if invalid_count:
+        warning_text = f"\n⚠️ Пропущено некорректных значений: {invalid_count}"
+    if parsed_count > len(valid_ids):
+        warning_text += f"\n♻️ Убрано повторов: {parsed_count - len(valid_ids)}"
 
     await message.answer(
         f"🎯 <b>Рассылка по ID</b>\n\n"
         f"Получателей: <b>{len(valid_ids)}</b>{warning_text}\n\n"
         f"<b>Шаг 1/4: Картинка</b>\n"
         f"Отправьте фото или нажмите «Пропустить»:",
-        reply_markup=keyboards.get_broadcast_photo_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_photo_menu()
     )
     await state.set_state(BroadcastStates.waiting_for_photo)
 
@@ -732,10 +809,9 @@ async def process_broadcast_photo(message: Message, state: FSMContext):
     # Берём фото максимального размера
     photo_id = message.photo[-1].file_id
 
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
-    broadcast_data["photo_id"] = photo_id
-    await state.update_data(broadcast=broadcast_data)
+    broadcast_data = await _load_bcast(state)
+    broadcast_data.photo_id = photo_id
+    await _save_bcast(state, broadcast_data)
 
     await message.answer(
         "✅ Фото загружено!\n\n"
@@ -749,10 +825,9 @@ async def process_broadcast_photo_edit(message: Message, state: FSMContext):
     """Обработка замены фото"""
     photo_id = message.photo[-1].file_id
 
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
-    broadcast_data["photo_id"] = photo_id
-    await state.update_data(broadcast=broadcast_data)
+    broadcast_data = await _load_bcast(state)
+    broadcast_data.photo_id = photo_id
+    await _save_bcast(state, broadcast_data)
 
     await message.answer(
         "✅ Фото заменено!\n\n"
@@ -762,67 +837,46 @@ async def process_broadcast_photo_edit(message: Message, state: FSMContext):
     await state.set_state(BroadcastStates.waiting_for_photo)
 
 
-@router.callback_query(F.data == "broadcast_skip_photo")
-async def broadcast_skip_photo(callback: CallbackQuery, state: FSMContext):
-    """Пропуск шага с фото"""
-    await callback.message.edit_text(
-        "📝 <b>Шаг 2/4: Текст сообщения</b>\n\n"
-        "Отправьте текст рассылки.\n\n"
-        "<i>Поддерживается HTML-форматирование:</i>\n"
-        "<code>&lt;b&gt;жирный&lt;/b&gt;</code>\n"
-        "<code>&lt;i&gt;курсив&lt;/i&gt;</code>\n"
-        "<code>&lt;a href=\"URL\"&gt;ссылка&lt;/a&gt;</code>",
-        reply_markup=keyboards.get_broadcast_text_menu(),
-        parse_mode="HTML"
-    )
-    await state.set_state(BroadcastStates.waiting_for_text)
-    await callback.answer()
-
-
-@router.callback_query(F.data == "broadcast_photo_next")
 async def broadcast_photo_next(callback: CallbackQuery, state: FSMContext):
-    """Переход к шагу текста после фото"""
-    await callback.message.edit_text(
+    """Переход к шагу текста (после фото или с пропуском фото)"""
+    await safe_edit(
+        callback.message,
         "📝 <b>Шаг 2/4: Текст сообщения</b>\n\n"
         "Отправьте текст рассылки.\n\n"
         "<i>Поддерживается HTML-форматирование:</i>\n"
         "<code>&lt;b&gt;жирный&lt;/b&gt;</code>\n"
         "<code>&lt;i&gt;курсив&lt;/i&gt;</code>\n"
         "<code>&lt;a href=\"URL\"&gt;ссылка&lt;/a&gt;</code>",
-        reply_markup=keyboards.get_broadcast_text_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_text_menu()
     )
     await state.set_state(BroadcastStates.waiting_for_text)
     await callback.answer()
 
 
-@router.callback_query(F.data == "broadcast_replace_photo")
 async def broadcast_replace_photo(callback: CallbackQuery, state: FSMContext):
     """Замена фото"""
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "🖼 <b>Замена фото</b>\n\n"
         "Отправьте новое фото:",
-        reply_markup=keyboards.get_broadcast_text_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_text_menu()
     )
     await state.set_state(BroadcastStates.editing_photo)
     await callback.answer()
 
 
-@router.callback_query(F.data == "broadcast_delete_photo")
 async def broadcast_delete_photo(callback: CallbackQuery, state: FSMContext):
     """Удаление фото"""
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
-    broadcast_data["photo_id"] = None
-    await state.update_data(broadcast=broadcast_data)
+    broadcast_data = await _load_bcast(state)
+    broadcast_data.photo_id = None
+    await _save_bcast(state, broadcast_data)
 
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "🗑 Фото удалено.\n\n"
         "<b>Шаг 1/4: Картинка</b>\n"
         "Отправьте фото или нажмите «Пропустить»:",
-        reply_markup=keyboards.get_broadcast_photo_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_photo_menu()
     )
     await state.set_state(BroadcastStates.waiting_for_photo)
     await callback.answer()
@@ -836,10 +890,9 @@ async def process_broadcast_text(message: Message, state: FSMContext):
     logger.info(f"[BROADCAST] Received text from user {message.from_user.id}: {message.text[:50]}...")
     text = message.text
 
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
-    broadcast_data["text"] = text
-    await state.update_data(broadcast=broadcast_data)
+    broadcast_data = await _load_bcast(state)
+    broadcast_data.text = text
+    await _save_bcast(state, broadcast_data)
 
     await message.answer(
         f"✅ Текст сохранён!\n\n"
@@ -848,8 +901,7 @@ async def process_broadcast_text(message: Message, state: FSMContext):
         f"{text}\n"
         f"─────────────────\n\n"
         f"Выберите действие:",
-        reply_markup=keyboards.get_broadcast_text_edit_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_text_edit_menu()
     )
 
 
@@ -858,10 +910,9 @@ async def process_broadcast_text_edit(message: Message, state: FSMContext):
     """Обработка редактирования текста"""
     text = message.text
 
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
-    broadcast_data["text"] = text
-    await state.update_data(broadcast=broadcast_data)
+    broadcast_data = await _load_bcast(state)
+    broadcast_data.text = text
+    await _save_bcast(state, broadcast_data)
 
     await message.answer(
         f"✅ Текст обновлён!\n\n"
@@ -870,40 +921,36 @@ async def process_broadcast_text_edit(message: Message, state: FSMContext):
         f"{text}\n"
         f"─────────────────\n\n"
         f"Выберите действие:",
-        reply_markup=keyboards.get_broadcast_text_edit_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_text_edit_menu()
     )
     await state.set_state(BroadcastStates.waiting_for_text)
 
 
-@router.callback_query(F.data == "broadcast_edit_text")
 async def broadcast_edit_text(callback: CallbackQuery, state: FSMContext):
     """Редактирование текста"""
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "✏️ <b>Редактирование текста</b>\n\n"
         "Отправьте новый текст рассылки:",
-        reply_markup=keyboards.get_broadcast_text_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_text_menu()
     )
     await state.set_state(BroadcastStates.editing_text)
     await callback.answer()
 
 
-@router.callback_query(F.data == "broadcast_text_next")
 async def broadcast_text_next(callback: CallbackQuery, state: FSMContext):
     """Переход к шагу кнопки после текста"""
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
+    broadcast_data = await _load_bcast(state)
 
     button_info = ""
-    if broadcast_data.get("button_text") and broadcast_data.get("button_url"):
-        button_info = f"\n\nТекущая кнопка: [{broadcast_data['button_text']}]({broadcast_data['button_url']})"
+    if broadcast_data.button_text and broadcast_data.button_url:
+        button_info = f"\n\nТекущая кнопка: [{broadcast_data.button_text}]({broadcast_data.button_url})"
 
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         f"🔘 <b>Шаг 3/4: URL-кнопка</b>\n\n"
         f"Хотите добавить кнопку со ссылкой под сообщением?{button_info}",
-        reply_markup=keyboards.get_broadcast_button_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_button_menu()
     )
     await state.set_state(BroadcastStates.waiting_for_button)
     await callback.answer()
@@ -911,17 +958,16 @@ async def broadcast_text_next(callback: CallbackQuery, state: FSMContext):
 
 # --- Шаг 3: Кнопка ---
 
-@router.callback_query(F.data == "broadcast_add_button")
 async def broadcast_add_button(callback: CallbackQuery, state: FSMContext):
     """Добавление кнопки"""
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "🔘 <b>Добавление URL-кнопки</b>\n\n"
         "Отправьте данные кнопки в формате:\n"
         "<code>Текст кнопки | https://ссылка.com</code>\n\n"
         "<i>Пример:</i>\n"
         "<code>Наш канал | https://t.me/channel</code>",
-        reply_markup=keyboards.get_broadcast_button_input_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_button_input_menu()
     )
     await state.set_state(BroadcastStates.waiting_for_button)
     await callback.answer()
@@ -938,8 +984,7 @@ async def process_broadcast_button(message: Message, state: FSMContext):
             "❌ Неверный формат!\n\n"
             "Используйте формат:\n"
             "<code>Текст кнопки | https://ссылка.com</code>",
-            reply_markup=keyboards.get_broadcast_button_input_menu(),
-            parse_mode="HTML"
+            reply_markup=keyboards.get_broadcast_button_input_menu()
         )
         return
 
@@ -947,13 +992,14 @@ async def process_broadcast_button(message: Message, state: FSMContext):
     button_text = parts[0].strip()
     button_url = parts[1].strip()
 
-    # Валидация URL
-    if not button_url.startswith(("http://", "https://", "tg://")):
+    # Валидация URL: разрешённая схема и непустой хост, иначе Telegram отклонит
+    # кнопку уже во время рассылки
+    url_parts = urlsplit(button_url)
+    if url_parts.scheme.lower() not in _BUTTON_URL_SCHEMES or not url_parts.netloc:
         await message.answer(
             "❌ Неверный URL!\n\n"
             "URL должен начинаться с <code>http://</code>, <code>https://</code> или <code>tg://</code>",
-            reply_markup=keyboards.get_broadcast_button_input_menu(),
-            parse_mode="HTML"
+            reply_markup=keyboards.get_broadcast_button_input_menu()
         )
         return
 
@@ -964,141 +1010,110 @@ async def process_broadcast_button(message: Message, state: FSMContext):
         )
         return
 
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
-    broadcast_data["button_text"] = button_text
-    broadcast_data["button_url"] = button_url
-    await state.update_data(broadcast=broadcast_data)
+    broadcast_data = await _load_bcast(state)
+    broadcast_data.button_text = button_text
+    broadcast_data.button_url = button_url
+    await _save_bcast(state, broadcast_data)
 
     await message.answer(
         f"✅ Кнопка добавлена!\n\n"
         f"<b>Текст:</b> {button_text}\n"
         f"<b>Ссылка:</b> {button_url}\n\n"
         f"Выберите действие:",
-        reply_markup=keyboards.get_broadcast_button_edit_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_button_edit_menu()
     )
 
 
-@router.callback_query(F.data == "broadcast_button_back")
 async def broadcast_button_back(callback: CallbackQuery, state: FSMContext):
     """Назад к меню кнопки"""
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
+    broadcast_data = await _load_bcast(state)
 
     button_info = ""
-    if broadcast_data.get("button_text") and broadcast_data.get("button_url"):
-        button_info = f"\n\nТекущая кнопка: [{broadcast_data['button_text']}]({broadcast_data['button_url']})"
+    if broadcast_data.button_text and broadcast_data.button_url:
+        button_info = f"\n\nТекущая кнопка: [{broadcast_data.button_text}]({broadcast_data.button_url})"
 
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         f"🔘 <b>Шаг 3/4: URL-кнопка</b>\n\n"
         f"Хотите добавить кнопку со ссылкой под сообщением?{button_info}",
-        reply_markup=keyboards.get_broadcast_button_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_button_menu()
     )
     await callback.answer()
 
 
-@router.callback_query(F.data == "broadcast_skip_button")
-async def broadcast_skip_button(callback: CallbackQuery, state: FSMContext):
-    """Пропуск шага с кнопкой"""
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
-    pin_enabled = broadcast_data.get("pin_enabled", False)
-
-    await callback.message.edit_text(
-        "📌 <b>Шаг 4/4: Закрепление</b>\n\n"
-        "Закрепить сообщение в чате у получателей?\n"
-        "<i>(Старое закреплённое сообщение будет откреплено)</i>",
-        reply_markup=keyboards.get_broadcast_pin_menu(pin_enabled),
-        parse_mode="HTML"
+async def _show_pin_step(callback: CallbackQuery, pin_enabled: bool, status_line: str = ""):
+    """Экран шага 4/4 (закрепление); status_line - строка с текущим режимом"""
+    await safe_edit(
+        callback.message,
+        f"📌 <b>Шаг 4/4: Закрепление</b>\n\n"
+        f"{status_line}"
+        f"Закрепить сообщение в чате у получателей?\n"
+        f"<i>(Старое закреплённое сообщение будет откреплено)</i>",
+        reply_markup=keyboards.get_broadcast_pin_menu(pin_enabled)
     )
-    await state.set_state(BroadcastStates.pin_step)
-    await callback.answer()
 
 
-@router.callback_query(F.data == "broadcast_button_next")
 async def broadcast_button_next(callback: CallbackQuery, state: FSMContext):
-    """Переход к шагу закрепления"""
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
-    pin_enabled = broadcast_data.get("pin_enabled", False)
+    """Переход к шагу закрепления (после кнопки или с пропуском кнопки)"""
+    broadcast_data = await _load_bcast(state)
 
-    await callback.message.edit_text(
-        "📌 <b>Шаг 4/4: Закрепление</b>\n\n"
-        "Закрепить сообщение в чате у получателей?\n"
-        "<i>(Старое закреплённое сообщение будет откреплено)</i>",
-        reply_markup=keyboards.get_broadcast_pin_menu(pin_enabled),
-        parse_mode="HTML"
-    )
+    await _show_pin_step(callback, broadcast_data.pin_enabled)
     await state.set_state(BroadcastStates.pin_step)
     await callback.answer()
 
 
-@router.callback_query(F.data == "broadcast_delete_button")
 async def broadcast_delete_button(callback: CallbackQuery, state: FSMContext):
     """Удаление кнопки"""
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
-    broadcast_data["button_text"] = None
-    broadcast_data["button_url"] = None
-    await state.update_data(broadcast=broadcast_data)
+    broadcast_data = await _load_bcast(state)
+    broadcast_data.button_text = None
+    broadcast_data.button_url = None
+    await _save_bcast(state, broadcast_data)
 
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "🗑 Кнопка удалена.\n\n"
         "🔘 <b>Шаг 3/4: URL-кнопка</b>\n\n"
         "Хотите добавить кнопку со ссылкой под сообщением?",
-        reply_markup=keyboards.get_broadcast_button_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_button_menu()
     )
     await callback.answer()
 
 
 # --- Шаг 4: Закрепление (Toggle) ---
 
-@router.callback_query(F.data == "broadcast_toggle_pin")
 async def broadcast_toggle_pin(callback: CallbackQuery, state: FSMContext):
     """Переключение режима закрепления"""
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
+    broadcast_data = await _load_bcast(state)
 
     # Переключаем состояние
-    broadcast_data["pin_enabled"] = not broadcast_data.get("pin_enabled", False)
-    await state.update_data(broadcast=broadcast_data)
+    broadcast_data.pin_enabled = not broadcast_data.pin_enabled
+    await _save_bcast(state, broadcast_data)
 
-    pin_enabled = broadcast_data["pin_enabled"]
+    pin_enabled = broadcast_data.pin_enabled
     status_text = "включено ✅" if pin_enabled else "выключено ❌"
 
-    await callback.message.edit_text(
-        f"📌 <b>Шаг 4/4: Закрепление</b>\n\n"
-        f"Закрепление: <b>{status_text}</b>\n\n"
-        f"Закрепить сообщение в чате у получателей?\n"
-        f"<i>(Старое закреплённое сообщение будет откреплено)</i>",
-        reply_markup=keyboards.get_broadcast_pin_menu(pin_enabled),
-        parse_mode="HTML"
-    )
+    await _show_pin_step(callback, pin_enabled, f"Закрепление: <b>{status_text}</b>\n\n")
     await callback.answer()
 
 
 # --- Предпросмотр ---
 
-@router.callback_query(F.data == "broadcast_preview")
-async def broadcast_preview(callback: CallbackQuery, state: FSMContext, bot: Bot):
+async def broadcast_preview(callback: CallbackQuery, state: FSMContext):
     """Показать предпросмотр рассылки"""
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
+    bot = callback.bot
+    broadcast_data = await _load_bcast(state)
 
     # Проверяем наличие текста
-    if not broadcast_data.get("text"):
+    if not broadcast_data.text:
         await callback.answer("❌ Текст сообщения обязателен!", show_alert=True)
         return
 
     await state.set_state(BroadcastStates.preview)
 
     # Формируем информацию о рассылке
-    mode_text = "всем пользователям" if broadcast_data.get("mode") == "all" else "по списку ID"
-    recipients_count = len(broadcast_data.get("target_ids", []))
-    pin_status = "✅ Да" if broadcast_data.get("pin_enabled") else "❌ Нет"
+    mode_text = "всем пользователям" if broadcast_data.mode == "all" else "по списку ID"
+    recipients_count = broadcast_data.target_count
+    pin_status = "✅ Да" if broadcast_data.pin_enabled else "❌ Нет"
 
     info_text = (
         f"👁 <b>ПРЕДПРОСМОТР РАССЫЛКИ</b>\n\n"
@@ -1109,38 +1124,35 @@ async def broadcast_preview(callback: CallbackQuery, state: FSMContext, bot: Bot
         f"<i>Ниже — сообщение как его увидят пользователи:</i>"
     )
 
-    await callback.message.edit_text(info_text, parse_mode="HTML")
+    await safe_edit(callback.message, info_text)
 
     # Формируем клавиатуру с URL-кнопкой если есть
     reply_markup = None
-    if broadcast_data.get("button_text") and broadcast_data.get("button_url"):
+    if broadcast_data.button_text and broadcast_data.button_url:
         reply_markup = keyboards.get_broadcast_url_button(
-            broadcast_data["button_text"],
-            broadcast_data["button_url"]
+            broadcast_data.button_text,
+            broadcast_data.button_url
         )
 
     # Отправляем предпросмотр сообщения
     try:
-        if broadcast_data.get("photo_id"):
+        if broadcast_data.photo_id:
             await bot.send_photo(
                 chat_id=callback.from_user.id,
-                photo=broadcast_data["photo_id"],
-                caption=broadcast_data["text"],
-                reply_markup=reply_markup,
-                parse_mode="HTML"
+                photo=broadcast_data.photo_id,
+                caption=broadcast_data.text,
+                reply_markup=reply_markup
             )
         else:
             await bot.send_message(
                 chat_id=callback.from_user.id,
-                text=broadcast_data["text"],
-                reply_markup=reply_markup,
-                parse_mode="HTML"
+                text=broadcast_data.text,
+                reply_markup=reply_markup
             )
     except Exception as e:
         await callback.message.answer(
             f"❌ Ошибка при формировании предпросмотра:\n<code>{e}</code>\n\n"
-            f"Проверьте правильность HTML-разметки.",
-            parse_mode="HTML"
+            f"Проверьте правильность HTML-разметки."
         )
         await callback.answer()
         return
@@ -1150,42 +1162,39 @@ async def broadcast_preview(callback: CallbackQuery, state: FSMContext, bot: Bot
         "─────────────────\n"
         "👆 <b>Так выглядит ваше сообщение</b>\n\n"
         "Выберите действие:",
-        reply_markup=keyboards.get_broadcast_preview_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_preview_menu()
     )
     await callback.answer()
 
 
 # --- Редактирование из предпросмотра ---
 
-@router.callback_query(F.data == "broadcast_edit")
 async def broadcast_edit(callback: CallbackQuery, state: FSMContext):
     """Меню выбора что редактировать"""
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "✏️ <b>Редактирование рассылки</b>\n\n"
         "Что вы хотите изменить?",
-        reply_markup=keyboards.get_broadcast_edit_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_edit_menu()
     )
     await callback.answer()
 
 
-@router.callback_query(F.data == "broadcast_edit_photo_step")
 async def broadcast_edit_photo_step(callback: CallbackQuery, state: FSMContext):
     """Редактирование фото из меню редактирования"""
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
+    broadcast_data = await _load_bcast(state)
 
-    if broadcast_data.get("photo_id"):
-        await callback.message.edit_text(
+    if broadcast_data.photo_id:
+        await safe_edit(
+            callback.message,
             "🖼 <b>Редактирование картинки</b>\n\n"
             "Текущее фото загружено.\n"
             "Выберите действие:",
-            reply_markup=keyboards.get_broadcast_photo_edit_menu(),
-            parse_mode="HTML"
+            reply_markup=keyboards.get_broadcast_photo_edit_menu()
         )
     else:
-        await callback.message.edit_text(
+        await safe_edit(
+            callback.message,
             "🖼 <b>Картинка</b>\n\n"
             "Отправьте фото или нажмите «Пропустить»:",
             reply_markup=keyboards.get_broadcast_photo_menu()
@@ -1195,59 +1204,54 @@ async def broadcast_edit_photo_step(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@router.callback_query(F.data == "broadcast_edit_text_step")
 async def broadcast_edit_text_step(callback: CallbackQuery, state: FSMContext):
     """Редактирование текста из меню редактирования"""
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "📝 <b>Редактирование текста</b>\n\n"
         "Отправьте новый текст рассылки:",
-        reply_markup=keyboards.get_broadcast_text_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_text_menu()
     )
     await state.set_state(BroadcastStates.editing_text)
     await callback.answer()
 
 
-@router.callback_query(F.data == "broadcast_edit_button_step")
 async def broadcast_edit_button_step(callback: CallbackQuery, state: FSMContext):
     """Редактирование кнопки из меню редактирования"""
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
+    broadcast_data = await _load_bcast(state)
 
-    if broadcast_data.get("button_text") and broadcast_data.get("button_url"):
-        await callback.message.edit_text(
+    if broadcast_data.button_text and broadcast_data.button_url:
+        await safe_edit(
+            callback.message,
             f"🔘 <b>Редактирование кнопки</b>\n\n"
             f"Текущая кнопка:\n"
-            f"<b>Текст:</b> {broadcast_data['button_text']}\n"
-            f"<b>Ссылка:</b> {broadcast_data['button_url']}\n\n"
+            f"<b>Текст:</b> {broadcast_data.button_text}\n"
+            f"<b>Ссылка:</b> {broadcast_data.button_url}\n\n"
             f"Выберите действие:",
-            reply_markup=keyboards.get_broadcast_button_edit_menu(),
-            parse_mode="HTML"
+            reply_markup=keyboards.get_broadcast_button_edit_menu()
         )
     else:
-        await callback.message.edit_text(
+        await safe_edit(
+            callback.message,
             "🔘 <b>URL-кнопка</b>\n\n"
             "Хотите добавить кнопку со ссылкой под сообщением?",
-            reply_markup=keyboards.get_broadcast_button_menu(),
-            parse_mode="HTML"
+            reply_markup=keyboards.get_broadcast_button_menu()
         )
 
     await state.set_state(BroadcastStates.waiting_for_button)
     await callback.answer()
 
 
-@router.callback_query(F.data == "broadcast_edit_pin_step")
 async def broadcast_edit_pin_step(callback: CallbackQuery, state: FSMContext):
     """Редактирование закрепления из меню редактирования"""
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
-    pin_enabled = broadcast_data.get("pin_enabled", False)
+    broadcast_data = await _load_bcast(state)
+    pin_enabled = broadcast_data.pin_enabled
 
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "📌 <b>Закрепление</b>\n\n"
         "Закрепить сообщение в чате у получателей?",
-        reply_markup=keyboards.get_broadcast_pin_menu(pin_enabled),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_pin_menu(pin_enabled)
     )
     await state.set_state(BroadcastStates.pin_step)
     await callback.answer()
@@ -1255,23 +1259,23 @@ async def broadcast_edit_pin_step(callback: CallbackQuery, state: FSMContext):
 
 # --- Отмена рассылки ---
 
-@router.callback_query(F.data == "broadcast_cancel")
 async def broadcast_cancel(callback: CallbackQuery, state: FSMContext):
     """Отмена рассылки"""
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "❓ <b>Отменить рассылку?</b>\n\n"
         "Все введённые данные будут потеряны.",
-        reply_markup=keyboards.get_broadcast_confirm_cancel_menu(),
-        parse_mode="HTML"
+        reply_markup=keyboards.get_broadcast_confirm_cancel_menu()
     )
     await callback.answer()
 
 
-@router.callback_query(F.data == "broadcast_confirm_cancel")
 async def broadcast_confirm_cancel(callback: CallbackQuery, state: FSMContext):
     """Подтверждение отмены рассылки"""
+    await release_broadcast_targets(state)
     await state.clear()
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "❌ Рассылка отменена.\n\n"
         "Возвращаю в админ-панель.",
         reply_markup=keyboards.get_admin_menu()
@@ -1281,134 +1285,96 @@ async def broadcast_confirm_cancel(callback: CallbackQuery, state: FSMContext):
 
 # --- Отправка рассылки ---
 
-@router.callback_query(F.data == "broadcast_send")
-async def broadcast_send(callback: CallbackQuery, state: FSMContext, bot: Bot):
-    """Начало отправки рассылки"""
-    data = await state.get_data()
-    broadcast_data = data.get("broadcast", get_default_broadcast_data())
+async def broadcast_send(callback: CallbackQuery, state: FSMContext):
+    """Постановка рассылки в очередь фонового воркера"""
+    broadcast_data = await _load_bcast(state)
 
-    target_ids = broadcast_data.get("target_ids", [])
-    if not target_ids:
+    total_count = broadcast_data.target_count
+    if not total_count:
         await callback.answer("❌ Нет получателей!", show_alert=True)
         return
 
-    text = broadcast_data.get("text")
+    text = broadcast_data.text
     if not text:
         await callback.answer("❌ Текст сообщения обязателен!", show_alert=True)
         return
 
-    await callback.answer("🚀 Запускаю рассылку...")
+    # Список ID забираем из реестра (дальше он хранится в БД). Он уже очищен от
+    # повторов и мусора в process_broadcast_ids, поэтому счётчик получателей
+    # берём по фактическому списку: он же знаменатель прогресса у воркера
+    mode = broadcast_data.mode or "ids"
+    job_id = broadcast_data.job_id or uuid.uuid4().hex
+    target_ids = _broadcast_targets.pop(job_id, None) or array("q")
+    if mode != "all":
+        total_count = len(target_ids)
+        if not total_count:
+            await callback.answer(
+                "❌ Список получателей устарел, начните рассылку заново",
+                show_alert=True
+            )
+            return
+
+    await callback.answer("✅ Рассылка поставлена в очередь")
 
-    # Отправляем сообщение о начале
+    # Статусное сообщение: дальше его обновляет воркер
     status_msg = await callback.message.edit_text(
         f"🚀 <b>Рассылка запущена!</b>\n\n"
-        f"👥 Получателей: {len(target_ids)}\n"
-        f"⏳ Прогресс: 0/{len(target_ids)} (0%)",
-        parse_mode="HTML"
+        f"👥 Получателей: {total_count}\n"
+        f"⏳ Прогресс: 0/{total_count} (0%)"
     )
 
-    # Формируем клавиатуру
-    reply_markup = None
-    if broadcast_data.get("button_text") and broadcast_data.get("button_url"):
-        reply_markup = keyboards.get_broadcast_url_button(
-            broadcast_data["button_text"],
-            broadcast_data["button_url"]
-        )
-
-    # Статистика
-    success_count = 0
-    blocked_count = 0
-    error_count = 0
-    start_time = time.time()
-
-    # Получаем данные для отправки
-    photo_id = broadcast_data.get("photo_id")
-    pin_enabled = broadcast_data.get("pin_enabled", False)
-
-    # Отправка с anti-flood
-    for idx, user_id in enumerate(target_ids, 1):
-        try:
-            # Отправляем сообщение
-            if photo_id:
-                sent_msg = await bot.send_photo(
-                    chat_id=user_id,
-                    photo=photo_id,
-                    caption=text,
-                    reply_markup=reply_markup,
-                    parse_mode="HTML"
-                )
-            else:
-                sent_msg = await bot.send_message(
-                    chat_id=user_id,
-                    text=text,
-                    reply_markup=reply_markup,
-                    parse_mode="HTML"
-                )
-
-            # Закрепляем если нужно
-            if pin_enabled:
-                try:
-                    await bot.pin_chat_message(
-                        chat_id=user_id,
-                        message_id=sent_msg.message_id,
-                        disable_notification=True
-                    )
-                except Exception:
-                    pass  # Игнорируем ошибки закрепления
-
-            success_count += 1
-
-        except TelegramForbiddenError:
-            # Бот заблокирован пользователем
-            blocked_count += 1
-        except TelegramNotFound:
-            # Чат/пользователь не найден
-            blocked_count += 1
-        except TelegramBadRequest as e:
-            # Другие ошибки Telegram API
-            error_count += 1
-            logger.warning(f"Broadcast error for user {user_id}: {e}")
-        except Exception as e:
-            error_count += 1
-            logger.error(f"Unexpected broadcast error for user {user_id}: {e}")
-
-        # Anti-flood delay
-        await asyncio.sleep(0.05)
-
-        # Обновляем прогресс каждые 10 сообщений или в конце
-        if idx % 10 == 0 or idx == len(target_ids):
-            progress_percent = int((idx / len(target_ids)) * 100)
-            try:
-                await status_msg.edit_text(
-                    f"🚀 <b>Рассылка в процессе...</b>\n\n"
-                    f"👥 Получателей: {len(target_ids)}\n"
-                    f"⏳ Прогресс: {idx}/{len(target_ids)} ({progress_percent}%)\n\n"
-                    f"✅ Успешно: {success_count}\n"
-                    f"🚫 Заблокировали: {blocked_count}\n"
-                    f"⚠️ Ошибки: {error_count}",
-                    parse_mode="HTML"
-                )
-            except Exception:
-                pass  # Игнорируем ошибки обновления статуса
-
-    # Расчёт времени
-    elapsed_time = round(time.time() - start_time, 1)
-
-    # Финальный отчёт
-    await status_msg.edit_text(
-        f"📊 <b>Рассылка завершена!</b>\n\n"
-        f"✅ Успешно доставлено: {success_count}\n"
-        f"🚫 Бот заблокирован: {blocked_count}\n"
-        f"⚠️ Ошибки: {error_count}\n"
-        f"⏱ Время выполнения: {elapsed_time} сек",
-        reply_markup=keyboards.get_admin_menu(),
-        parse_mode="HTML"
+    job = BroadcastJob(
+        job_id=job_id,
+        admin_chat_id=status_msg.chat.id,
+        status_message_id=status_msg.message_id,
+        mode=mode,
+        total_count=total_count,
+        text=text,
+        photo_id=broadcast_data.photo_id,
+        button_text=broadcast_data.button_text,
+        button_url=broadcast_data.button_url,
+        pin_enabled=broadcast_data.pin_enabled,
     )
+    # Задание и получатели сохраняются в БД: после перезапуска бота рассылка продолжится
+    ahead = await broadcast_worker.submit(job, target_ids if mode != "all" else None)
+    if ahead:
+        logger.info(f"Broadcast {job_id} queued behind {ahead} job(s)")
 
-    # Очищаем состояние
+    # Очищаем состояние - обработчик не ждёт окончания рассылки
     await state.clear()
 
-    logger.info(
-        f"Broadcast completed: success={success_count}, blocked={blocked_count}, "
-        f"errors={error_count}, time={elapsed_time}s"
-    )
+
+# Все callback'и рассылки - одним обработчиком: роутер проверяет одно вхождение
+# в множество вместо отдельного фильтра F.data == "..." на каждый шаг,
+# дальше - поиск обработчика в словаре
+_BROADCAST_DISPATCH: dict[str, Callable[[CallbackQuery, FSMContext], Awaitable[None]]] = {
+    "admin_broadcast_all": admin_broadcast_all_start,
+    "admin_broadcast_ids": admin_broadcast_ids_start,
+    "broadcast_skip_photo": broadcast_photo_next,
+    "broadcast_photo_next": broadcast_photo_next,
+    "broadcast_replace_photo": broadcast_replace_photo,
+    "broadcast_delete_photo": broadcast_delete_photo,
+    "broadcast_edit_text": broadcast_edit_text,
+    "broadcast_text_next": broadcast_text_next,
+    "broadcast_add_button": broadcast_add_button,
+    "broadcast_button_back": broadcast_button_back,
+    "broadcast_skip_button": broadcast_button_next,
+    "broadcast_button_next": broadcast_button_next,
+    "broadcast_delete_button": broadcast_delete_button,
+    "broadcast_toggle_pin": broadcast_toggle_pin,
+    "broadcast_preview": broadcast_preview,
+    "broadcast_edit": broadcast_edit,
+    "broadcast_edit_photo_step": broadcast_edit_photo_step,
+    "broadcast_edit_text_step": broadcast_edit_text_step,
+    "broadcast_edit_button_step": broadcast_edit_button_step,
+    "broadcast_edit_pin_step": broadcast_edit_pin_step,
+    "broadcast_cancel": broadcast_cancel,
+    "broadcast_confirm_cancel": broadcast_confirm_cancel,
+    "broadcast_send": broadcast_send,
+}
+
+
+@router.callback_query(F.data.in_(frozenset(_BROADCAST_DISPATCH)))
+async def broadcast_callback(callback: CallbackQuery, state: FSMContext):
+    """Маршрутизация callback'ов рассылки по таблице _BROADCAST_DISPATCH"""
+    await _BROADCAST_DISPATCH[callback.data](callback, state)
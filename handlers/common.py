@@ -0,0 +1,45 @@
+"""
+Common Handler Helpers
+Message-editing helpers shared by the user and admin routers
+"""
+
+import asyncio
+import logging
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+# Одновременных правок сообщений не больше N (лимит Bot API ~30 запросов/с);
+# на TelegramRetryAfter правка повторяется один раз после паузы
+EDIT_CONCURRENCY = 28
+_edit_semaphore = asyncio.Semaphore(EDIT_CONCURRENCY)
+
+
+def _shows(message: Message, text: str, reply_markup) -> bool:
+    """Сообщение уже показывает этот текст (HTML) с этой клавиатурой"""
+    if message.text is None:
+        return False
+    return message.html_text == text.strip() and message.reply_markup == reply_markup
+
+
+async def safe_edit(message: Message, text: str, **kwargs):
+    """
+    edit_text под общим семафором. Если сообщение уже показывает то же содержимое
+    (повторное нажатие той же кнопки), запрос не отправляется - Telegram ответил бы
+    "message is not modified".
+    """
+    if _shows(message, text, kwargs.get("reply_markup")):
+        return message
+    async with _edit_semaphore:
+        try:
+            return await message.edit_text(text, **kwargs)
+        except TelegramRetryAfter as e:
+            logger.warning(f"Edit rate limited, retrying in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+            return await message.edit_text(text, **kwargs)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+            return message
@@ -0,0 +1,53 @@
+"""
+Middlewares Module
+Dispatcher-level middlewares shared by all routers
+"""
+
+import time
+from contextlib import suppress
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery
+
+# Повторное нажатие той же кнопки тем же пользователем чаще, чем раз в N секунд, отбрасывается
+CALLBACK_DEBOUNCE = 0.7
+# Сколько пар (пользователь, кнопка) помним, прежде чем вычистить устаревшие
+CALLBACK_DEBOUNCE_MAX = 50_000
+
+
+class CallbackThrottleMiddleware(BaseMiddleware):
+    """Гасит двойные/тройные нажатия: дубликат получает пустой answer() и не доходит до хэндлера"""
+
+    def __init__(self, interval: float = CALLBACK_DEBOUNCE, max_size: int = CALLBACK_DEBOUNCE_MAX):
+        self.interval = interval
+        self.max_size = max_size
+        self._last_seen: Dict[tuple[int, str], float] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[CallbackQuery, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        key = (event.from_user.id, event.data or "")
+        now = time.monotonic()
+        last = self._last_seen.get(key)
+        if last is not None and now - last < self.interval:
+            # Убираем "часики" на кнопке; запрос мог уже устареть - это не ошибка
+            with suppress(TelegramBadRequest):
+                await event.answer()
+            return None
+
+        self._last_seen[key] = now
+        if len(self._last_seen) > self.max_size:
+            self._prune(now)
+        return await handler(event, data)
+
+    def _prune(self, now: float):
+        """Удалить записи старше окна; при сплошном всплеске - сбросить всё"""
+        cutoff = now - self.interval
+        self._last_seen = {k: t for k, t in self._last_seen.items() if t >= cutoff}
+        if len(self._last_seen) > self.max_size:
+            self._last_seen.clear()
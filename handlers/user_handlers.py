@@ -5,7 +5,9 @@ Handles all user interactions, FSM states, and parsing logic
 
 import logging
 import asyncio
+import re
 import time
+from typing import Awaitable, Callable, Optional
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.filters import Command, StateFilter
@@ -17,22 +19,117 @@ import keyboards
 import config
 from database import db
 from services.telethon_core import telethon_core
-from utils.excel_generator import excel_generator, SmartExportResult
+from handlers.common import safe_edit
 
 logger = logging.getLogger(__name__)
 
 # Минимальный интервал между обновлениями прогресса (секунды)
 PROGRESS_UPDATE_INTERVAL = 3.0
 
+# Формат ссылки на чат/канал (те же, что понимает telethon_core.join_chat) и номера телефона.
+# Компилируются один раз; fullmatch не пропускает мусор вроде "@@@" до запроса в Telegram
+_LINK_RE = re.compile(r"(?:https?://)?t\.me/(?:joinchat/|\+)?[\w-]+/?(?:\?\S*)?|@\w{4,}")
+_PHONE_RE = re.compile(r"\+\d{9,15}")
+# Разделители, которые пользователи вставляют в код подтверждения ("12-345", "1 2 3 4 5")
+_CODE_STRIP = str.maketrans("", "", "- \t\n\r")
+
 router = Router()
 
+# Telethon-операции из хэндлеров (send_code/sign_in/join_chat/get_user_dialogs) держат
+# клиент с соединением на секунды; сверх лимита запросы ждут очереди, а не плодят клиентов
+_telethon_semaphore = asyncio.Semaphore(config.TELETHON_CONCURRENCY)
+
+
+async def _telethon_call(coro):
+    """Выполнить корутину telethon_core под общим семафором"""
+    async with _telethon_semaphore:
+        return await coro
+
+# Приветствие главного меню: значения из config не меняются во время работы,
+# поэтому текст собирается один раз при импорте
+_WELCOME_TEXT = f"""
+👋 <b>Добро пожаловать в NeuroScraper Pro!</b>
+
+🔥 <b>Профессиональный инструмент для парсинга аудитории Telegram</b>
+
+<b>Возможности бота:</b>
+
+📊 <b>Парсинг каналов</b> — комментаторы из постов
+👥 <b>Парсинг чатов</b> — участники и активные
+🔒 <b>Мои Чаты</b> — парсинг закрытых групп
+📈 <b>Умная выгрузка</b> — 4 файла (админы, премиум, обычные, полный отчёт)
+
+⏱ <b>Фильтры:</b> день / неделя / месяц / 3 месяца
+
+🔐 <b>Многоаккаунтность</b> — добавляйте свои Telegram аккаунты
+
+💎 <b>Ваш лимит:</b> {config.FREE_PARSING_LIMIT} бесплатных парсингов
+👥 <b>Реферальная программа:</b> +{config.REFERRAL_BONUS} парсинга за друга!
+
+Выберите действие в меню ниже:
+"""
+
+
+_LIMIT_EXCEEDED_TEXT = (
+    f"❌ <b>Лимит исчерпан ({config.FREE_PARSING_LIMIT}/{config.FREE_PARSING_LIMIT})</b>\n\n"
+    "Ваши бесплатные парсинги закончились.\n\n"
+    "💡 <b>Способы получить больше:</b>\n"
+    "• Купить подписку\n"
+    f"• Пригласить друга (+{config.REFERRAL_BONUS} парсинга)"
+)
+
+
+async def _reserve_attempt(callback: CallbackQuery, state: FSMContext) -> Optional[dict]:
+    """
+    Атомарно списать попытку перед запуском парсинга.
+    Проверка лимита на входе в меню только информирует: два одновременных запуска
+    с последней попыткой проходят её оба, а try_consume пропустит лишь один.
+    Возвращает ответ try_consume или None (показан экран исчерпанного лимита).
+    """
+    limit_info = await db.try_consume(callback.from_user.id)
+    if limit_info is None:
+        await safe_edit(callback.message,
+            _LIMIT_EXCEEDED_TEXT,
+            reply_markup=keyboards.get_limit_exceeded_menu_v2(),
+            parse_mode="HTML"
+        )
+        await state.clear()
+    return limit_info
+
+
+async def _refund_attempt(user_id: int, limit_info: dict):
+    """Вернуть попытку, если парсинг не дошёл до выдачи файлов"""
+    # remaining == -1: безлимит (премиум/админ/открытый доступ) - счётчик не менялся
+    if limit_info["remaining"] != -1:
+        await db.add_parsing_attempts(user_id, 1)
 
 # ===== ПРОВЕРКА ПОДПИСКИ НА КАНАЛ =====
 
+# Результаты проверки подписки в памяти: user_id -> (истекает в, подписан).
+# Подтверждённая подписка живёт долго, отказ - коротко, чтобы только что
+# подписавшийся пользователь не ждал
+SUBSCRIPTION_TTL = 600.0
+SUBSCRIPTION_NEGATIVE_TTL = 30.0
+SUBSCRIPTION_CACHE_MAX = 100_000
+_subscription_cache: dict[int, tuple[float, bool]] = {}
+
+
+def _remember_subscription(user_id: int, is_subscribed: bool):
+    now = time.monotonic()
+    if len(_subscription_cache) >= SUBSCRIPTION_CACHE_MAX:
+        # Сначала выбрасываем просроченные записи, при переполнении - всё
+        for key in [key for key, (expires, _) in _subscription_cache.items() if expires <= now]:
+            del _subscription_cache[key]
+        if len(_subscription_cache) >= SUBSCRIPTION_CACHE_MAX:
+            _subscription_cache.clear()
+    ttl = SUBSCRIPTION_TTL if is_subscribed else SUBSCRIPTION_NEGATIVE_TTL
+    _subscription_cache[user_id] = (now + ttl, is_subscribed)
+
+
 async def check_subscription(bot, user_id: int, skip_cache: bool = False) -> bool:
     """
     Проверяет подписку пользователя на обязательный канал.
-    Сначала проверяет кэш в БД, затем Telegram API если нужно.
+    Сначала проверяет кэш в памяти и в БД, затем Telegram API если нужно.
     Возвращает True если подписан, False если нет.
     
     Args:
@@ -40,11 +137,15 @@ async def check_subscription(bot, user_id: int, skip_cache: bool = False) -> boo
         user_id: ID пользователя
         skip_cache: Если True, пропустить проверку кэша и сразу идти в Telegram API
     """
-    # 1. Сначала проверяем кэш в базе данных (если не указано пропустить)
+    # 1. Сначала проверяем кэш в памяти, затем в базе данных (если не указано пропустить)
     if not skip_cache:
+        cached = _subscription_cache.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
         is_cached = await db.is_subscription_verified(user_id)
         if is_cached:
             logger.debug(f"Subscription verified from cache for user {user_id}")
+            _remember_subscription(user_id, True)
             return True
     
     # 2. Проверяем через Telegram API
@@ -58,6 +159,7 @@ async def check_subscription(bot, user_id: int, skip_cache: bool = False) -> boo
             await db.set_subscription_verified(user_id, True)
             logger.info(f"Subscription verified and cached for user {user_id}")
         
+        _remember_subscription(user_id, is_subscribed)
         return is_subscribed
     except Exception as e:
         logger.warning(f"Subscription check failed for user {user_id}: {e}")
@@ -91,64 +193,88 @@ class JoinChatStates(StatesGroup):
     enter_link = State()
 
 
+# Повторный /start того же пользователя в пределах окна игнорируется:
+# серия нажатий не гоняет БД, проверку подписки и отправку приветствия заново
+START_COALESCE_WINDOW = 1.0
+START_COALESCE_MAX = 100_000
+_last_start: dict[int, float] = {}
+
+
+def _is_start_burst(user_id: int) -> bool:
+    """True, если этот /start - повтор в пределах START_COALESCE_WINDOW"""
+    now = time.monotonic()
+    last = _last_start.get(user_id)
+    if last is not None and now - last < START_COALESCE_WINDOW:
+        return True
+    if len(_last_start) >= START_COALESCE_MAX:
+        # Записи старше окна уже ничего не блокируют; при переполнении - сбрасываем всё
+        for key in [key for key, ts in _last_start.items() if now - ts >= START_COALESCE_WINDOW]:
+            del _last_start[key]
+        if len(_last_start) >= START_COALESCE_MAX:
+            _last_start.clear()
+    _last_start[user_id] = now
+    return False
+
+
 # Команда /start с поддержкой реферальных ссылок
 @router.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext):
     """Обработчик команды /start с Deep Linking для рефералов"""
+    user_id = message.from_user.id
+    if _is_start_burst(user_id):
+        return
+
     await state.clear()
 
-    user_id = message.from_user.id
     username = message.from_user.username
     first_name = message.from_user.first_name
     last_name = message.from_user.last_name
+
+    # Проверка подписки (запрос к Telegram) не зависит от работы с БД ниже:
+    # запускаем её сразу, а ждём только перед ответом пользователю
+    subscription_task = asyncio.create_task(check_subscription(message.bot, user_id))
     
     # Проверяем реферальный аргумент (Deep Linking)
     referrer_id = None
-    args = message.text.split()
-    if len(args) > 1:
+    # Deep link приходит как "/start <id>": берём хвост без разбиения на список
+    _, _, start_arg = message.text.partition(" ")
+    if start_arg:
         try:
-            potential_referrer = int(args[1])
+            potential_referrer = int(start_arg.strip())
             # Проверяем что реферер существует и это не сам пользователь
             if potential_referrer != user_id:
                 referrer_user = await db.get_user(potential_referrer)
                 if referrer_user:
                     referrer_id = potential_referrer
                     logger.info(f"User {user_id} came from referral link of {referrer_id}")
-        except (ValueError, IndexError):
+        except ValueError:
             pass
 
-    # Создаем или обновляем пользователя в БД
-    user = await db.get_user(user_id)
-    is_new_user = False
-    
-    if not user:
-        is_new_user = True
-        await db.create_user(user_id, username, first_name, last_name, referrer_id)
-        
-        # Начисляем бонус рефереру если есть
-        if referrer_id:
-            bonus_added = await db.add_referral_bonus(referrer_id, user_id)
-            if bonus_added:
-                # Уведомляем реферера о новом приглашённом (с кнопкой меню!)
-                try:
-                    from aiogram import Bot
-                    bot = message.bot
-                    await bot.send_message(
-                        referrer_id,
-                        f"🎉 <b>По вашей ссылке пришёл друг!</b>\n\n"
-                        f"Вам начислено <b>+{config.REFERRAL_BONUS} парсинга</b>!\n\n"
-                        f"Продолжайте приглашать друзей для получения бонусов.\n\n"
-                        f"👇 Нажмите кнопку ниже для продолжения:",
-                        reply_markup=keyboards.get_main_menu(),  # Кнопка меню!
-                        parse_mode="HTML"
-                    )
-                except Exception as e:
-                    logger.warning(f"Could not notify referrer {referrer_id}: {e}")
-    else:
-        await db.update_user_activity(user_id)
+    # Создаем или обновляем пользователя в БД (один запрос; бонус рефереру - там же)
+    is_new_user = await db.upsert_user(user_id, username, first_name, last_name, referrer_id)
+
+    if is_new_user and referrer_id:
+        # Уведомляем реферера о новом приглашённом (с кнопкой меню!)
+        try:
+            from aiogram import Bot
+            bot = message.bot
+            await bot.send_message(
+                referrer_id,
+                f"🎉 <b>По вашей ссылке пришёл друг!</b>\n\n"
+                f"Вам начислено <b>+{config.REFERRAL_BONUS} парсинга</b>!\n\n"
+                f"Продолжайте приглашать друзей для получения бонусов.\n\n"
+                f"👇 Нажмите кнопку ниже для продолжения:",
+                reply_markup=keyboards.get_main_menu(),  # Кнопка меню!
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            logger.warning(f"Could not notify referrer {referrer_id}: {e}")
 
     # ===== ПРОВЕРКА ПОДПИСКИ НА КАНАЛ =====
-    is_subscribed = await check_subscription(message.bot, user_id)
+    is_subscribed = await subscription_task
+    if is_subscribed and is_new_user:
+        # Проверка могла завершиться раньше, чем пользователь появился в БД
+        await db.set_subscription_verified(user_id, True)
     
     if not is_subscribed:
         # Пользователь НЕ подписан - показываем сообщение с просьбой подписаться
@@ -166,30 +292,8 @@ async def cmd_start(message: Message, state: FSMContext):
         return  # Прерываем выполнение, не показываем главное меню
 
     # ===== ПОЛЬЗОВАТЕЛЬ ПОДПИСАН - показываем главное меню =====
-    welcome_text = f"""
-👋 <b>Добро пожаловать в NeuroScraper Pro!</b>
-
-🔥 <b>Профессиональный инструмент для парсинга аудитории Telegram</b>
-
-<b>Возможности бота:</b>
-
-📊 <b>Парсинг каналов</b> — комментаторы из постов
-👥 <b>Парсинг чатов</b> — участники и активные
-🔒 <b>Мои Чаты</b> — парсинг закрытых групп
-📈 <b>Умная выгрузка</b> — 4 файла (админы, премиум, обычные, полный отчёт)
-
-⏱ <b>Фильтры:</b> день / неделя / месяц / 3 месяца
-
-🔐 <b>Многоаккаунтность</b> — добавляйте свои Telegram аккаунты
-
-💎 <b>Ваш лимит:</b> {config.FREE_PARSING_LIMIT} бесплатных парсингов
-👥 <b>Реферальная программа:</b> +{config.REFERRAL_BONUS} парсинга за друга!
-
-Выберите действие в меню ниже:
-"""
-
     await message.answer(
-        welcome_text,
+        _WELCOME_TEXT,
         reply_markup=keyboards.get_main_menu(),
         parse_mode="HTML"
     )
@@ -202,39 +306,20 @@ async def check_subscription_callback(callback: CallbackQuery):
     """Обработчик кнопки 'Проверить подписку'"""
     user_id = callback.from_user.id
     
-    is_subscribed = await check_subscription(callback.bot, user_id)
+    # Пользователь явно просит перепроверить - кэшированный отказ не используем
+    is_subscribed = await check_subscription(callback.bot, user_id, skip_cache=True)
     
     if is_subscribed:
         # Пользователь подписан - показываем главное меню
-        await callback.message.edit_text(
-            f"""
-👋 <b>Добро пожаловать в NeuroScraper Pro!</b>
-
-🔥 <b>Профессиональный инструмент для парсинга аудитории Telegram</b>
-
-<b>Возможности бота:</b>
-
-📊 <b>Парсинг каналов</b> — комментаторы из постов
-👥 <b>Парсинг чатов</b> — участники и активные
-🔒 <b>Мои Чаты</b> — парсинг закрытых групп
-📈 <b>Умная выгрузка</b> — 4 файла (админы, премиум, обычные, полный отчёт)
-
-⏱ <b>Фильтры:</b> день / неделя / месяц / 3 месяца
-
-🔐 <b>Многоаккаунтность</b> — добавляйте свои Telegram аккаунты
-
-💎 <b>Ваш лимит:</b> {config.FREE_PARSING_LIMIT} бесплатных парсингов
-👥 <b>Реферальная программа:</b> +{config.REFERRAL_BONUS} парсинга за друга!
-
-Выберите действие в меню ниже:
-""",
+        await safe_edit(callback.message,
+            _WELCOME_TEXT,
             reply_markup=keyboards.get_main_menu(),
             parse_mode="HTML"
         )
         await callback.answer("✅ Подписка подтверждена!")
     else:
         # Пользователь НЕ подписан
-        await callback.message.edit_text(
+        await safe_edit(callback.message,
             "❌ <b>К сожалению вы не подписаны на канал</b>\n\n"
             "Подпишитесь на канал и нажмите кнопку проверки снова.",
             reply_markup=keyboards.get_not_subscribed_menu(),
@@ -247,19 +332,20 @@ async def check_subscription_callback(callback: CallbackQuery):
 @router.callback_query(F.data == "back_to_main")
 async def back_to_main(callback: CallbackQuery, state: FSMContext):
     """Возврат в главное меню"""
+    await callback.answer()
     await state.clear()
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         "🏠 <b>Главное меню</b>\n\nВыберите действие:",
         reply_markup=keyboards.get_main_menu(),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 # Мой лимит
 @router.callback_query(F.data == "my_limit")
 async def show_limit(callback: CallbackQuery):
     """Показать информацию о лимите"""
+    await callback.answer()
     user_id = callback.from_user.id
     limit_info = await db.check_limit(user_id)
     ref_stats = await db.get_referral_stats(user_id)
@@ -286,29 +372,29 @@ async def show_limit(callback: CallbackQuery):
 • Заработано: +{ref_stats['total_bonus']} парсингов
 """
 
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         text,
         reply_markup=keyboards.get_back_button(),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 # Помощь
 @router.callback_query(F.data == "help")
 async def show_help(callback: CallbackQuery):
     """Показать меню помощи"""
-    await callback.message.edit_text(
+    await callback.answer()
+    await safe_edit(callback.message,
         "❓ <b>Раздел помощи</b>\n\nВыберите интересующую тему:",
         reply_markup=keyboards.get_help_menu(),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 @router.callback_query(F.data == "help_channels")
 async def help_channels(callback: CallbackQuery):
     """Помощь по парсингу каналов"""
+    await callback.answer()
     text = """
 📖 <b>Как парсить каналы</b>
 
@@ -335,17 +421,17 @@ async def help_channels(callback: CallbackQuery):
 <b>Примечание:</b>
 Для парсинга публичных каналов используйте системную сессию.
 """
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         text,
         reply_markup=keyboards.get_help_menu(),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 @router.callback_query(F.data == "help_chats")
 async def help_chats(callback: CallbackQuery):
     """Помощь по парсингу чатов"""
+    await callback.answer()
     text = """
 📖 <b>Как парсить чаты</b>
 
@@ -376,17 +462,17 @@ async def help_chats(callback: CallbackQuery):
 • Список администраторов
 • Статистика активности
 """
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         text,
         reply_markup=keyboards.get_help_menu(),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 @router.callback_query(F.data == "help_account")
 async def help_account(callback: CallbackQuery):
     """Помощь по добавлению аккаунта"""
+    await callback.answer()
     text = """
 📖 <b>Как добавить аккаунт</b>
 
@@ -419,12 +505,11 @@ async def help_account(callback: CallbackQuery):
 • Просмотреть добавленные аккаунты
 • Удалить аккаунт
 """
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         text,
         reply_markup=keyboards.get_help_menu(),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 # ===== ДОБАВЛЕНИЕ АККАУНТА =====
@@ -432,6 +517,7 @@ async def help_account(callback: CallbackQuery):
 @router.callback_query(F.data == "add_account")
 async def start_add_account(callback: CallbackQuery, state: FSMContext):
     """Начало процесса добавления аккаунта"""
+    await callback.answer()
     text = """
 ➕ <b>Добавление аккаунта</b>
 
@@ -444,23 +530,22 @@ async def start_add_account(callback: CallbackQuery, state: FSMContext):
 
 <i>Убедитесь, что номер указан правильно!</i>
 """
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         text,
         reply_markup=keyboards.get_cancel_button(),
         parse_mode="HTML"
     )
     await state.set_state(AddAccountStates.waiting_for_phone)
-    await callback.answer()
 
 
 @router.message(AddAccountStates.waiting_for_phone)
 async def process_phone(message: Message, state: FSMContext):
     """Обработка введенного телефона"""
-    phone = message.text.strip()
+    phone = message.text.strip().replace(" ", "")
     user_id = message.from_user.id
 
     # Валидация номера
-    if not phone.startswith('+') or len(phone) < 10:
+    if not _PHONE_RE.fullmatch(phone):
         await message.answer(
             "❌ Неверный формат номера!\n\nИспользуйте формат: +79991234567",
             reply_markup=keyboards.get_cancel_button()
@@ -473,7 +558,7 @@ async def process_phone(message: Message, state: FSMContext):
     # Отправляем код (показываем статус)
     wait_msg = await message.answer("⏳ Отправляем код...")
 
-    success, msg, phone_code_hash = await telethon_core.send_code(phone, session_name)
+    success, msg, phone_code_hash = await _telethon_call(telethon_core.send_code(phone, session_name))
 
     if not success:
         # Редактируем сообщение вместо удаления+создания
@@ -527,7 +612,7 @@ async def process_phone(message: Message, state: FSMContext):
 @router.message(AddAccountStates.waiting_for_code)
 async def process_code(message: Message, state: FSMContext):
     """Обработка кода авторизации"""
-    code = message.text.strip().replace('-', '').replace(' ', '')
+    code = message.text.translate(_CODE_STRIP)
 
     # Удаляем сообщение пользователя с кодом (безопасность)
     try:
@@ -554,12 +639,12 @@ async def process_code(message: Message, state: FSMContext):
 
     wait_msg = await message.answer("⏳ Проверяем код...")
 
-    success, msg = await telethon_core.sign_in(
+    success, msg = await _telethon_call(telethon_core.sign_in(
         phone,
         code,
         phone_code_hash,
         session_name
-    )
+    ))
 
     # Требуется 2FA
     if msg == "NEED_2FA":
@@ -578,7 +663,7 @@ async def process_code(message: Message, state: FSMContext):
     # Код устарел - автоматически запрашиваем новый
     if msg == "CODE_EXPIRED":
         logger.info(f"Code expired for {phone}, requesting new code...")
-        success_resend, msg_resend, new_hash = await telethon_core.send_code(phone, session_name)
+        success_resend, msg_resend, new_hash = await _telethon_call(telethon_core.send_code(phone, session_name))
         
         if success_resend and new_hash:
             # Обновляем hash в состоянии
@@ -657,13 +742,13 @@ async def process_2fa(message: Message, state: FSMContext):
     wait_msg = await message.answer("⏳ Проверяем пароль...")
 
     # Повторная попытка входа с паролем
-    success, msg = await telethon_core.sign_in(
+    success, msg = await _telethon_call(telethon_core.sign_in(
         phone,
         "",  # Код уже был использован
         phone_code_hash,
         session_name,
         password=password
-    )
+    ))
 
     if not success:
         # Редактируем сообщение вместо удаления
@@ -690,15 +775,7 @@ async def process_2fa(message: Message, state: FSMContext):
     await state.clear()
 
 
-# Мои аккаунты
-@router.callback_query(F.data == "my_accounts")
-async def show_my_accounts(callback: CallbackQuery):
-    """Показать список аккаунтов пользователя"""
-    user_id = callback.from_user.id
-    sessions = await db.get_user_sessions(user_id)
-
-    if not sessions:
-        text = """
+_NO_ACCOUNTS_TEXT = """
 📱 <b>Мои аккаунты</b>
 
 У вас пока нет добавленных аккаунтов.
@@ -708,42 +785,51 @@ async def show_my_accounts(callback: CallbackQuery):
 
 Нажмите кнопку ниже, чтобы добавить аккаунт:
 """
-    else:
-        text = f"📱 <b>Ваши аккаунты ({len(sessions)}):</b>\n\n"
-        for idx, session in enumerate(sessions, 1):
-            text += f"  {idx}. <code>{session['phone_number']}</code>\n"
 
-        text += "\n<i>Нажмите на номер для управления</i>"
 
-    await callback.message.edit_text(
-        text,
+def _accounts_text(sessions: list) -> str:
+    """Текст экрана "Мои аккаунты" для списка сессий"""
+    if not sessions:
+        return _NO_ACCOUNTS_TEXT
+    lines = [f"📱 <b>Ваши аккаунты ({len(sessions)}):</b>\n"]
+    lines.extend(
+        f"  {idx}. <code>{session['phone_number']}</code>"
+        for idx, session in enumerate(sessions, 1)
+    )
+    lines.append("\n<i>Нажмите на номер для управления</i>")
+    return "\n".join(lines)
+
+
+# Мои аккаунты
+@router.callback_query(F.data == "my_accounts")
+async def show_my_accounts(callback: CallbackQuery):
+    """Показать список аккаунтов пользователя"""
+    await callback.answer()
+    user_id = callback.from_user.id
+    sessions = await db.get_user_sessions(user_id)
+
+    await safe_edit(callback.message,
+        _accounts_text(sessions),
         reply_markup=keyboards.get_my_accounts_menu(sessions),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 # Просмотр конкретного аккаунта
-@router.callback_query(F.data.startswith("view_account_"))
-async def view_account(callback: CallbackQuery):
+async def view_account(callback: CallbackQuery, session_name: str, state: FSMContext):
     """Просмотр информации об аккаунте"""
-    session_name = callback.data.replace("view_account_", "")
     user_id = callback.from_user.id
     
-    # Получаем сессии пользователя
-    sessions = await db.get_user_sessions(user_id)
-    session_info = None
-    for s in sessions:
-        if s["session_name"] == session_name:
-            session_info = s
-            break
+    # Получаем сессию пользователя
+    session_info = await db.get_session_by_name(user_id, session_name)
     
     if not session_info:
         await callback.answer("❌ Аккаунт не найден", show_alert=True)
         return
+    await callback.answer()
     
     phone = session_info["phone_number"]
-    created = session_info.get("created_at", "N/A")
+    created = session_info["created_at"] or "N/A"
     
     text = f"""
 📱 <b>Информация об аккаунте</b>
@@ -755,28 +841,22 @@ async def view_account(callback: CallbackQuery):
 <b>Действия:</b>
 """
     
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         text,
         reply_markup=keyboards.get_account_actions_menu(session_name, phone),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 # Удаление аккаунта - запрос подтверждения
-@router.callback_query(F.data.startswith("delete_session_"))
-async def delete_session_confirm(callback: CallbackQuery):
+async def delete_session_confirm(callback: CallbackQuery, session_name: str, state: FSMContext):
     """Запрос подтверждения удаления аккаунта"""
-    session_name = callback.data.replace("delete_session_", "")
+    await callback.answer()
     user_id = callback.from_user.id
     
     # Получаем информацию о сессии
-    sessions = await db.get_user_sessions(user_id)
-    phone = "неизвестно"
-    for s in sessions:
-        if s["session_name"] == session_name:
-            phone = s["phone_number"]
-            break
+    session_info = await db.get_session_by_name(user_id, session_name)
+    phone = session_info["phone_number"] if session_info else "неизвестно"
     
     text = f"""
 ⚠️ <b>Подтверждение удаления</b>
@@ -788,41 +868,36 @@ async def delete_session_confirm(callback: CallbackQuery):
 <b>Внимание:</b> После удаления для повторного добавления потребуется заново ввести код из Telegram.
 """
     
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         text,
         reply_markup=keyboards.get_confirm_delete_menu(session_name),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 # Подтверждение удаления аккаунта
-@router.callback_query(F.data.startswith("confirm_delete_"))
-async def confirm_delete_session(callback: CallbackQuery):
+async def confirm_delete_session(callback: CallbackQuery, session_name: str, state: FSMContext):
     """Удалить аккаунт после подтверждения"""
-    session_name = callback.data.replace("confirm_delete_", "")
+    await callback.answer()
     user_id = callback.from_user.id
     
-    # Удаляем сессию из БД
-    await db.deactivate_session(session_name)
-    
-    # Удаляем файл сессии
-    await telethon_core.delete_session(session_name)
-    
-    await callback.message.edit_text(
-        "✅ <b>Аккаунт успешно удалён!</b>\n\n"
-        "Теперь вы можете добавить его заново при необходимости.",
-        parse_mode="HTML"
+    # Запись в БД, удаление файла сессии и чтение списка аккаунтов независимы -
+    # выполняем параллельно. Читатель может ещё увидеть удаляемую сессию,
+    # поэтому она отфильтровывается из результата
+    _, _, sessions = await asyncio.gather(
+        db.deactivate_session(session_name),
+        telethon_core.delete_session(session_name),
+        db.get_user_sessions(user_id)
     )
+    sessions = [s for s in sessions if s["session_name"] != session_name]
     
-    # Показываем обновлённый список
-    sessions = await db.get_user_sessions(user_id)
-    await callback.message.answer(
-        "📱 <b>Мои аккаунты</b>",
+    # Подтверждение и обновлённый список - одним сообщением
+    await safe_edit(callback.message,
+        "✅ <b>Аккаунт успешно удалён!</b>\n\n"
+        + _accounts_text(sessions).lstrip(),
         reply_markup=keyboards.get_my_accounts_menu(sessions),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 # ===== ВСТУПЛЕНИЕ В ЧАТ/КАНАЛ =====
@@ -836,25 +911,23 @@ async def join_chat_menu(callback: CallbackQuery, state: FSMContext):
     if not sessions:
         await callback.answer("❌ Сначала добавьте аккаунт!", show_alert=True)
         return
+    await callback.answer()
     
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         "🔗 <b>Вступление в чат/канал</b>\n\n"
         "Выберите аккаунт, с которого нужно вступить:\n\n"
         "<i>Этот аккаунт автоматически присоединится к указанной группе/каналу по ссылке.</i>",
         reply_markup=keyboards.get_join_chat_session_menu(sessions),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
-@router.callback_query(F.data.startswith("join_with_"))
-async def join_with_account(callback: CallbackQuery, state: FSMContext):
+async def join_with_account(callback: CallbackQuery, session_name: str, state: FSMContext):
     """Выбран аккаунт для вступления"""
-    session_name = callback.data.replace("join_with_", "")
-    
+    await callback.answer()
     await state.update_data(join_session_name=session_name)
     
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         "🔗 <b>Отправьте ссылку на чат/канал</b>\n\n"
         "<b>Поддерживаемые форматы:</b>\n"
         "• https://t.me/channel_name — публичный\n"
@@ -866,7 +939,21 @@ async def join_with_account(callback: CallbackQuery, state: FSMContext):
         parse_mode="HTML"
     )
     await state.set_state(JoinChatStates.enter_link)
-    await callback.answer()
+
+
+# Кнопки аккаунтов (AccountCB) - один фильтр вместо набора startswith-префиксов
+_ACCOUNT_ACTIONS: dict[str, Callable[[CallbackQuery, str, FSMContext], Awaitable[None]]] = {
+    "view": view_account,
+    "delete": delete_session_confirm,
+    "confirm": confirm_delete_session,
+    "join": join_with_account,
+}
+
+
+@router.callback_query(keyboards.AccountCB.filter(F.action.in_(frozenset(_ACCOUNT_ACTIONS))))
+async def account_callback(callback: CallbackQuery, callback_data: keyboards.AccountCB, state: FSMContext):
+    """Маршрутизация кнопок аккаунта по таблице _ACCOUNT_ACTIONS"""
+    await _ACCOUNT_ACTIONS[callback_data.action](callback, callback_data.session, state)
 
 
 @router.message(JoinChatStates.enter_link)
@@ -885,7 +972,7 @@ async def process_join_link(message: Message, state: FSMContext):
         return
     
     # Валидация ссылки
-    if not any(x in link for x in ["t.me/", "@"]):
+    if not _LINK_RE.fullmatch(link):
         await message.answer(
             "❌ <b>Неверный формат ссылки!</b>\n\n"
             "Отправьте корректную ссылку на чат/канал.",
@@ -896,7 +983,7 @@ async def process_join_link(message: Message, state: FSMContext):
     
     wait_msg = await message.answer("⏳ Вступаем в чат...")
     
-    success, msg, chat_title = await telethon_core.join_chat(session_name, link)
+    success, msg, chat_title = await _telethon_call(telethon_core.join_chat(session_name, link))
     
     await wait_msg.delete()
     
@@ -923,73 +1010,63 @@ async def process_join_link(message: Message, state: FSMContext):
 @router.callback_query(F.data == "channel_menu")
 async def show_channel_menu(callback: CallbackQuery, state: FSMContext):
     """Показать меню выбора режима парсинга каналов"""
-    await callback.message.edit_text(
+    await callback.answer()
+    await safe_edit(callback.message,
         "📊 <b>Парсинг каналов</b>\n\n"
         "Выберите режим парсинга:",
         reply_markup=keyboards.get_channel_parsing_menu(),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 @router.callback_query(F.data == "parse_channel_posts")
 async def start_parse_channel_posts(callback: CallbackQuery, state: FSMContext):
     """Начало парсинга последних постов канала"""
+    await callback.answer()
     user_id = callback.from_user.id
 
     # СТРОГАЯ проверка лимита
     limit_info = await db.check_limit(user_id)
     if not limit_info["has_limit"]:
-        await callback.message.edit_text(
-            f"❌ <b>Лимит исчерпан ({config.FREE_PARSING_LIMIT}/{config.FREE_PARSING_LIMIT})</b>\n\n"
-            "Ваши бесплатные парсинги закончились.\n\n"
-            "💡 <b>Способы получить больше:</b>\n"
-            "• Купить подписку\n"
-            f"• Пригласить друга (+{config.REFERRAL_BONUS} парсинга)",
+        await safe_edit(callback.message,
+            _LIMIT_EXCEEDED_TEXT,
             reply_markup=keyboards.get_limit_exceeded_menu_v2(),
             parse_mode="HTML"
         )
-        await callback.answer()
         return
 
     await state.update_data(parse_type="channel_posts", parsing_mode="multiple")
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         "📊 <b>Парсинг последних постов</b>\n\n"
         "Выберите временной фильтр активности:",
         reply_markup=keyboards.get_time_filter_menu(),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 @router.callback_query(F.data == "parse_channel_single")
 async def start_parse_channel_single(callback: CallbackQuery, state: FSMContext):
     """Начало парсинга конкретного поста"""
+    await callback.answer()
     user_id = callback.from_user.id
 
     # СТРОГАЯ проверка лимита
     limit_info = await db.check_limit(user_id)
     if not limit_info["has_limit"]:
-        await callback.message.edit_text(
-            f"❌ <b>Лимит исчерпан ({config.FREE_PARSING_LIMIT}/{config.FREE_PARSING_LIMIT})</b>\n\n"
-            "Ваши бесплатные парсинги закончились.\n\n"
-            "💡 <b>Способы получить больше:</b>\n"
-            "• Купить подписку\n"
-            f"• Пригласить друга (+{config.REFERRAL_BONUS} парсинга)",
+        await safe_edit(callback.message,
+            _LIMIT_EXCEEDED_TEXT,
             reply_markup=keyboards.get_limit_exceeded_menu_v2(),
             parse_mode="HTML"
         )
-        await callback.answer()
         return
 
     await state.update_data(parse_type="channel_single", parsing_mode="single")
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         "📌 <b>Парсинг конкретного поста</b>\n\n"
         "Выберите временной фильтр активности:",
         reply_markup=keyboards.get_time_filter_menu(),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 # ===== ПАРСИНГ ЧАТОВ (Обновлённый с новыми режимами) =====
@@ -997,25 +1074,21 @@ async def start_parse_channel_single(callback: CallbackQuery, state: FSMContext)
 @router.callback_query(F.data == "parse_chat")
 async def start_parse_chat(callback: CallbackQuery, state: FSMContext):
     """Начало парсинга чата - показываем выбор режима"""
+    await callback.answer()
     user_id = callback.from_user.id
 
     # СТРОГАЯ проверка лимита
     limit_info = await db.check_limit(user_id)
     if not limit_info["has_limit"]:
-        await callback.message.edit_text(
-            f"❌ <b>Лимит исчерпан ({config.FREE_PARSING_LIMIT}/{config.FREE_PARSING_LIMIT})</b>\n\n"
-            "Ваши бесплатные парсинги закончились.\n\n"
-            "💡 <b>Способы получить больше:</b>\n"
-            "• Купить подписку\n"
-            f"• Пригласить друга (+{config.REFERRAL_BONUS} парсинга)",
+        await safe_edit(callback.message,
+            _LIMIT_EXCEEDED_TEXT,
             reply_markup=keyboards.get_limit_exceeded_menu_v2(),
             parse_mode="HTML"
         )
-        await callback.answer()
         return
 
     await state.update_data(parse_type="chat")
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         "👥 <b>Парсинг чатов (группы)</b>\n\n"
         "Выберите режим парсинга:\n\n"
         "👥 <b>Участники (список)</b> — полный список членов группы\n"
@@ -1027,94 +1100,92 @@ async def start_parse_chat(callback: CallbackQuery, state: FSMContext):
         parse_mode="HTML"
     )
     await state.set_state(ParsingStates.select_chat_mode)
-    await callback.answer()
 
 
 # Выбор режима "Парсить Участников"
 @router.callback_query(F.data == "chat_mode_members", ParsingStates.select_chat_mode)
 async def chat_mode_members(callback: CallbackQuery, state: FSMContext):
     """Режим парсинга участников группы"""
+    await callback.answer()
     await state.update_data(chat_mode="members")
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         "👥 <b>Парсинг участников</b>\n\n"
         "Выберите временной фильтр:",
         reply_markup=keyboards.get_time_filter_menu(),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 # Выбор режима "Парсить Активных"
 @router.callback_query(F.data == "chat_mode_active", ParsingStates.select_chat_mode)
 async def chat_mode_active(callback: CallbackQuery, state: FSMContext):
     """Режим парсинга активных пользователей"""
+    await callback.answer()
     await state.update_data(chat_mode="active")
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         "💬 <b>Парсинг активных</b>\n\n"
         "Выберите временной фильтр:",
         reply_markup=keyboards.get_time_filter_menu(),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 # Выбор режима "Мои Чаты"
 @router.callback_query(F.data == "chat_mode_dialogs", ParsingStates.select_chat_mode)
 async def chat_mode_dialogs(callback: CallbackQuery, state: FSMContext):
     """Режим выбора из своих чатов"""
+    await callback.answer()
     user_id = callback.from_user.id
     
     # Получаем сессии пользователя
     sessions = await db.get_user_sessions(user_id)
     
     if not sessions:
-        await callback.message.edit_text(
+        await safe_edit(callback.message,
             "❌ <b>Нет добавленных аккаунтов</b>\n\n"
             "Для использования функции «Мои Чаты» нужно добавить свой Telegram аккаунт.\n\n"
             "Нажмите «Добавить аккаунт» в главном меню.",
             reply_markup=keyboards.get_back_button(),
             parse_mode="HTML"
         )
-        await callback.answer()
         return
     
     # Используем первую активную сессию
     session_name = sessions[0]["session_name"]
     await state.update_data(session_name=session_name, chat_mode="dialogs")
     
-    wait_msg = await callback.message.edit_text(
+    wait_msg = await safe_edit(callback.message,
         "⏳ Загружаем список ваших чатов...",
         parse_mode="HTML"
     )
     
     # Получаем диалоги
-    success, msg, dialogs = await telethon_core.get_user_dialogs(session_name, limit=20)
+    success, msg, dialogs = await _telethon_call(telethon_core.get_user_dialogs(session_name, limit=20))
     
     if not success or not dialogs:
-        await callback.message.edit_text(
+        await safe_edit(wait_msg,
             f"❌ <b>Не удалось загрузить чаты</b>\n\n{msg}",
             reply_markup=keyboards.get_back_button(),
             parse_mode="HTML"
         )
-        await callback.answer()
         return
     
     await state.update_data(dialogs=dialogs)
     
-    await callback.message.edit_text(
+    await safe_edit(wait_msg,
         "🔒 <b>Ваши чаты</b>\n\n"
         "Выберите чат для парсинга:",
         reply_markup=keyboards.get_dialogs_menu(dialogs),
         parse_mode="HTML"
     )
     await state.set_state(ParsingStates.select_dialog)
-    await callback.answer()
 
 
 # Выбор конкретного диалога
 @router.callback_query(F.data.startswith("dialog_"), ParsingStates.select_dialog)
 async def select_dialog_for_parsing(callback: CallbackQuery, state: FSMContext):
     """Выбран конкретный чат из списка диалогов"""
+    await callback.answer()
     chat_id = int(callback.data.replace("dialog_", ""))
     
     data = await state.get_data()
@@ -1137,7 +1208,7 @@ async def select_dialog_for_parsing(callback: CallbackQuery, state: FSMContext):
     )
     
     # Показываем меню настроек парсинга
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         f"⚙️ <b>Настройки парсинга</b>\n\n"
         f"📌 Чат: <b>{chat_title}</b>\n\n"
         f"Настройте параметры и нажмите «Начать»:",
@@ -1149,13 +1220,13 @@ async def select_dialog_for_parsing(callback: CallbackQuery, state: FSMContext):
         parse_mode="HTML"
     )
     await state.set_state(ParsingStates.parsing_settings)
-    await callback.answer()
 
 
 # Переключатели настроек
 @router.callback_query(F.data == "toggle_bio", ParsingStates.parsing_settings)
 async def toggle_bio_setting(callback: CallbackQuery, state: FSMContext):
     """Переключить парсинг био"""
+    await callback.answer()
     data = await state.get_data()
     current = data.get("parse_bio", False)
     new_value = not current
@@ -1168,7 +1239,7 @@ async def toggle_bio_setting(callback: CallbackQuery, state: FSMContext):
     if new_value:
         warning = "\n\n⚠️ <i>Парсинг био замедляет процесс (задержки 0.5-1.5 сек)</i>"
     
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         f"⚙️ <b>Настройки парсинга</b>\n\n"
         f"📌 Чат: <b>{chat_title}</b>{warning}\n\n"
         f"Настройте параметры и нажмите «Начать»:",
@@ -1179,12 +1250,12 @@ async def toggle_bio_setting(callback: CallbackQuery, state: FSMContext):
         ),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 @router.callback_query(F.data == "toggle_gender", ParsingStates.parsing_settings)
 async def toggle_gender_setting(callback: CallbackQuery, state: FSMContext):
     """Переключить определение пола"""
+    await callback.answer()
     data = await state.get_data()
     current = data.get("detect_gender", False)
     new_value = not current
@@ -1192,7 +1263,7 @@ async def toggle_gender_setting(callback: CallbackQuery, state: FSMContext):
     
     chat_title = data.get("selected_chat_title", "Чат")
     
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         f"⚙️ <b>Настройки парсинга</b>\n\n"
         f"📌 Чат: <b>{chat_title}</b>\n\n"
         f"Настройте параметры и нажмите «Начать»:",
@@ -1203,13 +1274,13 @@ async def toggle_gender_setting(callback: CallbackQuery, state: FSMContext):
         ),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 @router.callback_query(F.data == "set_limit", ParsingStates.parsing_settings)
 async def set_limit_prompt(callback: CallbackQuery, state: FSMContext):
     """Запрос ввода лимита"""
-    await callback.message.edit_text(
+    await callback.answer()
+    await safe_edit(callback.message,
         "📊 <b>Установка лимита</b>\n\n"
         "Введите количество последних постов для парсинга\n"
         "(любое число от 1 до 200):\n\n"
@@ -1223,7 +1294,6 @@ async def set_limit_prompt(callback: CallbackQuery, state: FSMContext):
     )
     
     await state.set_state(ParsingStates.enter_limit)
-    await callback.answer()
 
 
 @router.message(ParsingStates.enter_limit)
@@ -1280,6 +1350,7 @@ async def process_limit_input(message: Message, state: FSMContext):
 @router.callback_query(F.data == "start_parsing_with_settings", ParsingStates.parsing_settings)
 async def start_parsing_with_settings(callback: CallbackQuery, state: FSMContext):
     """Запуск парсинга с выбранными настройками (только для 'Мои Чаты')"""
+    await callback.answer()
     user_id = callback.from_user.id
     data = await state.get_data()
     
@@ -1299,13 +1370,12 @@ async def start_parsing_with_settings(callback: CallbackQuery, state: FSMContext
             await start_parsing(callback, state)
             return
         
-        await callback.message.edit_text(
+        await safe_edit(callback.message,
             "❌ Ошибка: сессия истекла. Начните заново из главного меню.",
             reply_markup=keyboards.get_main_menu(),
             parse_mode="HTML"
         )
         await state.clear()
-        await callback.answer()
         return
     
     if not session_name:
@@ -1313,7 +1383,12 @@ async def start_parsing_with_settings(callback: CallbackQuery, state: FSMContext
         session_name, _ = telethon_core.get_smart_session(user_id)
         await state.update_data(session_name=session_name)
     
-    progress_msg = await callback.message.edit_text(
+    limit_info = await _reserve_attempt(callback, state)
+    if limit_info is None:
+        return
+    delivered = False
+    
+    progress_msg = await safe_edit(callback.message,
         "🚀 <b>Начинаем парсинг...</b>\n\n"
         "⏳ Подготовка...",
         parse_mode="HTML"
@@ -1365,12 +1440,13 @@ async def start_parsing_with_settings(callback: CallbackQuery, state: FSMContext
                 parse_mode="HTML"
             )
             await state.clear()
-            await callback.answer()
             return
         
         # Генерируем умную выгрузку (4 файла)
         await progress_msg.edit_text("📝 Создаём отчёты...", parse_mode="HTML")
         
+        # pandas/openpyxl грузятся при первой выгрузке, а не при старте бота
+        from utils.excel_generator import excel_generator
         export_result = excel_generator.generate_smart_export(
             result,
             parse_type="chat_dialogs",
@@ -1379,9 +1455,6 @@ async def start_parsing_with_settings(callback: CallbackQuery, state: FSMContext
             include_gender=detect_gender
         )
         
-        # Уменьшаем лимит
-        await db.decrease_limit(user_id)
-        
         # Сохраняем в историю
         await db.add_parsing_history(
             user_id=user_id,
@@ -1414,8 +1487,9 @@ async def start_parsing_with_settings(callback: CallbackQuery, state: FSMContext
                     parse_mode="HTML"
                 )
         
+        delivered = True
+        
         # Итоговое сообщение
-        limit_info = await db.check_limit(user_id)
         remaining_text = ""
         if not limit_info["is_premium"]:
             remaining_text = f"\n\n💎 Осталось парсингов: <b>{limit_info['remaining']}</b>"
@@ -1449,9 +1523,11 @@ async def start_parsing_with_settings(callback: CallbackQuery, state: FSMContext
             reply_markup=keyboards.get_main_menu(),
             parse_mode="HTML"
         )
+    finally:
+        if not delivered:
+            await _refund_attempt(user_id, limit_info)
     
     await state.clear()
-    await callback.answer()
 
 
 # ===== РЕФЕРАЛЬНАЯ СИСТЕМА =====
@@ -1459,6 +1535,7 @@ async def start_parsing_with_settings(callback: CallbackQuery, state: FSMContext
 @router.callback_query(F.data == "show_referral")
 async def show_referral_menu(callback: CallbackQuery):
     """Показать реферальное меню"""
+    await callback.answer()
     user_id = callback.from_user.id
     bot_info = await callback.bot.get_me()
     ref_link = f"https://t.me/{bot_info.username}?start={user_id}"
@@ -1466,7 +1543,7 @@ async def show_referral_menu(callback: CallbackQuery):
     # Получаем статистику рефералов
     ref_stats = await db.get_referral_stats(user_id)
     
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         f"👥 <b>Реферальная программа</b>\n\n"
         f"Приглашайте друзей и получайте <b>+{config.REFERRAL_BONUS} парсинга</b> за каждого!\n\n"
         f"🔗 <b>Ваша ссылка:</b>\n"
@@ -1477,16 +1554,16 @@ async def show_referral_menu(callback: CallbackQuery):
         reply_markup=keyboards.get_referral_menu(ref_link),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 @router.callback_query(F.data == "ref_stats")
 async def show_ref_stats(callback: CallbackQuery):
     """Показать статистику рефералов"""
+    await callback.answer()
     user_id = callback.from_user.id
     ref_stats = await db.get_referral_stats(user_id)
     
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         f"📊 <b>Статистика рефералов</b>\n\n"
         f"👥 Приглашено друзей: <b>{ref_stats['invited_count']}</b>\n"
         f"🎁 Заработано парсингов: <b>+{ref_stats['total_bonus']}</b>\n\n"
@@ -1494,7 +1571,6 @@ async def show_ref_stats(callback: CallbackQuery):
         reply_markup=keyboards.get_back_button(),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 @router.callback_query(F.data == "copy_ref_link")
@@ -1522,13 +1598,14 @@ async def copy_ref_link(callback: CallbackQuery):
 @router.callback_query(F.data == "parse_active_instead")
 async def parse_active_instead(callback: CallbackQuery, state: FSMContext):
     """Переключиться на парсинг активных вместо участников"""
+    await callback.answer()
     data = await state.get_data()
     link = data.get("link")
     
     if link:
         # Если ссылка уже есть - сразу парсим активных
         await state.update_data(chat_mode="active")
-        await callback.message.edit_text(
+        await safe_edit(callback.message,
             "💬 <b>Переключаемся на парсинг активных...</b>\n\n"
             "Выберите временной фильтр:",
             reply_markup=keyboards.get_time_filter_menu(),
@@ -1537,25 +1614,25 @@ async def parse_active_instead(callback: CallbackQuery, state: FSMContext):
     else:
         # Если ссылки нет - запрашиваем
         await state.update_data(chat_mode="active")
-        await callback.message.edit_text(
+        await safe_edit(callback.message,
             "💬 <b>Парсинг активных</b>\n\n"
             "Выберите временной фильтр:",
             reply_markup=keyboards.get_time_filter_menu(),
             parse_mode="HTML"
         )
-    await callback.answer()
 
 
 # Выбор временного фильтра
 @router.callback_query(F.data.startswith("time_"))
 async def select_time_filter(callback: CallbackQuery, state: FSMContext):
     """Выбор временного фильтра -> переход к выбору аккаунта"""
+    await callback.answer()
     time_key = callback.data.split("_", 1)[1]
     
     # Обработка "За всё время" - запрос количества постов
     if time_key == "alltime":
         await state.update_data(time_filter="alltime", time_days=None)
-        await callback.message.edit_text(
+        await safe_edit(callback.message,
             "♾ <b>Парсинг за всё время</b>\n\n"
             "Введите количество последних постов для парсинга (не более 200).\n\n"
             "⚠️ <i>Учитывайте, что сервисные сообщения тоже считаются!</i>",
@@ -1563,7 +1640,6 @@ async def select_time_filter(callback: CallbackQuery, state: FSMContext):
             parse_mode="HTML"
         )
         await state.set_state(ParsingStates.enter_custom_posts)
-        await callback.answer()
         return
     
     time_days = config.TIME_FILTERS.get(time_key)
@@ -1620,13 +1696,12 @@ async def select_time_filter(callback: CallbackQuery, state: FSMContext):
             f"🕵️ {session_info}"
         )
     
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         link_prompt,
         reply_markup=keyboards.get_cancel_button(),
         parse_mode="HTML"
     )
     await state.set_state(ParsingStates.enter_link)
-    await callback.answer()
 
 
 # Обработка ввода количества постов (для "За всё время")
@@ -1701,6 +1776,7 @@ async def process_custom_posts(message: Message, state: FSMContext):
 @router.callback_query(F.data.startswith("session_"), ParsingStates.select_session)
 async def select_session(callback: CallbackQuery, state: FSMContext):
     """Выбор сессии для парсинга -> показываем опции Bio/Gender"""
+    await callback.answer()
     session_key = callback.data.replace("session_", "")
     
     if session_key == "system":
@@ -1719,7 +1795,7 @@ async def select_session(callback: CallbackQuery, state: FSMContext):
     parse_type = data.get("parse_type", "channel_posts")
 
     # Показываем меню настроек перед парсингом
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         "⚙️ <b>Настройки парсинга</b>\n\n"
         "Выберите дополнительные опции:\n\n"
         "📝 <b>Парсить Био</b> — собирать описание профиля (медленнее)\n"
@@ -1728,7 +1804,6 @@ async def select_session(callback: CallbackQuery, state: FSMContext):
         parse_mode="HTML"
     )
     await state.set_state(ParsingStates.parsing_settings)
-    await callback.answer()
 
 
 # Вспомогательная функция для формирования текста настроек
@@ -1750,6 +1825,7 @@ def _get_settings_text(link: str, is_user_session: bool, parse_bio: bool) -> str
 @router.callback_query(F.data == "toggle_bio", ParsingStates.parsing_settings)
 async def toggle_bio(callback: CallbackQuery, state: FSMContext):
     """Переключить опцию парсинга био"""
+    await callback.answer()
     data = await state.get_data()
     parse_bio = not data.get("parse_bio", False)
     detect_gender = data.get("detect_gender", False)
@@ -1758,18 +1834,18 @@ async def toggle_bio(callback: CallbackQuery, state: FSMContext):
     
     await state.update_data(parse_bio=parse_bio)
     
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         _get_settings_text(link, is_user_session, parse_bio),
         reply_markup=keyboards.get_parsing_options_menu(parse_bio, detect_gender),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 # Toggle: Определять Пол
 @router.callback_query(F.data == "toggle_gender", ParsingStates.parsing_settings)
 async def toggle_gender(callback: CallbackQuery, state: FSMContext):
     """Переключить опцию определения пола"""
+    await callback.answer()
     data = await state.get_data()
     parse_bio = data.get("parse_bio", False)
     detect_gender = not data.get("detect_gender", False)
@@ -1778,12 +1854,11 @@ async def toggle_gender(callback: CallbackQuery, state: FSMContext):
     
     await state.update_data(detect_gender=detect_gender)
     
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         _get_settings_text(link, is_user_session, parse_bio),
         reply_markup=keyboards.get_parsing_options_menu(parse_bio, detect_gender),
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
 # Ввод ссылки для парсинга -> показываем настройки
@@ -1834,18 +1909,18 @@ async def process_link_input(message: Message, state: FSMContext):
 @router.callback_query(F.data == "confirm_parsing_options", ParsingStates.parsing_settings)
 async def start_parsing(callback: CallbackQuery, state: FSMContext):
     """Запуск парсинга после подтверждения настроек"""
+    await callback.answer()
     user_id = callback.from_user.id
     data = await state.get_data()
     
     link = data.get("link")
     if not link:
-        await callback.message.edit_text(
+        await safe_edit(callback.message,
             "❌ Ссылка не найдена. Начните заново.",
             reply_markup=keyboards.get_main_menu(),
             parse_mode="HTML"
         )
         await state.clear()
-        await callback.answer()
         return
     
     parse_type = data.get("parse_type", "channel_posts")
@@ -1864,12 +1939,16 @@ async def start_parsing(callback: CallbackQuery, state: FSMContext):
     logger.info(f"[StartParsing] Link: {link}")
     logger.info(f"[StartParsing] Parse Type: {parse_type}")
 
-    progress_msg = await callback.message.edit_text(
+    limit_info = await _reserve_attempt(callback, state)
+    if limit_info is None:
+        return
+    delivered = False
+
+    progress_msg = await safe_edit(callback.message,
         "🚀 <b>Начинаем парсинг...</b>\n\n"
         "⏳ Подготовка...",
         parse_mode="HTML"
     )
-    await callback.answer()
 
     # Состояние для throttling обновлений прогресса
     last_update_time = [0.0]
@@ -2025,6 +2104,7 @@ async def start_parsing(callback: CallbackQuery, state: FSMContext):
             parse_mode="HTML"
         )
 
+        from utils.excel_generator import excel_generator
         excel_path, txt_path = excel_generator.generate_reports(
             result,
             parse_type,
@@ -2040,9 +2120,6 @@ async def start_parsing(callback: CallbackQuery, state: FSMContext):
             await state.clear()
             return
 
-        # Уменьшаем лимит
-        await db.decrease_limit(user_id)
-
         # Сохраняем в историю
         await db.add_parsing_history(
             user_id=user_id,
@@ -2074,9 +2151,9 @@ async def start_parsing(callback: CallbackQuery, state: FSMContext):
             caption="📝 <b>Список юзернеймов</b>\n\n<i>👑 Админы в самом верху файла!</i>",
             parse_mode="HTML"
         )
+        delivered = True
 
         # Итоговое сообщение
-        limit_info = await db.check_limit(user_id)
         remaining_text = ""
         if not limit_info["is_premium"]:
             remaining_text = f"\n\n💎 Осталось парсингов: <b>{limit_info['remaining']}</b>"
@@ -2113,6 +2190,9 @@ async def start_parsing(callback: CallbackQuery, state: FSMContext):
             reply_markup=keyboards.get_main_menu(),
             parse_mode="HTML"
         )
+    finally:
+        if not delivered:
+            await _refund_attempt(user_id, limit_info)
 
     await state.clear()
 
@@ -2121,9 +2201,9 @@ async def start_parsing(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "cancel")
 async def cancel_action(callback: CallbackQuery, state: FSMContext):
     """Отмена текущего действия"""
+    await callback.answer()
     await state.clear()
-    await callback.message.edit_text(
+    await safe_edit(callback.message,
         "❌ Действие отменено",
         reply_markup=keyboards.get_main_menu()
     )
-    await callback.answer()
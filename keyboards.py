@@ -5,9 +5,21 @@ Contains all inline keyboards for bot navigation
 
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
+from aiogram.filters.callback_data import CallbackData
 from typing import List, Dict, Any
+import functools
 import config
 
+# Статические клавиатуры собираются один раз и переиспользуются (lru_cache).
+# Разметку никто не модифицирует - aiogram только сериализует её в запрос
+_static_keyboard = functools.lru_cache(maxsize=None)
+
+
+class AccountCB(CallbackData, prefix="acct"):
+    """Callback-данные кнопок аккаунта: acct:<action>:<session>"""
+    action: str
+    session: str
+
 
 # ===== ПРОВЕРКА ПОДПИСКИ НА КАНАЛ =====
 
@@ -16,6 +28,7 @@ SUBSCRIPTION_CHANNEL_ID = -1002443306268
 SUBSCRIPTION_CHANNEL_LINK = "https://t.me/Novopoltsev_Pavel"
 
 
+@_static_keyboard
 def get_subscription_check_menu() -> InlineKeyboardMarkup:
     """Меню проверки подписки на канал"""
     builder = InlineKeyboardBuilder()
@@ -34,6 +47,7 @@ def get_subscription_check_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_not_subscribed_menu() -> InlineKeyboardMarkup:
     """Меню когда пользователь не подписан"""
     builder = InlineKeyboardBuilder()
@@ -52,6 +66,7 @@ def get_not_subscribed_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_main_menu() -> InlineKeyboardMarkup:
     """Главное меню бота"""
     builder = InlineKeyboardBuilder()
@@ -100,6 +115,7 @@ def get_main_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_channel_parsing_menu() -> InlineKeyboardMarkup:
     """Меню выбора режима парсинга каналов"""
     builder = InlineKeyboardBuilder()
@@ -124,6 +140,7 @@ def get_channel_parsing_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_time_filter_menu() -> InlineKeyboardMarkup:
     """Меню выбора временного фильтра"""
     builder = InlineKeyboardBuilder()
@@ -166,6 +183,7 @@ def get_time_filter_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_parsing_options_menu(parse_bio: bool = False, detect_gender: bool = False) -> InlineKeyboardMarkup:
     """Меню настроек перед вводом ссылки (toggles Bio/Gender)"""
     builder = InlineKeyboardBuilder()
@@ -242,6 +260,7 @@ def get_session_selection_menu(sessions: list) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_back_button() -> InlineKeyboardMarkup:
     """Кнопка 'Назад'"""
     builder = InlineKeyboardBuilder()
@@ -254,6 +273,7 @@ def get_back_button() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_cancel_button() -> InlineKeyboardMarkup:
     """Кнопка 'Отмена'"""
     builder = InlineKeyboardBuilder()
@@ -266,6 +286,7 @@ def get_cancel_button() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_limit_exceeded_menu() -> InlineKeyboardMarkup:
     """Меню при исчерпанном лимите"""
     builder = InlineKeyboardBuilder()
@@ -284,6 +305,7 @@ def get_limit_exceeded_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_admin_menu() -> InlineKeyboardMarkup:
     """Админ-панель"""
     builder = InlineKeyboardBuilder()
@@ -360,6 +382,7 @@ def get_admin_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_parsing_progress_menu() -> InlineKeyboardMarkup:
     """Меню во время парсинга"""
     builder = InlineKeyboardBuilder()
@@ -400,7 +423,7 @@ def get_my_accounts_menu(sessions: list) -> InlineKeyboardMarkup:
         builder.row(
             InlineKeyboardButton(
                 text=f"📱 {phone}",
-                callback_data=f"view_account_{session_name}"
+                callback_data=AccountCB(action="view", session=session_name).pack()
             )
         )
     
@@ -424,7 +447,7 @@ def get_join_chat_session_menu(sessions: list) -> InlineKeyboardMarkup:
         builder.row(
             InlineKeyboardButton(
                 text=f"📱 {masked_phone}",
-                callback_data=f"join_with_{session_name}"
+                callback_data=AccountCB(action="join", session=session_name).pack()
             )
         )
     
@@ -443,7 +466,7 @@ def get_account_actions_menu(session_name: str, phone: str) -> InlineKeyboardMar
     builder.row(
         InlineKeyboardButton(
             text="🗑 Удалить аккаунт",
-            callback_data=f"delete_session_{session_name}"
+            callback_data=AccountCB(action="delete", session=session_name).pack()
         )
     )
     builder.row(
@@ -461,7 +484,7 @@ def get_confirm_delete_menu(session_name: str) -> InlineKeyboardMarkup:
     builder.row(
         InlineKeyboardButton(
             text="✅ Да, удалить",
-            callback_data=f"confirm_delete_{session_name}"
+            callback_data=AccountCB(action="confirm", session=session_name).pack()
         )
     )
     builder.row(
@@ -473,6 +496,7 @@ def get_confirm_delete_menu(session_name: str) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_help_menu() -> InlineKeyboardMarkup:
     """Меню помощи"""
     builder = InlineKeyboardBuilder()
@@ -511,6 +535,7 @@ def get_help_menu() -> InlineKeyboardMarkup:
 
 # ===== НОВЫЕ РЕЖИМЫ ПАРСИНГА ЧАТОВ (Feature 1) =====
 
+@_static_keyboard
 def get_chat_parsing_mode_menu() -> InlineKeyboardMarkup:
     """Меню выбора режима парсинга чатов"""
     builder = InlineKeyboardBuilder()
@@ -622,6 +647,7 @@ def get_parsing_settings_menu(
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_limit_input_keyboard() -> ReplyKeyboardMarkup:
     """Reply-клавиатура для ввода лимита"""
     builder = ReplyKeyboardBuilder()
@@ -631,6 +657,7 @@ def get_limit_input_keyboard() -> ReplyKeyboardMarkup:
     return builder.as_markup(resize_keyboard=True, one_time_keyboard=True)
 
 
+@_static_keyboard
 def get_remove_keyboard():
     """Убрать Reply-клавиатуру"""
     from aiogram.types import ReplyKeyboardRemove
@@ -663,6 +690,7 @@ def get_referral_menu(ref_link: str) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_limit_exceeded_menu_v2() -> InlineKeyboardMarkup:
     """Обновлённое меню при исчерпанном лимите с реферальной ссылкой"""
     builder = InlineKeyboardBuilder()
@@ -695,6 +723,7 @@ def get_limit_exceeded_menu_v2() -> InlineKeyboardMarkup:
 
 # ===== ВЫБОР ДЛЯ СКРЫТЫХ УЧАСТНИКОВ =====
 
+@_static_keyboard
 def get_hidden_members_menu() -> InlineKeyboardMarkup:
     """Меню когда участники чата скрыты"""
     builder = InlineKeyboardBuilder()
@@ -715,6 +744,7 @@ def get_hidden_members_menu() -> InlineKeyboardMarkup:
 
 # ===== КЛАВИАТУРЫ РАССЫЛКИ (Admin Broadcast) =====
 
+@_static_keyboard
 def get_broadcast_photo_menu() -> InlineKeyboardMarkup:
     """Меню для шага 'Картинка' в рассылке"""
     builder = InlineKeyboardBuilder()
@@ -733,6 +763,7 @@ def get_broadcast_photo_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_broadcast_photo_edit_menu() -> InlineKeyboardMarkup:
     """Меню после загрузки фото"""
     builder = InlineKeyboardBuilder()
@@ -763,6 +794,7 @@ def get_broadcast_photo_edit_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_broadcast_text_menu() -> InlineKeyboardMarkup:
     """Меню для шага 'Текст' в рассылке"""
     builder = InlineKeyboardBuilder()
@@ -775,6 +807,7 @@ def get_broadcast_text_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_broadcast_text_edit_menu() -> InlineKeyboardMarkup:
     """Меню после ввода текста"""
     builder = InlineKeyboardBuilder()
@@ -799,6 +832,7 @@ def get_broadcast_text_edit_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_broadcast_button_menu() -> InlineKeyboardMarkup:
     """Меню для шага 'URL-кнопка' в рассылке"""
     builder = InlineKeyboardBuilder()
@@ -823,6 +857,7 @@ def get_broadcast_button_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_broadcast_button_input_menu() -> InlineKeyboardMarkup:
     """Меню для ввода данных кнопки"""
     builder = InlineKeyboardBuilder()
@@ -841,6 +876,7 @@ def get_broadcast_button_input_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_broadcast_button_edit_menu() -> InlineKeyboardMarkup:
     """Меню после добавления кнопки"""
     builder = InlineKeyboardBuilder()
@@ -871,6 +907,7 @@ def get_broadcast_button_edit_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_broadcast_pin_menu(pin_enabled: bool = False) -> InlineKeyboardMarkup:
     """Меню для шага 'Закрепление' в рассылке (Toggle)"""
     builder = InlineKeyboardBuilder()
@@ -896,6 +933,7 @@ def get_broadcast_pin_menu(pin_enabled: bool = False) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_broadcast_preview_menu() -> InlineKeyboardMarkup:
     """Меню предпросмотра перед отправкой"""
     builder = InlineKeyboardBuilder()
@@ -920,6 +958,7 @@ def get_broadcast_preview_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_broadcast_edit_menu() -> InlineKeyboardMarkup:
     """Меню выбора что редактировать"""
     builder = InlineKeyboardBuilder()
@@ -968,6 +1007,7 @@ def get_broadcast_url_button(text: str, url: str) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_static_keyboard
 def get_broadcast_confirm_cancel_menu() -> InlineKeyboardMarkup:
     """Подтверждение отмены рассылки"""
     builder = InlineKeyboardBuilder()
@@ -11,12 +11,20 @@ from datetime import datetime, time as dt_time
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 
 import config
 from database import db
 from handlers import user_handlers, admin_handlers
+from handlers.middlewares import CallbackThrottleMiddleware
+from services.broadcast_worker import broadcast_worker
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Настройка логирования
 logging.basicConfig(
@@ -64,7 +72,7 @@ async def daily_backup_task():
             await asyncio.sleep(3600)  # Подождать час при ошибке
 
 
-async def on_startup():
+async def on_startup(bot: Bot):
     """Действия при запуске бота"""
     logger.info("Starting NeuroScraper Pro Bot...")
 
@@ -73,7 +81,7 @@ async def on_startup():
     logger.info("Database initialized")
 
     # Создание директорий
-    config.SESSIONS_DIR.mkdir(exist_ok=True)
+    config.sessions_dir()
     Path("reports").mkdir(exist_ok=True)
     Path("backups").mkdir(exist_ok=True)
     logger.info("Directories created")
@@ -83,6 +91,9 @@ async def on_startup():
     _background_tasks.add(backup_task)
     backup_task.add_done_callback(_background_tasks.discard)
 
+    # Воркер рассылок (очередь + ограничение частоты отправки)
+    broadcast_worker.start(bot)
+
     logger.info("Bot started successfully!")
 
 
@@ -93,6 +104,7 @@ async def on_shutdown():
     # Отменяем фоновые задачи
     for task in _background_tasks:
         task.cancel()
+    await broadcast_worker.stop()
     
     # Закрываем соединение с БД
     await db.close()
@@ -103,9 +115,19 @@ async def on_shutdown():
 async def main():
     """Главная функция запуска бота"""
 
+    # Ответы Bot API разбираются (а запросы собираются) через orjson, если он установлен:
+    # каждый update и каждая отправка проходят через JSON
+    session = None
+    if orjson is not None:
+        session = AiohttpSession(
+            json_loads=orjson.loads,
+            json_dumps=lambda obj: orjson.dumps(obj).decode()
+        )
+
     # Создание бота и диспетчера
     bot = Bot(
         token=config.BOT_TOKEN,
+        session=session,
         default=DefaultBotProperties(
             parse_mode=ParseMode.HTML
         )
@@ -115,6 +137,9 @@ async def main():
     storage = MemoryStorage()
     dp = Dispatcher(storage=storage)
 
+    # Дубликаты нажатий отсекаются до фильтров и хэндлеров всех роутеров
+    dp.callback_query.outer_middleware(CallbackThrottleMiddleware())
+
     # Регистрация роутеров (admin первый - приоритет для админских команд)
     dp.include_router(admin_handlers.router)
     dp.include_router(user_handlers.router)
@@ -0,0 +1,431 @@
+"""
+Broadcast Worker Service
+Sends broadcast messages from a background queue within Telegram rate limits
+"""
+
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass, asdict
+from typing import Iterable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramRetryAfter
+)
+
+import config
+import keyboards
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Глобальный лимит Telegram на исходящие сообщения бота (~30 в секунду)
+BROADCAST_RATE = 30
+# Сколько отправок держать "в полёте" одновременно: сетевые задержки перекрываются,
+# а общую частоту по-прежнему держит TokenBucket
+SEND_CONCURRENCY = 30
+# Статус рассылки у админа обновляется не чаще раза в N секунд:
+# Telegram ограничивает правки сообщений в одном чате (~1 в секунду)
+PROGRESS_INTERVAL = 1.0
+# ...и не чаще, чем раз в N отправок: N растёт с размером рассылки (1/50 от числа получателей),
+# маленькие рассылки почти не правят статус и сразу получают итоговый отчёт
+PROGRESS_MIN_STEP = 10
+PROGRESS_STEPS = 50
+# Сколько раз повторять отправку одному пользователю после RetryAfter
+MAX_RETRY_AFTER_ATTEMPTS = 3
+# Результаты отправки пишутся в broadcast_targets пачками по N: после падения
+# бота повторно уйдут не больше N последних сообщений
+STATUS_FLUSH_SIZE = 100
+
+# Статусы получателя в broadcast_targets
+STATUS_OK = "ok"
+STATUS_BLOCKED = "blocked"
+STATUS_ERROR = "error"
+
+# Ошибка Telegram API -> статус получателя (по точному типу, остальные - STATUS_ERROR)
+_ERROR_STATUS = {
+    TelegramForbiddenError: STATUS_BLOCKED,  # Бот заблокирован пользователем
+    TelegramNotFound: STATUS_BLOCKED,        # Чат не найден
+}
+
+_PROGRESS_TEMPLATE = (
+    "🚀 <b>Рассылка в процессе...</b>\n\n"
+    "👥 Получателей: {total}\n"
+    "⏳ Прогресс: {done}/{total} ({percent}%)\n\n"
+    "✅ Успешно: {success}\n"
+    "🚫 Заблокировали: {blocked}\n"
+    "⚠️ Ошибки: {errors}"
+)
+
+
+class TokenBucket:
+    """Ограничитель частоты: не больше rate операций в секунду, всплеск до capacity"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Дождаться и забрать один токен"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class BroadcastJob:
+    """Задание на рассылку (всё, что нужно воркеру, без FSM).
+    Получатели хранятся в БД (broadcast_targets), а не в задании"""
+    job_id: str
+    admin_chat_id: int              # Чат админа со статусным сообщением
+    status_message_id: int          # Сообщение, в котором показываем прогресс
+    mode: str                       # "all" или "ids"
+    total_count: int
+    text: str
+    photo_id: Optional[str] = None
+    button_text: Optional[str] = None
+    button_url: Optional[str] = None
+    pin_enabled: bool = False
+
+
+@dataclass
+class BroadcastStats:
+    """Счётчики результатов рассылки"""
+    success: int = 0
+    blocked: int = 0
+    errors: int = 0
+
+    def add(self, status: str, count: int = 1):
+        """Учесть результат отправки (статус из broadcast_targets)"""
+        if status == STATUS_OK:
+            self.success += count
+        elif status == STATUS_BLOCKED:
+            self.blocked += count
+        elif status == STATUS_ERROR:
+            self.errors += count
+
+
+class BroadcastWorker:
+    """Фоновый потребитель очереди рассылок: задания выполняются по одному,
+    отправки внутри задания - параллельно (до SEND_CONCURRENCY)"""
+
+    def __init__(self, rate: float = BROADCAST_RATE):
+        self._bucket = TokenBucket(rate=rate, capacity=int(rate))
+        self._send_sem = asyncio.Semaphore(SEND_CONCURRENCY)
+        self._queue: asyncio.Queue[BroadcastJob] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._bot: Optional[Bot] = None
+        self._current: Optional[BroadcastJob] = None
+        self._current_task: Optional[asyncio.Task] = None
+        self._cancelled_job_id: Optional[str] = None  # Отменена админом, а не остановкой бота
+
+    def start(self, bot: Bot):
+        """Запустить воркер (вызывается при старте бота)"""
+        if self._task is None or self._task.done():
+            self._bot = bot
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить воркер; незавершённые задания продолжатся после перезапуска"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, job: BroadcastJob, target_ids: Optional[Iterable[int]] = None) -> int:
+        """
+        Сохранить рассылку в БД и поставить в очередь, вернуть число заданий перед ней.
+        target_ids=None - все пользователи на момент постановки
+        """
+        payload = json.dumps(asdict(job), ensure_ascii=False)
+        await db.create_broadcast_job(job.job_id, payload, target_ids)
+        return self.enqueue(job)
+
+    def enqueue(self, job: BroadcastJob) -> int:
+        """Поставить сохранённую рассылку в очередь, вернуть число заданий перед ней"""
+        ahead = self._queue.qsize() + (self._current is not None)
+        self._queue.put_nowait(job)
+        return ahead
+
+    async def _resume_jobs(self):
+        """Вернуть в очередь рассылки, прерванные остановкой бота"""
+        try:
+            rows = await db.get_broadcast_jobs()
+        except Exception as e:
+            logger.error(f"Failed to load unfinished broadcasts: {e}")
+            return
+        for row in rows:
+            try:
+                job = BroadcastJob(**json.loads(row["payload"]))
+            except (ValueError, TypeError) as e:
+                logger.error(f"Broadcast {row['job_id']}: broken payload, dropped: {e}")
+                await db.delete_broadcast_job(row["job_id"])
+                continue
+            self.enqueue(job)
+            logger.info(f"Broadcast {job.job_id} resumed after restart")
+
+    def cancel_current(self) -> Optional[str]:
+        """Остановить текущую рассылку, вернуть её job_id (None - рассылок нет)"""
+        if self._current is None or self._current_task is None or self._current_task.done():
+            return None
+        self._cancelled_job_id = self._current.job_id
+        self._current_task.cancel()
+        return self._current.job_id
+
+    async def _run(self):
+        await self._resume_jobs()
+        while True:
+            job = await self._queue.get()
+            self._current = job
+            # Задание - отдельная задача, чтобы его можно было отменить, не останавливая воркер
+            self._current_task = asyncio.create_task(self._process(job))
+            try:
+                await self._current_task
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise  # Останавливается сам воркер
+                logger.info(f"Broadcast {job.job_id} cancelled")
+            except Exception as e:
+                logger.error(f"Broadcast {job.job_id} failed: {e}", exc_info=True)
+            finally:
+                self._current = None
+                self._current_task = None
+                self._cancelled_job_id = None
+                self._queue.task_done()
+
+    async def _build_send(self, job: BroadcastJob):
+        """
+        Метод отправки и общие для всех получателей аргументы - один раз на задание.
+        Фото публикуется один раз в служебном чате и дальше копируется (copyMessage):
+        Telegram не перепроверяет медиа для каждого получателя.
+        Возвращает (метод, аргументы, ID подготовленного сообщения или None)
+        """
+        reply_markup = None
+        if job.button_text and job.button_url:
+            reply_markup = keyboards.get_broadcast_url_button(job.button_text, job.button_url)
+
+        if job.photo_id:
+            try:
+                staged = await self._bot.send_photo(
+                    chat_id=config.SCRATCH_CHAT_ID,
+                    photo=job.photo_id,
+                    caption=job.text,
+                    disable_notification=True
+                )
+            except Exception as e:
+                logger.warning(f"Broadcast {job.job_id}: failed to stage photo, sending directly: {e}")
+                return self._bot.send_photo, {
+                    "photo": job.photo_id,
+                    "caption": job.text,
+                    "reply_markup": reply_markup
+                }, None
+            return self._bot.copy_message, {
+                "from_chat_id": config.SCRATCH_CHAT_ID,
+                "message_id": staged.message_id,
+                "reply_markup": reply_markup
+            }, staged.message_id
+
+        return self._bot.send_message, {
+            "text": job.text,
+            "reply_markup": reply_markup
+        }, None
+
+    async def _send_one(self, job: BroadcastJob, user_id: int, send, send_kwargs: dict) -> str:
+        """Отправить сообщение одному получателю с учётом лимита и RetryAfter, вернуть статус"""
+        bot = self._bot
+        for attempt in range(MAX_RETRY_AFTER_ATTEMPTS + 1):
+            await self._bucket.acquire()
+            try:
+                sent_msg = await send(chat_id=user_id, **send_kwargs)
+
+                # Закрепляем если нужно
+                if job.pin_enabled:
+                    try:
+                        await bot.pin_chat_message(
+                            chat_id=user_id,
+                            message_id=sent_msg.message_id,
+                            disable_notification=True
+                        )
+                    except Exception:
+                        pass  # Игнорируем ошибки закрепления
+
+                return STATUS_OK
+
+            except TelegramRetryAfter as e:
+                # Сервер сам говорит, сколько ждать - ждём и повторяем
+                if attempt == MAX_RETRY_AFTER_ATTEMPTS:
+                    logger.warning(f"Broadcast error for user {user_id}: {e}")
+                    return STATUS_ERROR
+                await asyncio.sleep(e.retry_after)
+            except TelegramAPIError as e:
+                status = _ERROR_STATUS.get(type(e), STATUS_ERROR)
+                if status == STATUS_ERROR:
+                    logger.warning(f"Broadcast error for user {user_id}: {e}")
+                return status
+            except Exception as e:
+                logger.error(f"Unexpected broadcast error for user {user_id}: {e}")
+                return STATUS_ERROR
+
+    @staticmethod
+    def _progress_text(job: BroadcastJob, done: int, stats: BroadcastStats) -> str:
+        # Пользователи могли добавиться во время рассылки - не выходим за 100%
+        total = job.total_count
+        return _PROGRESS_TEMPLATE.format(
+            total=total,
+            done=done,
+            percent=min(100, done * 100 // total),
+            success=stats.success,
+            blocked=stats.blocked,
+            errors=stats.errors
+        )
+
+    async def _show_progress(self, job: BroadcastJob, text: str):
+        try:
+            await self._bot.edit_message_text(
+                chat_id=job.admin_chat_id,
+                message_id=job.status_message_id,
+                text=text
+            )
+        except Exception:
+            pass  # Игнорируем ошибки обновления статуса
+
+    async def _process(self, job: BroadcastJob):
+        """Выполнить одну рассылку и отчитаться админу"""
+        # Клавиатура и остальные аргументы собираются до цикла и переиспользуются
+        # для каждого получателя - в цикле меняется только chat_id
+        send, send_kwargs, staged_id = await self._build_send(job)
+
+        # Получатели зафиксированы в БД при постановке; после перезапуска
+        # продолжаем с уже набранными счётчиками
+        progress = await db.get_broadcast_progress(job.job_id)
+        job.total_count = sum(progress.values())
+        stats = BroadcastStats()
+        for status, count in progress.items():
+            stats.add(status, count)
+        start_time = time.time()
+
+        done = stats.success + stats.blocked + stats.errors
+        results: list[tuple[str, int]] = []
+        edit_every = max(PROGRESS_MIN_STEP, job.total_count // PROGRESS_STEPS)
+        next_edit_done = done + edit_every
+        last_edit = 0.0
+        last_text = None
+        editing = False
+
+        async def flush_results():
+            nonlocal results
+            if results:
+                batch, results = results, []
+                await db.set_broadcast_statuses(job.job_id, batch)
+
+        async def send_and_count(user_id: int):
+            nonlocal done, next_edit_done, last_edit, last_text, editing
+            try:
+                status = await self._send_one(job, user_id, send, send_kwargs)
+            finally:
+                self._send_sem.release()
+            stats.add(status)
+            results.append((status, user_id))
+            done += 1
+            if len(results) >= STATUS_FLUSH_SIZE:
+                await flush_results()
+
+            # Прогресс - не чаще раза в edit_every отправок и раз в PROGRESS_INTERVAL;
+            # одна правка за раз и без повтора того же текста
+            # (Telegram отвечает "message is not modified")
+            if editing or done < next_edit_done:
+                return
+            now = time.monotonic()
+            if now - last_edit < PROGRESS_INTERVAL:
+                return
+            next_edit_done = done + edit_every
+            text = self._progress_text(job, done, stats)
+            if text == last_text:
+                return
+            editing = True
+            last_edit = now
+            try:
+                await self._show_progress(job, text)
+                last_text = text
+            finally:
+                editing = False
+
+        # Скользящее окно: слот семафора занимается до создания задачи, поэтому в полёте
+        # не больше SEND_CONCURRENCY отправок, а медленный получатель (например, после
+        # RetryAfter) не задерживает остальных
+        pending: set[asyncio.Task] = set()
+        try:
+            async for user_id in db.iter_broadcast_targets(job.job_id):
+                await self._send_sem.acquire()
+                task = asyncio.create_task(send_and_count(user_id))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        except asyncio.CancelledError:
+            for task in pending:
+                task.cancel()
+            # При остановке бота задание остаётся в БД и продолжится после перезапуска
+            if self._cancelled_job_id == job.job_id:
+                await db.delete_broadcast_job(job.job_id)
+                await self._report(job, stats, start_time, "⛔ <b>Рассылка остановлена</b>")
+            raise
+        finally:
+            # Отмеченные отправки не повторятся при возобновлении
+            await flush_results()
+            if staged_id is not None:
+                try:
+                    await self._bot.delete_message(chat_id=config.SCRATCH_CHAT_ID, message_id=staged_id)
+                except Exception:
+                    pass  # Подготовленное сообщение можно удалить и вручную
+
+        await db.delete_broadcast_job(job.job_id)
+
+        await self._report(job, stats, start_time, "📊 <b>Рассылка завершена!</b>")
+
+    async def _report(self, job: BroadcastJob, stats: BroadcastStats, start_time: float, title: str):
+        """Финальный отчёт админу"""
+        # Расчёт времени
+        elapsed_time = round(time.time() - start_time, 1)
+
+        try:
+            await self._bot.edit_message_text(
+                chat_id=job.admin_chat_id,
+                message_id=job.status_message_id,
+                text=(
+                    f"{title}\n\n"
+                    f"✅ Успешно доставлено: {stats.success}\n"
+                    f"🚫 Бот заблокирован: {stats.blocked}\n"
+                    f"⚠️ Ошибки: {stats.errors}\n"
+                    f"⏱ Время выполнения: {elapsed_time} сек"
+                ),
+                reply_markup=keyboards.get_admin_menu()
+            )
+        except Exception as e:
+            logger.warning(f"Broadcast {job.job_id}: failed to send report: {e}")
+
+        logger.info(
+            f"Broadcast {job.job_id} finished: success={stats.success}, blocked={stats.blocked}, "
+            f"errors={stats.errors}, time={elapsed_time}s"
+        )
+
+
+# Глобальный экземпляр воркера
+broadcast_worker = BroadcastWorker()
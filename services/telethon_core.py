@@ -7,7 +7,7 @@ import asyncio
 import logging
 import random
 import functools
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
 from pathlib import Path
 from typing import Optional, Dict, List, Any, Tuple, Callable
 from dataclasses import dataclass, field
@@ -142,7 +142,7 @@ class TelethonCore:
         phone: Optional[str] = None
     ) -> TelegramClient:
         """Создать и инициализировать клиента Telethon"""
-        session_path = config.SESSIONS_DIR / f"{session_name}.session"
+        session_path = config.sessions_dir() / f"{session_name}.session"
 
         client = TelegramClient(
             str(session_path),
@@ -382,9 +382,7 @@ class TelethonCore:
             logger.info(f"Parsing channel: {result.target_title}")
 
             # Время фильтра
-            cutoff_date = None
-            if time_filter_days:
-                cutoff_date = datetime.now(timezone.utc) - timedelta(days=time_filter_days)
+            cutoff_date = config.cutoff_for(time_filter_days) if time_filter_days else None
 
             users_dict: Dict[int, ParsedUser] = {}
             admins_dict: Dict[int, ParsedUser] = {}
@@ -741,9 +739,7 @@ class TelethonCore:
             logger.info(f"Parsing chat: {result.target_title}")
 
             # Время фильтра
-            cutoff_date = None
-            if time_filter_days:
-                cutoff_date = datetime.now(timezone.utc) - timedelta(days=time_filter_days)
+            cutoff_date = config.cutoff_for(time_filter_days) if time_filter_days else None
 
             users_dict: Dict[int, ParsedUser] = {}
             admins_dict: Dict[int, ParsedUser] = {}
@@ -0,0 +1,49 @@
+"""
+.env File Parser
+The single .env reader shared by config.py, build_env_cache.py and auth.py
+"""
+
+import os
+import re
+from pathlib import Path
+from typing import Dict
+
+# Комментарий в конце строки: "#" в начале значения или после пробела ("KEY=value # comment")
+_INLINE_COMMENT = re.compile(r"(?:^|\s+)#.*$")
+
+
+def parse_env(path: Path) -> Dict[str, str]:
+    """
+    Разобрать .env: строки KEY=VALUE, комментарии через #.
+    Понимает префикс "export ", значения в кавычках и комментарии в конце строки
+    ("KEY=value # comment"). Строки без "=" пропускаются.
+    """
+    values = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] == "#":
+                continue
+            if line.startswith("export "):
+                line = line[len("export "):].lstrip()
+            key, sep, value = line.partition("=")
+            key = key.strip()
+            if not sep or not key:
+                continue
+            value = value.strip()
+            if value[:1] in ("\"", "'"):
+                # Значение в кавычках - до парной кавычки, остальное (комментарий) отбрасываем
+                end = value.find(value[0], 1)
+                value = value[1:end] if end != -1 else value[1:]
+            else:
+                value = _INLINE_COMMENT.sub("", value)
+            values[key] = value
+    return values
+
+
+def load_env(path: Path) -> None:
+    """Загрузить .env в os.environ, не перезаписывая уже заданные переменные"""
+    if not path.exists():
+        return  # .env не обязателен - переменные могут прийти из окружения
+    for key, value in parse_env(path).items():
+        os.environ.setdefault(key, value)